@@ -5,6 +5,10 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
+
+The chart and analytics JSON endpoints are async views, so under an ASGI
+server (e.g. ``uvicorn expense_tracker.asgi:application``) concurrent
+dashboard loads share a worker instead of each holding a thread.
 """
 
 import os
@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 
 import os
 from pathlib import Path
+
+import django
 from config import SECRET_KEY, EMAIL_BACKEND, EMAIL_HOST, EMAIL_PORT, EMAIL_USE_TLS, EMAIL_HOST_USER, EMAIL_HOST_PASSWORD
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -54,9 +56,25 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'expenses.middleware.PerformanceMiddleware',
     'expenses.middleware.AlreadyLoggedMiddleware',
 ]
 
+# Request instrumentation (expenses.middleware.PerformanceMiddleware)
+# Maximum SQL queries per URL name; 'log' a warning or 'raise' when exceeded
+PERFORMANCE_QUERY_BUDGETS = {
+    'home': 10,
+    'event_details': 15,
+    'members': 10,
+    'expense_audit_trail': 15,
+    'generate_report': 15,
+    'settlement': 25,
+    'api_event_expenses': 6,
+}
+PERFORMANCE_BUDGET_ACTION = 'log'
+# Samples kept per URL name for the performance_stats endpoint
+PERFORMANCE_HISTORY_SIZE = 500
+
 ROOT_URLCONF = 'expense_tracker.urls'
 
 TEMPLATES = [
@@ -70,6 +88,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'expenses.preferences.user_preferences',
             ],
         },
     },
@@ -81,13 +100,134 @@ WSGI_APPLICATION = 'expense_tracker.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
-DATABASES = {
+# DATABASE_PROFILE selects the backend: 'sqlite' (default) or 'postgres'.
+# SQLite runs in WAL mode (see SQLITE_PRAGMAS) so readers never block the single
+# writer and concurrent writers wait on busy_timeout instead of failing with
+# "database is locked". Postgres takes connections from an in-process
+# psycopg_pool pool with health checks: Django's own pool on 5.1+, the
+# expenses.postgresql backend on 5.0 (needs psycopg and psycopg-pool).
+# Compare the two with the benchmark_concurrent_writes command.
+
+DATABASE_PROFILE = os.environ.get('DATABASE_PROFILE', 'sqlite')
+
+if DATABASE_PROFILE == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('POSTGRES_DB', 'expense_tracker'),
+            'USER': os.environ.get('POSTGRES_USER', 'expense_tracker'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+            'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+            # Pooled connections are returned after each request, so
+            # persistent connections are off
+            'CONN_MAX_AGE': 0,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {},
+        }
+    }
+    POSTGRES_POOL = {
+        'min_size': int(os.environ.get('POSTGRES_POOL_MIN_SIZE', 2)),
+        'max_size': int(os.environ.get('POSTGRES_POOL_MAX_SIZE', 10)),
+        'timeout': 10,
+    }
+    if django.VERSION >= (5, 1):
+        DATABASES['default']['OPTIONS']['pool'] = POSTGRES_POOL
+    else:
+        DATABASES['default']['ENGINE'] = 'expenses.postgresql'
+        DATABASES['default']['POOL'] = POSTGRES_POOL
+else:
+    DATABASES = {
+        'default': {
+            # Transactions take the write lock up front (BEGIN IMMEDIATE), see expenses/sqlite3/base.py
+            'ENGINE': 'expenses.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'OPTIONS': {
+                # Seconds the sqlite3 module waits for a lock before raising
+                'timeout': 20,
+            },
+        }
+    }
+    if django.VERSION >= (5, 1):
+        DATABASES['default']['ENGINE'] = 'django.db.backends.sqlite3'
+        DATABASES['default']['OPTIONS']['transaction_mode'] = 'IMMEDIATE'
+
+# Applied to every new SQLite connection by expenses.db.configure_sqlite
+# (in order; busy_timeout comes first so switching to WAL also waits for locks)
+SQLITE_PRAGMAS = {
+    'busy_timeout': 20000,  # Milliseconds
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',  # Safe with WAL: a crash can only lose the last commits, never corrupt
+    'cache_size': -64000,  # Negative values are KiB, so 64 MB of page cache
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+# Caching
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+# Local memory (LRU) by default; set ANALYTICS_CACHE_DIR to keep the per-user
+# analytics rollups in a file-based cache shared by every worker instead.
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'expense-tracker',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+}
+
+if os.environ.get('ANALYTICS_CACHE_DIR'):
+    CACHES['analytics'] = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ['ANALYTICS_CACHE_DIR'],
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    }
+else:
+    CACHES['analytics'] = {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'expense-tracker-analytics',
+        'OPTIONS': {'MAX_ENTRIES': 1000},
     }
+
+# {% cache %} fragments in base.html (navbar, logout modal, footer)
+CACHES['template_fragments'] = {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    'LOCATION': 'expense-tracker-fragments',
+    'OPTIONS': {'MAX_ENTRIES': 5000},
+}
+
+# Per-user analytics versions must be seen by every worker, or a write handled
+# by one leaves the others serving stale rollups: they live in the database
+# cache table. One row per user, never expiring; MAX_ENTRIES is set well
+# above the user count so culling never drops a live version (that would
+# force a rollup recompute and a new ETag).
+#
+# Deploy: the table must exist before the first expense write, or
+# bump_analytics_version fails in on_commit after every write. `migrate`
+# creates it (expenses.analytics.create_version_table_after_migrate); on a
+# database that is not migrated, run `python manage.py createcachetable`.
+CACHES['analytics_versions'] = {
+    'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+    'LOCATION': 'expenses_analytics_versions',
+    'OPTIONS': {'MAX_ENTRIES': 1_000_000},
 }
 
+ANALYTICS_CACHE_ALIAS = 'analytics'
+ANALYTICS_VERSION_CACHE_ALIAS = 'analytics_versions'
+ANALYTICS_CACHE_TIMEOUT = 24 * 60 * 60  # Rollups are also invalidated on every write
+
+# PDF reports (expenses.reports)
+# Rendered by an in-process thread pool; 0 workers renders in the request instead
+REPORT_PDF_WORKERS = 2
+REPORT_PDF_DIR = BASE_DIR / 'report_cache'
+
+# Currency conversion (expenses.currency)
+# ExchangeRate rows are quoted in FX_QUOTE_CURRENCY; lookups are LRU-cached per
+# process for up to FX_RATE_CACHE_TTL seconds
+FX_QUOTE_CURRENCY = 'INR'
+FX_RATE_CACHE_SIZE = 4096
+FX_RATE_CACHE_TTL = 300
+
 # Email Validation
 
 EMAIL_BACKEND = EMAIL_BACKEND
@@ -97,6 +237,20 @@ EMAIL_USE_TLS = EMAIL_USE_TLS # Use TLS (True for port 587, False for port 465)
 EMAIL_HOST_USER = EMAIL_HOST_USER # Replace with your email address
 EMAIL_HOST_PASSWORD = EMAIL_HOST_PASSWORD # Replace with your email password
 
+# Outbound mail queue (expenses.mailqueue)
+# Views only queue mail; it is delivered through MAIL_QUEUE_BACKEND by a sender
+# thread (or the send_queued_mail command when MAIL_QUEUE_SENDER_THREAD is off).
+# For local testing set MAIL_QUEUE_BACKEND to
+# 'django.core.mail.backends.console.EmailBackend' or
+# 'django.core.mail.backends.filebased.EmailBackend' (writes to EMAIL_FILE_PATH).
+MAIL_QUEUE_BACKEND = os.environ.get('MAIL_QUEUE_BACKEND', EMAIL_BACKEND)
+EMAIL_FILE_PATH = os.environ.get('EMAIL_FILE_PATH', BASE_DIR / 'sent_emails')
+MAIL_QUEUE_SENDER_THREAD = True
+MAIL_QUEUE_BATCH_SIZE = 50
+MAIL_QUEUE_MAX_ATTEMPTS = 5
+MAIL_QUEUE_RETRY_DELAY = 60  # Seconds before the first retry, doubled on each attempt
+MAIL_QUEUE_POLL_INTERVAL = 30  # Seconds between checks for deferred retries
+
 #Logged user prevention
 LOGIN_REDIRECT_URL = '/'
 #LOGIN_URL = 'login'
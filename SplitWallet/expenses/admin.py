@@ -1,10 +1,193 @@
-from django.contrib import admin
-from .models import Event, Member, Expense, UserPreferences, Transaction
+from django import forms
+from django.contrib import admin, messages
+from django.db import transaction
+from .models import Event, Member, Expense, UserPreferences, Transaction, ReportJob, OutboundEmail, ExchangeRate, ExpenseShare
+from .currency import convert, ExchangeRateMissing
+from .splits import compute_shares, update_shares, SplitError
+from .totals import ledger_entries, expense_changed, expenses_changed
 
 # Register your models here.
-   
+#
+# Admin writes to expenses, their contributors and shares, and members go
+# through the same ledger hooks as the views (expenses.totals.expense_changed
+# / expenses_changed), so the running totals and member ledger stay in step.
+
+
+class ExpenseShareAdminForm(forms.ModelForm):
+    class Meta:
+        model = ExpenseShare
+        fields = ['expense', 'member', 'weight', 'fixed_amount']
+
+    def clean(self):
+        cleaned_data = super().clean()
+        # expense and member are read-only (not in the form) once the row exists
+        expense = cleaned_data.get('expense') or (self.instance.expense if self.instance.pk else None)
+        member = cleaned_data.get('member') or (self.instance.member if self.instance.pk else None)
+        if expense is None or member is None:
+            return cleaned_data
+        if member.event_id != expense.event_id:
+            raise forms.ValidationError("The member must belong to the expense's event.")
+
+        # Split the expense with this row in place of the stored one
+        rows = {row.member_id: (row.weight, row.fixed_amount) for row in expense.shares.exclude(pk=self.instance.pk)}
+        rows[member.id] = (cleaned_data.get('weight') or 0, cleaned_data.get('fixed_amount'))
+        try:
+            compute_shares(expense.amount, expense.base_amount, [rows[member_id] for member_id in sorted(rows)])
+        except SplitError as error:
+            raise forms.ValidationError(str(error))
+        return cleaned_data
+
+
+class ExpenseShareAdmin(admin.ModelAdmin):
+    # Weights and fixed amounts are edited here; every save re-splits the
+    # expense and moves the ledger by the difference, like edit_expense
+    form = ExpenseShareAdminForm
+    list_display = ('expense', 'member', 'weight', 'fixed_amount', 'share')
+    readonly_fields = ('share',)
+
+    def get_readonly_fields(self, request, obj=None):
+        # Moving a row to another expense would need two re-splits
+        if obj is not None:
+            return ('expense', 'member', 'share')
+        return self.readonly_fields
+
+    def save_model(self, request, obj, form, change):
+        with transaction.atomic():
+            before = ledger_entries([obj.expense_id])
+            super().save_model(request, obj, form, change)
+            update_shares([obj.expense_id])
+            expense_changed(obj.expense.event, before, ledger_entries([obj.expense_id]))
+
+    def delete_model(self, request, obj):
+        self.delete_queryset(request, ExpenseShare.objects.filter(pk=obj.pk))
+
+    def delete_queryset(self, request, queryset):
+        try:
+            with transaction.atomic():
+                expenses = Expense.objects.filter(id__in=queryset.values('expense_id')).select_related('event')
+                before = {expense.id: ledger_entries([expense.id]) for expense in expenses}
+                super().delete_queryset(request, queryset)
+                update_shares(list(before))
+                for expense in expenses:
+                    expense_changed(expense.event, before[expense.id], ledger_entries([expense.id]))
+        except SplitError as error:
+            # e.g. the remaining contributors all have fixed amounts that no longer add up
+            self.message_user(request, f"Nothing was deleted: {error}", messages.ERROR)
+
+
+class ExpenseAdminForm(forms.ModelForm):
+    class Meta:
+        model = Expense
+        exclude = ['base_amount']
+
+    def clean(self):
+        cleaned_data = super().clean()
+        event = cleaned_data.get('event')
+        amount = cleaned_data.get('amount')
+        if event is None or amount is None:
+            return cleaned_data
+        # Same checks as ExpenseForm and the split engine, before anything is written
+        if cleaned_data.get('currency') and cleaned_data.get('date'):
+            try:
+                convert(amount, cleaned_data['currency'], event.base_currency, cleaned_data['date'])
+            except ExchangeRateMissing as error:
+                self.add_error('currency', str(error))
+        return cleaned_data
+
+
+class ExpenseShareInlineFormSet(forms.BaseInlineFormSet):
+    def clean(self):
+        super().clean()
+        if any(self.errors):
+            return
+        # The expense's contributors as they will be saved, split with its new amount
+        rows = {}
+        for form in self.forms:
+            member = form.cleaned_data.get('member')
+            if member is None or form.cleaned_data.get('DELETE'):
+                continue
+            if member.event_id != self.instance.event_id:
+                raise forms.ValidationError(f'{member.name} is not a member of this expense\'s event.')
+            rows[member.id] = (form.cleaned_data.get('weight') or 0, form.cleaned_data.get('fixed_amount'))
+        try:
+            compute_shares(self.instance.amount, self.instance.amount, [rows[member_id] for member_id in sorted(rows)])
+        except SplitError as error:
+            raise forms.ValidationError(str(error))
+
+
+class ExpenseShareInline(admin.TabularInline):
+    # Contributors: the M2M itself isn't editable in the admin (custom through model)
+    model = ExpenseShare
+    formset = ExpenseShareInlineFormSet
+    fields = ('member', 'weight', 'fixed_amount', 'share')
+    readonly_fields = ('share',)
+    extra = 0
+
+
+class ExpenseAdmin(admin.ModelAdmin):
+    # Contributors are saved with the inlines, after save_model, so the
+    # shares and ledger are settled in save_related
+    form = ExpenseAdminForm
+    inlines = [ExpenseShareInline]
+    readonly_fields = ('base_amount',)
+
+    def save_model(self, request, obj, form, change):
+        if change:
+            previous = Expense.objects.select_related('event').get(pk=obj.pk)
+            obj.ledger_before = (previous.event, ledger_entries([obj.pk]))
+        else:
+            obj.ledger_before = (obj.event, ledger_entries([]))
+        super().save_model(request, obj, form, change)
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        expense = form.instance
+        update_shares([expense.id])
+        previous_event, before = expense.ledger_before
+        after = ledger_entries([expense.id])
+        if previous_event.id == expense.event_id:
+            expense_changed(expense.event, before, after)
+        else:
+            expense_changed(previous_event, before, ledger_entries([]))
+            expense_changed(expense.event, ledger_entries([]), after)
+
+    def delete_model(self, request, obj):
+        self.delete_queryset(request, Expense.objects.filter(pk=obj.pk))
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            expenses = list(queryset.select_related('event'))
+            before = {expense.id: ledger_entries([expense.id]) for expense in expenses}
+            super().delete_queryset(request, queryset)
+            for expense in expenses:
+                expense_changed(expense.event, before[expense.id], ledger_entries([]))
+
+
+class MemberAdmin(admin.ModelAdmin):
+    # Like delete_member: the remaining contributors split the member's expenses again
+
+    def delete_model(self, request, obj):
+        self.delete_queryset(request, Member.objects.filter(pk=obj.pk))
+
+    def delete_queryset(self, request, queryset):
+        try:
+            with transaction.atomic():
+                members = list(queryset.select_related('event'))
+                expense_ids = list(ExpenseShare.objects.filter(member__in=members).values_list('expense_id', flat=True))
+                super().delete_queryset(request, queryset)
+                update_shares(expense_ids)
+                for event in {member.event_id: member.event for member in members}.values():
+                    expenses_changed(event)
+        except SplitError as error:
+            self.message_user(request, f"Nothing was deleted: {error}", messages.ERROR)
+
+
 admin.site.register(Event)
-admin.site.register(Member)
-admin.site.register(Expense)
+admin.site.register(Member, MemberAdmin)
+admin.site.register(Expense, ExpenseAdmin)
 admin.site.register(UserPreferences)
-admin.site.register(Transaction)
\ No newline at end of file
+admin.site.register(Transaction)
+admin.site.register(ReportJob)
+admin.site.register(OutboundEmail)
+admin.site.register(ExchangeRate)
+admin.site.register(ExpenseShare, ExpenseShareAdmin)
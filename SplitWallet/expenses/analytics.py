@@ -0,0 +1,251 @@
+import uuid
+from decimal import Decimal
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db.models import Q
+
+from .currency import convert, quote_currency, ExchangeRateMissing
+from .models import Event, Expense, CURRENCY_SYMBOLS
+
+# Per-user analytics rollup
+#
+# Every analytics endpoint is answered from one precomputed rollup per user,
+# built by a single pass over the user's events and expenses. Rollups live in
+# the analytics cache under a per-user version. Versions are kept in a cache
+# every worker shares (the database cache by default); expense and event
+# writes replace the version (bump_analytics_version) so stale rollups are
+# never read again, in any worker, and simply age out of the cache. Versions
+# are random tokens, not counters, so a version lost to a restart or eviction
+# is never handed out again (it doubles as the bundle ETag). The a-prefixed
+# functions are the same lookups for async views, using the cache's async API.
+#
+# Events keep their expenses in their own base currency, so the rollup
+# converts every amount to one reporting currency (FX_QUOTE_CURRENCY) on the
+# expense date before adding it up. Amounts with no rate to convert them are
+# left out of the sums and reported per currency under `unconverted`.
+
+MONTH_NAMES = [
+    'January', 'February', 'March', 'April', 'May', 'June',
+    'July', 'August', 'September', 'October', 'November', 'December'
+]
+
+
+def analytics_cache():
+    return caches[getattr(settings, 'ANALYTICS_CACHE_ALIAS', 'default')]
+
+
+def version_cache():
+    return caches[getattr(settings, 'ANALYTICS_VERSION_CACHE_ALIAS', 'default')]
+
+
+def version_key(user_id):
+    return f'analytics:version:{user_id}'
+
+
+def create_version_table_after_migrate(sender, using='default', **kwargs):
+    # The version cache is a database cache table (see settings); creating it
+    # with every migrate means a deploy can't forget it. Existing tables are
+    # left alone.
+    call_command('createcachetable', database=using, verbosity=0)
+
+
+def new_version():
+    return uuid.uuid4().hex
+
+
+def analytics_version(user_id):
+    cache = version_cache()
+    version = cache.get(version_key(user_id))
+    if version is None:
+        # add() so concurrent first requests agree on the starting version
+        version = new_version()
+        if not cache.add(version_key(user_id), version, timeout=None):
+            version = cache.get(version_key(user_id), version)
+    return version
+
+
+async def aanalytics_version(user_id):
+    cache = version_cache()
+    version = await cache.aget(version_key(user_id))
+    if version is None:
+        version = new_version()
+        if not await cache.aadd(version_key(user_id), version, timeout=None):
+            version = await cache.aget(version_key(user_id), version)
+    return version
+
+
+def bump_analytics_version(*user_ids):
+    cache = version_cache()
+    cache.set_many({version_key(user_id): new_version() for user_id in set(user_ids)}, timeout=None)
+
+
+def rollup_key(user_id, version):
+    # v2: amounts in the reporting currency
+    return f'analytics:rollup:v2:{user_id}:{version}'
+
+
+def get_rollup(user):
+    cache = analytics_cache()
+    key = rollup_key(user.id, analytics_version(user.id))
+    rollup = cache.get(key)
+    if rollup is None:
+        rollup = compute_rollup(user)
+        cache.set(key, rollup, timeout=getattr(settings, 'ANALYTICS_CACHE_TIMEOUT', 24 * 60 * 60))
+    return rollup
+
+
+async def aget_rollup(user):
+    cache = analytics_cache()
+    key = rollup_key(user.id, await aanalytics_version(user.id))
+    rollup = await cache.aget(key)
+    if rollup is None:
+        # The rollup is one long pass over the user's expenses; run it off the event loop
+        rollup = await sync_to_async(compute_rollup)(user)
+        await cache.aset(key, rollup, timeout=getattr(settings, 'ANALYTICS_CACHE_TIMEOUT', 24 * 60 * 60))
+    return rollup
+
+
+def count_into(counts, key, amount=1):
+    counts[key] = counts.get(key, 0) + amount
+
+
+def compute_rollup(user):
+    reporting_currency = quote_currency()
+    unconverted = {}
+
+    def reporting_amount(amount, currency, day):
+        # None (and noted in `unconverted`) when there is no rate for the day
+        try:
+            return convert(amount, currency, reporting_currency, day)
+        except ExchangeRateMissing:
+            count_into(unconverted, currency, amount)
+            return None
+
+    events = list(Event.objects.filter(user=user).order_by().values_list('id', 'start_date'))
+
+    events_by_year = {}
+    event_expenditure_by_year = {}
+    events_by_day = {}
+    event_years = {}
+    for event_id, start_date in events:
+        event_years[event_id] = (start_date.year, start_date.month)
+        count_into(events_by_year, start_date.year)
+        event_expenditure_by_year.setdefault(start_date.year, None)
+        count_into(events_by_day, (start_date.year, start_date.month, start_date.day))
+
+    # One scan over every expense the user created or that belongs to one of their events
+    expenses = Expense.objects.filter(Q(user=user) | Q(event__user=user)).order_by().values_list(
+        'user_id', 'event_id', 'event__user_id', 'event__start_date', 'event__end_date', 'date', 'base_amount',
+        'event__base_currency', 'category'
+    )
+
+    expenses_by_month = {}
+    expenses_by_day = {}
+    expenses_by_category = {}
+    total_expenses_count = 0
+    total_event_expenditure = None
+    for expense_user_id, event_id, event_user_id, start_date, end_date, date, base_amount, base_currency, category in expenses.iterator(chunk_size=5000):
+        amount = reporting_amount(base_amount, base_currency, date)
+        if expense_user_id == user.id and amount is not None:
+            count_into(expenses_by_category, category, amount)
+        if event_user_id != user.id:
+            continue
+
+        total_expenses_count += 1
+        count_into(expenses_by_month, event_years[event_id])
+        year = event_years[event_id][0]
+        if amount is not None:
+            total_event_expenditure = (total_event_expenditure or Decimal('0')) + amount
+            event_expenditure_by_year[year] = (event_expenditure_by_year[year] or Decimal('0')) + amount
+        if start_date <= date <= end_date:
+            count_into(expenses_by_day, (date.year, date.month, date.day))
+
+    return {
+        'currency': reporting_currency,
+        'unconverted': dict(sorted(unconverted.items())),
+        'total_events': len(events),
+        'total_event_expenditure': total_event_expenditure,
+        'total_expenses_count': total_expenses_count,
+        'events_by_year': [{'year': year, 'count': count} for year, count in sorted(events_by_year.items())],
+        'expenses_by_month': [{'year': year, 'month': month, 'count': count} for (year, month), count in sorted(expenses_by_month.items())],
+        'event_expenditure_by_year': [{'year': year, 'total_expenditure': total} for year, total in sorted(event_expenditure_by_year.items())],
+        'events_by_month_and_day': [
+            {'year': year, 'month': month, 'day': day, 'event_count': count}
+            for (year, month, day), count in sorted(events_by_day.items())
+        ],
+        'expenses_by_month_and_day': [
+            {'year': year, 'month': month, 'day': day, 'expense_count': count}
+            for (year, month, day), count in sorted(expenses_by_day.items())
+        ],
+        'expenses_by_category': expenses_by_category,
+    }
+
+
+def line_chart(expenses_by_month):
+    # Month labels and expense counts for the line chart
+    return {
+        'labels': [f"{entry['year']}-{MONTH_NAMES[entry['month'] - 1]}" for entry in expenses_by_month],
+        'data': [entry['count'] for entry in expenses_by_month],
+    }
+
+
+def build_bundle(rollup):
+    # Every chart series on the analytics page, each computed exactly once
+    events_by_year = rollup['events_by_year']
+    expenses_by_month = rollup['expenses_by_month']
+    event_expenditure_by_year = rollup['event_expenditure_by_year']
+    expenses_by_category = rollup['expenses_by_category']
+
+    total_by_category = sum(expenses_by_category.values())
+    if total_by_category != 0:
+        percentage_by_category = {category: round((total_amount / total_by_category) * 100, 2) for category, total_amount in expenses_by_category.items()}
+    else:
+        percentage_by_category = {}
+
+    return {
+        'currency': rollup['currency'],
+        'currency_symbol': CURRENCY_SYMBOLS.get(rollup['currency'], rollup['currency']),
+        'unconverted': rollup['unconverted'],
+        'totals': {
+            'total_events': rollup['total_events'],
+            'total_event_expenditure': rollup['total_event_expenditure'] or 0,
+            'total_expenses_count': rollup['total_expenses_count'],
+        },
+        'events_by_year': events_by_year,
+        'expenses_by_month': expenses_by_month,
+        'bar_chart_events_by_year': {
+            'labels': [entry['year'] for entry in events_by_year],
+            'data': [entry['count'] for entry in events_by_year],
+        },
+        'line_chart_data': line_chart(expenses_by_month),
+        'line_chart_expenses_by_month': {
+            'labels': [entry['year'] for entry in expenses_by_month],
+            'data': [entry['count'] or 0 for entry in expenses_by_month],
+        },
+        'event_expenditure_data': {
+            'labels': [entry['year'] for entry in event_expenditure_by_year],
+            'data': [entry['total_expenditure'] or 0 for entry in event_expenditure_by_year],
+        },
+        'expense_by_category': expenses_by_category,
+        'percentage_by_category': percentage_by_category,
+        'expense_and_event_by_month_and_day': {
+            'events': rollup['events_by_month_and_day'],
+            'expenses': rollup['expenses_by_month_and_day'],
+        },
+    }
+
+
+def get_bundle(user):
+    return build_bundle(get_rollup(user))
+
+
+async def aget_bundle(user):
+    return build_bundle(await aget_rollup(user))
+
+
+def bundle_etag(request):
+    # Changes whenever the user's analytics version is bumped; one cache-table lookup
+    return f'analytics-{request.user.id}-{analytics_version(request.user.id)}'
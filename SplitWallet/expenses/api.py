@@ -0,0 +1,122 @@
+from datetime import date
+
+from .models import Expense
+from .pagination import keyset_page, InvalidCursor
+
+# Read-only expenses API
+#
+# Pages through an event's expenses in Meta.ordering order (-date, then -id)
+# with keyset pagination, so every page is one range scan on
+# expense_event_date_idx however deep the client pages. `fields` maps straight
+# onto .values(), so only the requested columns are read.
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# API field name -> ORM path
+API_FIELDS = {
+    'id': 'id',
+    'date': 'date',
+    'description': 'description',
+    'amount': 'amount',
+    'currency': 'currency',
+    'base_amount': 'base_amount',
+    'category': 'category',
+    'payment_method': 'payment_method',
+    'location': 'location',
+    'approval_status': 'approval_status',
+    'is_settled': 'is_settled',
+    'notes': 'notes',
+    'payer_id': 'payer_id',
+    'payer': 'payer__name',
+    'created_date': 'created_date',
+    'updated_date': 'updated_date',
+}
+DEFAULT_FIELDS = ['id', 'date', 'description', 'amount', 'currency', 'category', 'payer', 'approval_status']
+# Not a column: names of the contributors, loaded with one extra query per page
+CONTRIBUTORS_FIELD = 'contributors'
+
+APPROVAL_STATUSES = [value for value, _ in Expense._meta.get_field('approval_status').choices]
+
+
+class ApiError(Exception):
+    pass
+
+
+def parse_fields(value):
+    if not value:
+        return list(DEFAULT_FIELDS)
+    fields = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in fields if name not in API_FIELDS and name != CONTRIBUTORS_FIELD]
+    if unknown:
+        raise ApiError(f"Unknown field(s): {', '.join(unknown)}.")
+    return fields
+
+
+def parse_date(value, name):
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise ApiError(f'Invalid {name} "{value}". Use YYYY-MM-DD.')
+
+
+def parse_page_size(value):
+    if not value:
+        return DEFAULT_PAGE_SIZE
+    try:
+        page_size = int(value)
+    except ValueError:
+        raise ApiError(f'Invalid page_size "{value}".')
+    return max(1, min(page_size, MAX_PAGE_SIZE))
+
+
+def filter_expenses(queryset, params):
+    if params.get('category'):
+        queryset = queryset.filter(category=params['category'])
+    if params.get('payer'):
+        try:
+            queryset = queryset.filter(payer_id=int(params['payer']))
+        except ValueError:
+            raise ApiError(f'Invalid payer "{params["payer"]}". Use a member id.')
+    if params.get('approval_status'):
+        if params['approval_status'] not in APPROVAL_STATUSES:
+            raise ApiError(f'Invalid approval_status "{params["approval_status"]}".')
+        queryset = queryset.filter(approval_status=params['approval_status'])
+    if params.get('date_from'):
+        queryset = queryset.filter(date__gte=parse_date(params['date_from'], 'date_from'))
+    if params.get('date_to'):
+        queryset = queryset.filter(date__lte=parse_date(params['date_to'], 'date_to'))
+    return queryset
+
+
+def expense_page(event, params):
+    # Returns (rows, next_cursor) for one page of the event's expenses
+    fields = parse_fields(params.get('fields'))
+    page_size = parse_page_size(params.get('page_size'))
+
+    # date and id are always read: the cursor is built from them
+    paths = {'date', 'id'}
+    paths.update(API_FIELDS[name] for name in fields if name in API_FIELDS)
+    queryset = filter_expenses(Expense.objects.filter(event=event), params).values(*paths)
+
+    try:
+        rows, next_cursor = keyset_page(queryset, '-date', cursor=params.get('cursor'), page_size=page_size)
+    except InvalidCursor as error:
+        raise ApiError(str(error))
+
+    contributors = {}
+    if CONTRIBUTORS_FIELD in fields and rows:
+        links = Expense.contributors.through.objects.filter(expense_id__in=[row['id'] for row in rows]).values_list('expense_id', 'member__name').order_by('id')
+        for expense_id, name in links:
+            contributors.setdefault(expense_id, []).append(name)
+
+    results = []
+    for row in rows:
+        result = {}
+        for name in fields:
+            if name == CONTRIBUTORS_FIELD:
+                result[name] = contributors.get(row['id'], [])
+            else:
+                result[name] = row[API_FIELDS[name]]
+        results.append(result)
+    return results, next_cursor
@@ -0,0 +1,67 @@
+from decimal import Decimal
+
+from django.db.models import Count, Q, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Expense
+
+# Approval-status summary
+#
+# Pending / approved / rejected counts and amounts for an event, as one
+# conditional aggregate (COUNT/SUM ... FILTER) over the event's expenses.
+# approval_summaries gets the same figures for a page of events in one query
+# grouped by event, so listing pages never check events one by one.
+
+APPROVAL_STATUSES = [value for value, _ in Expense._meta.get_field('approval_status').choices]
+
+
+def status_aggregates():
+    # {'<status>_count': Count, '<status>_amount': Sum} for every status
+    aggregates = {}
+    for status in APPROVAL_STATUSES:
+        condition = Q(approval_status=status)
+        name = status.lower()
+        aggregates[f'{name}_count'] = Count('id', filter=condition)
+        aggregates[f'{name}_amount'] = Coalesce(Sum('base_amount', filter=condition), Value(Decimal('0')))
+    return aggregates
+
+
+def build_summary(values):
+    summary = {
+        status.lower(): {'count': values[f'{status.lower()}_count'], 'amount': values[f'{status.lower()}_amount']}
+        for status in APPROVAL_STATUSES
+    }
+    total = sum(figures['count'] for figures in summary.values())
+    summary['total_count'] = total
+    # No expenses means nothing to approve yet, not "all approved"
+    summary['all_approved'] = total > 0 and summary['approved']['count'] == total
+    return summary
+
+
+def approval_summary(event):
+    values = Expense.objects.filter(event=event).order_by().aggregate(**status_aggregates())
+    return build_summary(values)
+
+
+def approval_summaries(event_ids):
+    # {event_id: summary} for the given events. Only their expenses are read,
+    # so call it with the ids of one page, after paginating the events.
+    rows = Expense.objects.filter(event_id__in=event_ids).order_by().values('event_id').annotate(**status_aggregates())
+    values = {row['event_id']: row for row in rows}
+    # Events without expenses get no row
+    empty = {name: 0 for name in status_aggregates()}
+    return {event_id: build_summary(values.get(event_id, empty)) for event_id in event_ids}
+
+
+def set_approval_status(event, expense_ids, status):
+    # Moves the given expenses of `event` to `status` in one UPDATE; returns
+    # how many changed and the refreshed summary
+    if status not in APPROVAL_STATUSES:
+        raise ValueError(f'Unknown approval status "{status}".')
+    updated = Expense.objects.filter(event=event, id__in=expense_ids).exclude(approval_status=status).update(
+        approval_status=status,
+        # update() skips auto_now, and report versions key off updated_date
+        updated_date=timezone.now(),
+    )
+    return updated, approval_summary(event)
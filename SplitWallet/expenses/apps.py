@@ -1,6 +1,21 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_migrate
 
 
 class ExpensesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'expenses'
+
+    def ready(self):
+        # The full-text search table and its triggers live outside the models
+        from .search import install_after_migrate
+        post_migrate.connect(install_after_migrate, sender=self)
+
+        # Database cache table holding the per-user analytics versions
+        from .analytics import create_version_table_after_migrate
+        post_migrate.connect(create_version_table_after_migrate, sender=self)
+
+        # SQLite pragmas (WAL, busy_timeout, ...) from settings.SQLITE_PRAGMAS
+        from .db import configure_sqlite
+        connection_created.connect(configure_sqlite)
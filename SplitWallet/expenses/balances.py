@@ -0,0 +1,124 @@
+from decimal import Decimal
+
+from django.db.models import Sum
+
+from .models import Member, Expense, ExpenseShare
+
+# Balance engine
+#
+# Loads an event's members, expenses and the expense/contributor links once
+# (three queries, whatever the event size) and derives every per-member figure
+# the report and settlement pages need in memory. Pairwise debts are kept in a
+# dense member x member matrix where debts[i][j] is what member i owes member j.
+
+ZERO = Decimal('0')
+
+
+class EventBalances:
+    def __init__(self, event):
+        self.event = event
+        self.members = list(Member.objects.filter(event=event))
+        self.expenses = list(Expense.objects.filter(event=event).select_related('payer'))
+
+        # Member id -> row/column in the debt matrix
+        self.index = {member.id: i for i, member in enumerate(self.members)}
+        size = len(self.members)
+        self.debts = [[ZERO] * size for _ in range(size)]
+
+        self.paid = [ZERO] * size
+        self.owed = [ZERO] * size
+        self.expense_count = [0] * size
+        self.total = ZERO
+
+        # Stored shares per expense (member id -> share), from the through table
+        shares = {}
+        links = ExpenseShare.objects.filter(expense__event=event).values_list('expense_id', 'member_id', 'share')
+        for expense_id, member_id, share in links:
+            shares.setdefault(expense_id, {})[member_id] = share
+
+        for expense in self.expenses:
+            expense.member_shares = shares.get(expense.id, {})
+            expense.contributor_count = len(expense.member_shares)
+            # Average share, for listings that show one figure per expense
+            expense.contribution_amount = expense.base_amount / len(expense.member_shares) if expense.member_shares else 0
+            self.total += expense.base_amount
+
+            payer = self.index.get(expense.payer_id)
+            if payer is None:
+                continue
+            self.paid[payer] += expense.base_amount
+            self.expense_count[payer] += 1
+
+            for member_id, share in expense.member_shares.items():
+                contributor = self.index.get(member_id)
+                if contributor is None:
+                    continue
+                self.owed[contributor] += share
+                if contributor != payer:
+                    self.debts[contributor][payer] += share
+
+    def paid_by(self, member):
+        return self.paid[self.index[member.id]]
+
+    def owed_by(self, member):
+        return self.owed[self.index[member.id]]
+
+    def balance(self, member):
+        # Positive: the member is owed money, negative: the member owes money
+        i = self.index[member.id]
+        return self.paid[i] - self.owed[i]
+
+    def expense_count_for(self, member):
+        return self.expense_count[self.index[member.id]]
+
+    def percentage_spent(self, member):
+        if self.total > 0:
+            return (self.paid_by(member) / self.total) * 100
+        return 0
+
+    def net_between(self, member, other):
+        # What `other` owes `member` after netting both directions
+        i, j = self.index[member.id], self.index[other.id]
+        return self.debts[j][i] - self.debts[i][j]
+
+    def pay_to(self, member, other):
+        return max(ZERO, -self.net_between(member, other))
+
+    def get_from(self, member, other):
+        return max(ZERO, self.net_between(member, other))
+
+    def paid_for(self, payer, contributor):
+        # Share of `payer`'s expenses that `contributor` took part in
+        return self.debts[self.index[contributor.id]][self.index[payer.id]]
+
+    def expenses_paid_by(self, member):
+        return [expense for expense in self.expenses if expense.payer_id == member.id]
+
+    def expenses_not_paid_by(self, member):
+        return [expense for expense in self.expenses if expense.payer_id != member.id]
+
+
+def member_totals(event):
+    # Amount paid and share owed per member id, without building the pairwise
+    # matrix. Three queries: members, then one aggregate each over the
+    # expenses and the stored shares.
+    member_ids = list(Member.objects.filter(event=event).values_list('id', flat=True))
+    paid = dict.fromkeys(member_ids, ZERO)
+    owed = dict.fromkeys(member_ids, ZERO)
+
+    for payer_id, amount in Expense.objects.filter(event=event).order_by().values('payer_id').annotate(total=Sum('base_amount')).values_list('payer_id', 'total'):
+        if payer_id in paid:
+            paid[payer_id] += amount
+
+    for member_id, share in ExpenseShare.objects.filter(expense__event=event).order_by().values('member_id').annotate(total=Sum('share')).values_list('member_id', 'total'):
+        if member_id in owed:
+            owed[member_id] += share
+
+    return paid, owed
+
+
+def net_balances(event):
+    # Net balance per member id (paid minus share owed), read from the running
+    # ledger on the member rows: one query over the members, not the expenses
+    members = Member.objects.filter(event=event).values_list('id', 'amount_paid', 'amount_owed')
+    return {member_id: paid - owed for member_id, paid, owed in members}
@@ -0,0 +1,91 @@
+import time
+from decimal import Decimal, ROUND_HALF_UP
+from functools import lru_cache
+
+from django.conf import settings
+
+from .models import Expense, ExchangeRate
+from .splits import update_shares
+
+# Currency conversion
+#
+# ExchangeRate holds one rate per currency per day, quoted as units of
+# FX_QUOTE_CURRENCY for one unit of the currency (load them from a CSV with
+# load_fx_rates). Every expense stores base_amount, its amount converted to
+# the event's base currency on the expense date, so totals, balances and
+# analytics sum a single column. Rate lookups go through an in-process LRU
+# cache keyed by (currency, date), which keeps bulk imports and
+# re-conversions to one query per distinct currency and day. Entries expire
+# after FX_RATE_CACHE_TTL seconds, so other processes pick up rates loaded
+# later (e.g. today's rate replacing yesterday's for a new expense).
+
+CENT = Decimal('0.01')
+
+
+class ExchangeRateMissing(ValueError):
+    pass
+
+
+def quote_currency():
+    return getattr(settings, 'FX_QUOTE_CURRENCY', 'INR')
+
+
+def rate_on(currency, day):
+    # Latest rate on or before `day`. The time bucket in the key ends every
+    # entry after at most FX_RATE_CACHE_TTL seconds.
+    ttl = getattr(settings, 'FX_RATE_CACHE_TTL', 300)
+    return cached_rate(currency, day, int(time.monotonic() // ttl))
+
+
+@lru_cache(maxsize=getattr(settings, 'FX_RATE_CACHE_SIZE', 4096))
+def cached_rate(currency, day, bucket):
+    # Misses raise, and lru_cache never caches an exception
+    if currency == quote_currency():
+        return Decimal('1')
+    rate = ExchangeRate.objects.filter(currency=currency, date__lte=day).order_by('-date').values_list('rate', flat=True).first()
+    if rate is None:
+        raise ExchangeRateMissing(f"No {currency} exchange rate on or before {day}. Load rates with the load_fx_rates command.")
+    return rate
+
+
+def clear_rate_cache():
+    cached_rate.cache_clear()
+
+
+def convert(amount, currency, to_currency, day):
+    if currency == to_currency:
+        return amount
+    converted = Decimal(amount) * rate_on(currency, day) / rate_on(to_currency, day)
+    return converted.quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def base_amount(expense, event=None):
+    event = event or expense.event
+    return convert(expense.amount, expense.currency, event.base_currency, expense.date)
+
+
+def convert_expenses(expenses, chunk_size):
+    # Recompute base_amount for a queryset of expenses; returns the ids that changed
+    changed = []
+    changed_ids = []
+    for expense in expenses.select_related('event').only('id', 'amount', 'currency', 'date', 'base_amount', 'event__base_currency').iterator(chunk_size=chunk_size):
+        amount = base_amount(expense)
+        if amount != expense.base_amount:
+            expense.base_amount = amount
+            changed.append(expense)
+            changed_ids.append(expense.id)
+        if len(changed) >= chunk_size:
+            Expense.objects.bulk_update(changed, ['base_amount'])
+            changed = []
+    if changed:
+        Expense.objects.bulk_update(changed, ['base_amount'])
+    return changed_ids
+
+
+def reconvert_expenses(expenses, chunk_size=2000):
+    # Recompute base_amount and the stored shares of a queryset of expenses;
+    # returns how many expenses changed
+    changed_ids = convert_expenses(expenses, chunk_size=chunk_size)
+    for start in range(0, len(changed_ids), chunk_size):
+        update_shares(changed_ids[start:start + chunk_size])
+    return len(changed_ids)
@@ -0,0 +1,30 @@
+from django.conf import settings
+
+# Database connection setup
+#
+# configure_sqlite runs on every new connection (connected to
+# connection_created in ExpensesConfig.ready) and applies settings.SQLITE_PRAGMAS.
+# journal_mode=WAL is stored in the database file, the rest are per connection.
+
+
+def sqlite_pragmas():
+    return getattr(settings, 'SQLITE_PRAGMAS', {}).items()
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in sqlite_pragmas():
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+def current_pragmas(connection):
+    # Effective values, for checking the profile is applied
+    values = {}
+    with connection.cursor() as cursor:
+        for name, _ in sqlite_pragmas():
+            cursor.execute(f'PRAGMA {name}')
+            row = cursor.fetchone()
+            values[name] = row[0] if row else None
+    return values
@@ -0,0 +1,25 @@
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.auth.views import redirect_to_login
+from django.shortcuts import resolve_url
+
+# Async view decorators
+#
+# Django 5.0's login_required only wraps sync views (async support arrives in
+# 5.1), and reading request.user from async code would run a blocking session
+# query. alogin_required resolves the user with request.auser() instead.
+
+
+def alogin_required(login_url=None):
+    def decorator(view_func):
+        @wraps(view_func)
+        async def wrapper(request, *args, **kwargs):
+            user = await request.auser()
+            if not user.is_authenticated:
+                return redirect_to_login(request.get_full_path(), resolve_url(login_url or settings.LOGIN_URL))
+            # Later request.user reads get the resolved user, not a lazy lookup
+            request.user = user
+            return await view_func(request, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,42 @@
+from django.core.mail import EmailMultiAlternatives
+from django.template.loader import get_template
+
+# Account emails
+#
+# Each email has an HTML template and a hand-written plain-text template, so
+# sending an email is two renders with no strip_tags pass over the HTML.
+# Compiled templates are kept by Django's cached template loader, which also
+# picks up template edits in development.
+
+EMAILS = {
+    'account_activation': {
+        'subject': 'Activate your account',
+        'html': 'expenses/account_activation_email.html',
+        'text': 'expenses/account_activation_email.txt',
+    },
+    'password_reset': {
+        'subject': 'Reset Your Password',
+        'html': 'expenses/password_reset_email.html',
+        'text': 'expenses/password_reset_email.txt',
+    },
+}
+
+
+def render_email(name, context):
+    # (html, text) for one recipient
+    email = EMAILS[name]
+    html_template, text_template = get_template(email['html']), get_template(email['text'])
+    return html_template.render(context), text_template.render(context)
+
+
+def build_email(name, user, domain, uid, token, to):
+    context = {
+        'user': user,
+        'domain': domain,
+        'uid': uid,
+        'token': token,
+    }
+    html, text = render_email(name, context)
+    message = EmailMultiAlternatives(EMAILS[name]['subject'], text, to=to)
+    message.attach_alternative(html, 'text/html')
+    return message
@@ -0,0 +1,67 @@
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .queries import expense_listing
+
+# Streaming expense export
+#
+# Rows are produced by a generator over .iterator(chunk_size=...). Since
+# Django 4.1 the contributor and share prefetches are applied to each chunk,
+# so memory stays flat whether the event has 100 expenses or 500,000.
+# `shares` are the stored ExpenseShare.share values (expenses.splits), in
+# the same order as `contributors`.
+
+EXPORT_CHUNK_SIZE = 2000
+
+EXPORT_FIELDS = [
+    'id', 'date', 'description', 'category', 'amount', 'currency', 'base_amount', 'payer',
+    'contributors', 'contributor_count', 'shares', 'payment_method', 'location',
+    'approval_status', 'notes', 'created_date', 'updated_date',
+]
+
+
+def expense_rows(event, user=None, chunk_size=EXPORT_CHUNK_SIZE):
+    for expense in expense_listing(event, user=user).prefetch_related('shares').iterator(chunk_size=chunk_size):
+        contributors = list(expense.contributors.all())
+        shares = {row.member_id: row.share for row in expense.shares.all()}
+        yield {
+            'id': expense.id,
+            'date': expense.date,
+            'description': expense.description,
+            'category': expense.category,
+            'amount': expense.amount,
+            'currency': expense.currency,
+            'base_amount': expense.base_amount,
+            'payer': expense.payer.name,
+            'contributors': [member.name for member in contributors],
+            'contributor_count': expense.contributor_count,
+            'shares': [shares[member.id] for member in contributors],
+            'payment_method': expense.payment_method,
+            'location': expense.location,
+            'approval_status': expense.approval_status,
+            'notes': expense.notes,
+            'created_date': expense.created_date,
+            'updated_date': expense.updated_date,
+        }
+
+
+class Echo:
+    # File-like object whose write() hands the line straight back to csv.writer
+    def write(self, value):
+        return value
+
+
+def csv_stream(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for row in rows:
+        row['contributors'] = '; '.join(row['contributors'])
+        row['shares'] = '; '.join(str(share) for share in row['shares'])
+        yield writer.writerow([row[field] for field in EXPORT_FIELDS])
+
+
+def ndjson_stream(rows):
+    for row in rows:
+        yield json.dumps(row, cls=DjangoJSONEncoder) + '\n'
@@ -1,4 +1,5 @@
 from django import forms
+from .currency import convert, ExchangeRateMissing
 from .models import Event, Member, Expense, Transaction
 
 from django.contrib.auth.models import User  
@@ -45,7 +46,7 @@ class CustomUserCreationForm(UserCreationForm):
 class EventForm(forms.ModelForm):
     class Meta:
         model = Event
-        fields = ['title', 'description', 'start_date', 'end_date', 'location']
+        fields = ['title', 'description', 'start_date', 'end_date', 'location', 'base_currency']
         widgets = {
             'start_date': forms.DateInput(attrs={'type': 'date'}),
             'end_date': forms.DateInput(attrs={'type': 'date'}),
@@ -90,6 +91,7 @@ class ExpenseForm(forms.ModelForm):
     def __init__(self, *args, **kwargs):
         event = kwargs.pop('event', None)
         super().__init__(*args, **kwargs)
+        self.event = event or getattr(self.instance, 'event', None)
 
         # Dynamically set the choices for the 'payer' field
         if event:
@@ -119,6 +121,28 @@ class ExpenseForm(forms.ModelForm):
             contributors = contributors.filter(event=event)
         return contributors
 
+    def clean(self):
+        cleaned_data = super().clean()
+        amount = cleaned_data.get('amount')
+        currency = cleaned_data.get('currency')
+        date = cleaned_data.get('date')
+        # Expense.save converts to the event's base currency, so the rate must exist
+        if self.event and amount is not None and currency and date:
+            try:
+                convert(amount, currency, self.event.base_currency, date)
+            except ExchangeRateMissing as error:
+                self.add_error('currency', str(error))
+        return cleaned_data
+
+class ExpenseImportForm(forms.Form):
+    file = forms.FileField(label='CSV or XLSX file', help_text='Columns: description, date, amount, payer, contributors (separated by ";"), category, payment_method, currency, approval_status, location, notes.')
+
+    def clean_file(self):
+        file = self.cleaned_data['file']
+        if not file.name.lower().endswith(('.csv', '.xlsx')):
+            raise ValidationError("Upload a .csv or .xlsx file.")
+        return file
+
 class TransactionForm(forms.ModelForm):
     class Meta:
         model = Transaction
@@ -0,0 +1,220 @@
+import codecs
+import csv
+import zipfile
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+
+from .currency import convert
+from .models import Member, Expense, ExpenseShare, CATEGORY_CHOICES, PAYMENT_METHOD_CHOICES
+from .splits import share_rows
+
+# Bulk expense import
+#
+# Streams a CSV or XLSX file row by row, validates each row against the
+# event (members resolved through one name -> member map, dates checked the
+# same way ExpenseForm.clean_date does) and writes valid rows in fixed-size
+# chunks with bulk_create, contributors included. Only one chunk of rows is
+# held in memory at a time, whatever the file size.
+#
+# Expected columns (header row, case-insensitive): description, date, amount,
+# payer, contributors (names separated by ';', blank for every member),
+# category, payment_method, currency, approval_status, location, notes.
+
+CHUNK_SIZE = 500
+# Errors beyond this many are counted but not listed
+MAX_REPORTED_ERRORS = 1000
+
+DATE_FORMATS = ['%Y-%m-%d', '%d-%m-%Y', '%d/%m/%Y']
+REQUIRED_COLUMNS = ['description', 'date', 'amount', 'payer']
+CURRENCIES = [value for value, _ in Expense._meta.get_field('currency').choices]
+APPROVAL_STATUSES = [value for value, _ in Expense._meta.get_field('approval_status').choices]
+CATEGORIES = {value for value, _ in CATEGORY_CHOICES}
+PAYMENT_METHODS = {value for value, _ in PAYMENT_METHOD_CHOICES}
+MAX_AMOUNT = Decimal('99999999.99')  # max_digits=10, decimal_places=2
+
+
+class ImportFileError(Exception):
+    pass
+
+
+class ImportResult:
+    def __init__(self):
+        self.imported = 0
+        self.error_count = 0
+        self.errors = []
+
+    def add_error(self, row_number, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'row': row_number, 'message': message})
+
+
+def iter_csv_rows(uploaded_file):
+    # Uploaded files iterate line by line, so only the current line is decoded
+    try:
+        yield from csv.reader(codecs.iterdecode(uploaded_file, 'utf-8-sig'))
+    except UnicodeDecodeError:
+        raise ImportFileError("The file is not valid UTF-8. Save it as \"CSV UTF-8\" and try again.")
+
+
+def iter_xlsx_rows(uploaded_file):
+    try:
+        from openpyxl import load_workbook
+        from openpyxl.utils.exceptions import InvalidFileException
+    except ImportError:
+        raise ImportFileError("XLSX import needs the openpyxl package. Upload a CSV file instead.")
+
+    try:
+        workbook = load_workbook(uploaded_file, read_only=True, data_only=True)
+    except (zipfile.BadZipFile, InvalidFileException, KeyError):
+        raise ImportFileError("The file is not a valid .xlsx workbook.")
+    try:
+        for row in workbook.active.iter_rows(values_only=True):
+            yield ['' if value is None else value for value in row]
+    finally:
+        workbook.close()
+
+
+def iter_rows(uploaded_file):
+    name = uploaded_file.name.lower()
+    if name.endswith('.xlsx'):
+        return iter_xlsx_rows(uploaded_file)
+    if name.endswith('.csv'):
+        return iter_csv_rows(uploaded_file)
+    raise ImportFileError("Unsupported file type. Upload a .csv or .xlsx file.")
+
+
+def parse_date(value):
+    if hasattr(value, 'date'):
+        # openpyxl returns datetimes for date cells
+        return value.date()
+    value = str(value).strip()
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format).date()
+        except ValueError:
+            continue
+    raise ValueError(f'Invalid date "{value}". Use YYYY-MM-DD.')
+
+
+def parse_row(row, event, members_by_name):
+    # Returns (expense, contributors) or raises ValueError with the reason
+    description = str(row.get('description', '')).strip()
+    if not description:
+        raise ValueError("Description is required.")
+
+    date = parse_date(row.get('date', ''))
+    if date < event.start_date or date > event.end_date:
+        raise ValueError('Date must be within the event start and end dates.')
+
+    try:
+        amount = Decimal(str(row.get('amount', '')).strip().replace(',', ''))
+        # NaN and Infinity parse, but can't be quantized or compared
+        if not amount.is_finite():
+            raise InvalidOperation
+        amount = amount.quantize(Decimal('0.01'))
+    except InvalidOperation:
+        raise ValueError(f'Invalid amount "{row.get("amount", "")}".')
+    if amount <= 0 or amount > MAX_AMOUNT:
+        raise ValueError(f'Amount must be between 0.01 and {MAX_AMOUNT}.')
+
+    payer_name = str(row.get('payer', '')).strip()
+    payer = members_by_name.get(payer_name.casefold())
+    if payer is None:
+        raise ValueError(f'Payer "{payer_name}" is not a member of this event.')
+
+    contributor_names = [name.strip() for name in str(row.get('contributors', '')).split(';') if name.strip()]
+    if contributor_names:
+        contributors = []
+        for name in contributor_names:
+            member = members_by_name.get(name.casefold())
+            if member is None:
+                raise ValueError(f'Contributor "{name}" is not a member of this event.')
+            if member not in contributors:
+                contributors.append(member)
+    else:
+        contributors = list(members_by_name.values())
+
+    category = str(row.get('category', '')).strip().lower()
+    if category and category not in CATEGORIES:
+        raise ValueError(f'Unknown category "{category}".')
+    payment_method = str(row.get('payment_method', '')).strip().lower()
+    if payment_method and payment_method not in PAYMENT_METHODS:
+        raise ValueError(f'Unknown payment method "{payment_method}".')
+    currency = str(row.get('currency', '')).strip().upper() or 'INR'
+    if currency not in CURRENCIES:
+        raise ValueError(f'Unknown currency "{currency}".')
+    # Rates are LRU-cached per (currency, date); a missing rate rejects the row
+    base_amount = convert(amount, currency, event.base_currency, date)
+    approval_status = str(row.get('approval_status', '')).strip().capitalize() or 'Pending'
+    if approval_status not in APPROVAL_STATUSES:
+        raise ValueError(f'Unknown approval status "{approval_status}".')
+
+    expense = Expense(
+        event=event,
+        description=description[:255],
+        date=date,
+        amount=amount,
+        base_amount=base_amount,
+        payer=payer,
+        category=category,
+        payment_method=payment_method,
+        currency=currency,
+        approval_status=approval_status,
+        location=str(row.get('location', '')).strip()[:50],
+        notes=str(row.get('notes', '')).strip(),
+    )
+    return expense, contributors
+
+
+def write_chunk(chunk):
+    expenses = Expense.objects.bulk_create([expense for expense, _ in chunk])
+    ExpenseShare.objects.bulk_create([
+        share
+        for expense, (_, contributors) in zip(expenses, chunk)
+        for share in share_rows(expense, contributors)
+    ])
+    return len(expenses)
+
+
+def import_expenses(event, uploaded_file, user, chunk_size=CHUNK_SIZE):
+    result = ImportResult()
+    rows = iter_rows(uploaded_file)
+
+    header = next(rows, None)
+    if not header:
+        raise ImportFileError("The file is empty.")
+    columns = [str(name).strip().lower().replace(' ', '_') for name in header]
+    missing = [column for column in REQUIRED_COLUMNS if column not in columns]
+    if missing:
+        raise ImportFileError(f"Missing required column(s): {', '.join(missing)}.")
+
+    # One lookup map for payer and contributor names
+    members_by_name = {}
+    for member in Member.objects.filter(event=event).order_by('id'):
+        members_by_name.setdefault(member.name.strip().casefold(), member)
+
+    with transaction.atomic():
+        chunk = []
+        # Row numbers match the spreadsheet, counting the header as row 1
+        for row_number, values in enumerate(rows, start=2):
+            if not any(str(value).strip() for value in values):
+                continue
+            try:
+                expense, contributors = parse_row(dict(zip(columns, values)), event, members_by_name)
+            except ValueError as error:
+                result.add_error(row_number, str(error))
+                continue
+
+            expense.user = user
+            chunk.append((expense, contributors))
+            if len(chunk) >= chunk_size:
+                result.imported += write_chunk(chunk)
+                chunk = []
+
+        if chunk:
+            result.imported += write_chunk(chunk)
+
+    return result
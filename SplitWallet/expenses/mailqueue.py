@@ -0,0 +1,156 @@
+import logging
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .models import OutboundEmail
+
+# Outbound mail queue
+#
+# Views queue messages as OutboundEmail rows instead of talking to SMTP, so a
+# slow relay never holds up a request. A background sender thread (or the
+# send_queued_mail command) drains the queue in batches over a single
+# get_connection() connection, kept open while there is mail to send. Failed
+# deliveries are retried with exponential backoff until MAIL_QUEUE_MAX_ATTEMPTS.
+
+logger = logging.getLogger(__name__)
+
+sender_thread = None
+sender_lock = threading.Lock()
+wake_event = threading.Event()
+
+
+def queue_setting(name, default):
+    return getattr(settings, f'MAIL_QUEUE_{name}', default)
+
+
+def queue_message(message):
+    # Store an EmailMessage / EmailMultiAlternatives for background delivery
+    html_body = ''
+    for content, mimetype in getattr(message, 'alternatives', []):
+        if mimetype == 'text/html':
+            html_body = content
+
+    email = OutboundEmail.objects.create(
+        subject=message.subject,
+        body=message.body,
+        html_body=html_body,
+        from_email=message.from_email or '',
+        to=','.join(message.to),
+    )
+    transaction.on_commit(wake_sender)
+    return email
+
+
+def build_message(email, connection):
+    message = EmailMultiAlternatives(
+        email.subject,
+        email.body,
+        email.from_email or None,
+        email.to.split(','),
+        connection=connection,
+    )
+    if email.html_body:
+        message.attach_alternative(email.html_body, 'text/html')
+    return message
+
+
+def retry_delay(attempts):
+    # 1, 2, 4, 8... times the base delay, capped at an hour
+    return min(queue_setting('RETRY_DELAY', 60) * 2 ** (attempts - 1), 60 * 60)
+
+
+def claim_due(batch_size):
+    # Claim due messages one by one with a conditional UPDATE, so several
+    # senders can share the queue without delivering anything twice. While a
+    # message is Sending, next_attempt records when it was claimed.
+    now = timezone.now()
+    due_ids = OutboundEmail.objects.filter(status='Pending', next_attempt__lte=now).order_by('next_attempt', 'id').values_list('id', flat=True)[:batch_size]
+    claimed = [email_id for email_id in due_ids if OutboundEmail.objects.filter(pk=email_id, status='Pending').update(status='Sending', next_attempt=now)]
+    return list(OutboundEmail.objects.filter(pk__in=claimed).order_by('id'))
+
+
+def record_failure(email, error):
+    email.attempts += 1
+    email.last_error = str(error) or error.__class__.__name__
+    if email.attempts >= queue_setting('MAX_ATTEMPTS', 5):
+        email.status = 'Failed'
+        logger.error("Giving up on email #%s to %s: %s", email.id, email.to, email.last_error)
+    else:
+        email.status = 'Pending'
+        email.next_attempt = timezone.now() + timedelta(seconds=retry_delay(email.attempts))
+    email.save(update_fields=['attempts', 'last_error', 'status', 'next_attempt'])
+
+
+def deliver(email, connection):
+    try:
+        build_message(email, connection).send()
+    except Exception as error:
+        record_failure(email, error)
+        return False
+
+    email.attempts += 1
+    email.status = 'Sent'
+    email.sent_date = timezone.now()
+    email.save(update_fields=['attempts', 'status', 'sent_date'])
+    return True
+
+
+def send_queued_mail(batch_size=None, connection=None):
+    # Deliver every due message; returns (sent, failed) counts
+    batch_size = batch_size or queue_setting('BATCH_SIZE', 50)
+    sent = failed = 0
+    connection = connection or get_connection(backend=queue_setting('BACKEND', settings.EMAIL_BACKEND))
+    batch = claim_due(batch_size)
+    if not batch:
+        return sent, failed
+
+    try:
+        connection.open()
+    except Exception as error:
+        # Relay unreachable: put the batch back and let the backoff handle it
+        for email in batch:
+            record_failure(email, error)
+        logger.warning("Could not connect to the mail server: %s", error)
+        return sent, len(batch)
+
+    try:
+        while batch:
+            for email in batch:
+                if deliver(email, connection):
+                    sent += 1
+                else:
+                    failed += 1
+            batch = claim_due(batch_size)
+    finally:
+        connection.close()
+    return sent, failed
+
+
+def sender_loop():
+    while True:
+        wake_event.wait(timeout=queue_setting('POLL_INTERVAL', 30))
+        wake_event.clear()
+        close_old_connections()
+        try:
+            send_queued_mail()
+        except Exception:
+            logger.exception("Mail queue sender failed")
+        finally:
+            close_old_connections()
+
+
+def wake_sender():
+    global sender_thread
+    if not queue_setting('SENDER_THREAD', True):
+        # Delivery is left to the send_queued_mail command
+        return
+    with sender_lock:
+        if sender_thread is None or not sender_thread.is_alive():
+            sender_thread = threading.Thread(target=sender_loop, name='mail-queue-sender', daemon=True)
+            sender_thread.start()
+    wake_event.set()
@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from expenses.analytics import bump_analytics_version
+from expenses.currency import convert_expenses, ExchangeRateMissing
+from expenses.models import Event, Expense
+from expenses.settlements import mark_settlement_stale
+from expenses.splits import update_shares
+from expenses.totals import refresh_event_totals
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill in base_amount for every expense, including those already in the event's base currency, then re-split them "
+        "and rebuild the event totals. Run once after the migration that adds base_amount and ExpenseShare.share: existing "
+        "rows start at 0 and everything sums those columns. Safe to re-run; events that already match are left alone."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--event', type=int, action='append', help="Only process this event id (repeatable).")
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        events = Event.objects.order_by('id')
+        if options['event']:
+            events = events.filter(id__in=options['event'])
+
+        backfilled = 0
+        for event in events.iterator():
+            expenses = Expense.objects.filter(event=event)
+            try:
+                with transaction.atomic():
+                    converted = len(convert_expenses(expenses, chunk_size=options['batch_size']))
+                    # Shares of every expense, not just the converted ones: rows
+                    # carried over from the old contributors table have share 0
+                    expense_ids = list(expenses.values_list('id', flat=True))
+                    resplit = 0
+                    for start in range(0, len(expense_ids), options['batch_size']):
+                        resplit += update_shares(expense_ids[start:start + options['batch_size']])
+                    if converted or resplit:
+                        refresh_event_totals(event)
+                        mark_settlement_stale(event)
+            except ExchangeRateMissing as error:
+                raise CommandError(f"Event #{event.id} ({event.title}): {error}")
+            if converted or resplit:
+                backfilled += 1
+                bump_analytics_version(event.user_id)
+                self.stdout.write(f"Event #{event.id} ({event.title}): {converted} base amount(s), {resplit} share(s) updated")
+
+        self.stdout.write(self.style.SUCCESS(f"Backfilled {backfilled} event(s)."))
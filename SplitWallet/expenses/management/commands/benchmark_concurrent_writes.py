@@ -0,0 +1,126 @@
+import multiprocessing
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, transaction, OperationalError
+from django.db.models import Count
+from django.test import Client
+from django.urls import reverse
+
+from expenses.db import current_pragmas
+from expenses.models import Event, Expense, Member
+from expenses.settlements import mark_settlement_stale
+from expenses.totals import refresh_event_totals
+
+DESCRIPTION_PREFIX = 'Concurrent write benchmark'
+
+
+def write_expenses(user_id, event_id, writes, worker):
+    # One worker: posts `writes` expenses through event_details, which saves
+    # them with handle_expense_form. Returns (latencies in ms, error messages).
+    event = Event.objects.get(pk=event_id)
+    member_ids = list(Member.objects.filter(event=event).values_list('id', flat=True))
+    client = Client()
+    client.force_login(User.objects.get(pk=user_id))
+    url = reverse('event_details', args=[event_id])
+
+    latencies = []
+    errors = []
+    for i in range(writes):
+        data = {
+            'add_expense': '1',
+            'description': f'{DESCRIPTION_PREFIX} {worker}-{i}',
+            'date': event.start_date.isoformat(),
+            'amount': '100.00',
+            'payer': member_ids[i % len(member_ids)],
+            'contributors': member_ids,
+            'currency': event.base_currency,
+            'approval_status': 'Pending',
+        }
+        start = time.perf_counter()
+        try:
+            client.post(url, data)
+        except OperationalError as error:
+            errors.append(str(error))
+            continue
+        latencies.append((time.perf_counter() - start) * 1000)
+    connections.close_all()
+    return latencies, errors
+
+
+def write_expenses_in_process(args):
+    return write_expenses(*args)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Post expenses to one event from several concurrent workers (threads, or forked processes like "
+        "gunicorn workers) through handle_expense_form, and report throughput, latency and lock errors "
+        "for the active DATABASE_PROFILE. The benchmark expenses are deleted afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help="Username to write as (defaults to the user with the most expenses).")
+        parser.add_argument('--event', type=int, help="Event id to write to (defaults to the user's largest event).")
+        parser.add_argument('--workers', type=int, default=8)
+        parser.add_argument('--writes', type=int, default=25, help="Expenses posted by each worker.")
+        parser.add_argument('--processes', action='store_true', help="Use forked processes instead of threads.")
+        parser.add_argument('--keep', action='store_true', help="Keep the benchmark expenses.")
+
+    def handle(self, *args, **options):
+        if options['user']:
+            user = User.objects.filter(username=options['user']).first()
+        else:
+            user = User.objects.annotate(count=Count('expense')).order_by('-count').first()
+        if user is None:
+            raise CommandError("No users found. Run seed_benchmark first.")
+        events = Event.objects.filter(user=user)
+        if options['event']:
+            events = events.filter(id=options['event'])
+        event = events.order_by('-expense_count').first()
+        if event is None or not Member.objects.filter(event=event).exists():
+            raise CommandError(f"User {user.username} has no event with members.")
+
+        self.stdout.write(f"Profile: {settings.DATABASE_PROFILE} ({connection.vendor})")
+        if connection.vendor == 'sqlite':
+            pragmas = ', '.join(f'{name}={value}' for name, value in current_pragmas(connection).items())
+            self.stdout.write(f"Pragmas: {pragmas}")
+
+        jobs = [(user.id, event.id, options['writes'], worker) for worker in range(options['workers'])]
+        start = time.perf_counter()
+        if options['processes']:
+            # Forked children must not share the parent's open connections
+            connections.close_all()
+            with multiprocessing.get_context('fork').Pool(options['workers']) as pool:
+                results = pool.map(write_expenses_in_process, jobs)
+        else:
+            with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+                results = list(executor.map(lambda job: write_expenses(*job), jobs))
+        elapsed = time.perf_counter() - start
+
+        latencies = [latency for worker_latencies, _ in results for latency in worker_latencies]
+        errors = [error for _, worker_errors in results for error in worker_errors]
+        benchmark_expenses = Expense.objects.filter(event=event, description__startswith=DESCRIPTION_PREFIX)
+        saved = benchmark_expenses.count()
+
+        attempted = options['workers'] * options['writes']
+        self.stdout.write(f"Writes: {saved}/{attempted} saved in {elapsed:.2f} s ({saved / elapsed:.1f} writes/s)")
+        if latencies:
+            self.stdout.write(f"Latency: p50 {statistics.median(latencies):.1f} ms, p95 {percentile(latencies, 0.95):.1f} ms")
+        if errors:
+            self.stdout.write(self.style.ERROR(f"{len(errors)} database error(s), e.g. {errors[0]}"))
+
+        if not options['keep']:
+            with transaction.atomic():
+                benchmark_expenses.delete()
+                refresh_event_totals(event)
+                mark_settlement_stale(event)
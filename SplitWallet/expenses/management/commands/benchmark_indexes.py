@@ -0,0 +1,94 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count, Sum
+
+from expenses.models import Event, Member, Expense
+
+
+class Command(BaseCommand):
+    help = (
+        "Show query plans and timings for the hot Expense/Member filters with and without "
+        "the composite indexes declared on the models. Runs against the configured database "
+        "(seed it first, e.g. with seed_benchmark)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20, help="Times each query is run per measurement.")
+        parser.add_argument('--event', type=int, help="Event id to query (defaults to the event with the most expenses).")
+
+    def handle(self, *args, **options):
+        if options['event']:
+            event = Event.objects.filter(id=options['event']).first()
+        else:
+            event = Event.objects.annotate(count=Count('expense')).order_by('-count').first()
+        if event is None:
+            raise CommandError("No events found. Seed the database first.")
+
+        member = Member.objects.filter(event=event).first()
+        self.stdout.write(f"Benchmarking event #{event.id} ({event.expense_count} expenses) on {connection.vendor}\n")
+
+        queries = {
+            'event total': lambda: Expense.objects.filter(event=event).aggregate(Sum('base_amount')),
+            'payer total': lambda: Expense.objects.filter(event=event, payer=member).aggregate(Sum('base_amount')),
+            'event listing': lambda: list(Expense.objects.filter(event=event)[:50]),
+            'approved count': lambda: Expense.objects.filter(event=event, approval_status='Approved').count(),
+            'user categories': lambda: list(Expense.objects.filter(user=event.user).values('category').annotate(total=Sum('base_amount'))),
+            'member name check': lambda: Member.objects.filter(event=event, name=member.name if member else '').first(),
+        }
+        plans = {
+            'event total': Expense.objects.filter(event=event).values('event').annotate(total=Sum('base_amount')),
+            'payer total': Expense.objects.filter(event=event, payer=member).values('event').annotate(total=Sum('base_amount')),
+            'event listing': Expense.objects.filter(event=event)[:50],
+            'approved count': Expense.objects.filter(event=event, approval_status='Approved').order_by().values('event').annotate(count=Count('id')),
+            'user categories': Expense.objects.filter(user=event.user).values('category').annotate(total=Sum('base_amount')),
+            'member name check': Member.objects.filter(event=event, name=member.name if member else ''),
+        }
+
+        indexes = [(Expense, index) for index in Expense._meta.indexes] + [(Member, index) for index in Member._meta.indexes]
+
+        self.drop_indexes(indexes)
+        try:
+            before = self.measure(queries, plans, options['repeat'], "without composite indexes")
+        finally:
+            self.create_indexes(indexes)
+        after = self.measure(queries, plans, options['repeat'], "with composite indexes")
+
+        self.stdout.write(self.style.MIGRATE_HEADING("\nSummary (ms per query)"))
+        for name in queries:
+            speedup = before[name] / after[name] if after[name] else 0
+            self.stdout.write(f"  {name:<20} {before[name]:>10.3f} -> {after[name]:>10.3f}  ({speedup:.1f}x)")
+
+    def measure(self, queries, plans, repeat, label):
+        self.stdout.write(self.style.MIGRATE_HEADING(f"\nQuery plans {label}"))
+        timings = {}
+        for name, run in queries.items():
+            self.stdout.write(f"-- {name}")
+            self.stdout.write(plans[name].explain())
+            run()
+            start = time.perf_counter()
+            for _ in range(repeat):
+                run()
+            timings[name] = (time.perf_counter() - start) * 1000 / repeat
+        return timings
+
+    def drop_indexes(self, indexes):
+        existing = {}
+        for model, index in indexes:
+            table = model._meta.db_table
+            if table not in existing:
+                with connection.cursor() as cursor:
+                    existing[table] = connection.introspection.get_constraints(cursor, table)
+            if index.name in existing[table]:
+                with connection.schema_editor() as editor:
+                    editor.remove_index(model, index)
+
+    def create_indexes(self, indexes):
+        for model, index in indexes:
+            with connection.schema_editor() as editor:
+                editor.add_index(model, index)
+        # Refresh planner statistics so the new indexes are considered
+        if connection.vendor in ('sqlite', 'postgresql'):
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
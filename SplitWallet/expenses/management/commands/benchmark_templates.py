@@ -0,0 +1,91 @@
+import copy
+import re
+import statistics
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from expenses.models import Event
+
+SOURCE_LOADERS = [
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+]
+
+TEMPLATE_TIMING = re.compile(r'tpl;dur=([\d.]+)')
+
+
+def templates_with(loaders):
+    templates = copy.deepcopy(settings.TEMPLATES)
+    templates[0]['APP_DIRS'] = False
+    templates[0]['OPTIONS']['loaders'] = loaders
+    return templates
+
+
+def caches_with(fragments_enabled):
+    caches = copy.deepcopy(settings.CACHES)
+    if not fragments_enabled:
+        caches['template_fragments'] = {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+    return caches
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare template render time on home and event_details with no template caching, "
+        "with the cached loader, and with the cached loader plus base.html fragment caching."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help="Username to benchmark as (defaults to the user with the most expenses).")
+        parser.add_argument('--event', type=int, help="Event id to benchmark (defaults to the user's largest event).")
+        parser.add_argument('--repeat', type=int, default=50)
+
+    def handle(self, *args, **options):
+        if 'expenses.middleware.PerformanceMiddleware' not in settings.MIDDLEWARE:
+            raise CommandError("PerformanceMiddleware must be enabled; template times are read from its Server-Timing header.")
+
+        if options['user']:
+            user = User.objects.filter(username=options['user']).first()
+        else:
+            user = User.objects.annotate(count=Count('expense')).order_by('-count').first()
+        if user is None:
+            raise CommandError("No users found. Run seed_benchmark first.")
+        events = Event.objects.filter(user=user)
+        if options['event']:
+            events = events.filter(id=options['event'])
+        event = events.order_by('-expense_count').first()
+        if event is None:
+            raise CommandError(f"User {user.username} has no events.")
+
+        pages = [
+            ('home', reverse('home')),
+            ('event_details', reverse('event_details', args=[event.id])),
+        ]
+        modes = [
+            ('no caching', SOURCE_LOADERS, False),
+            ('cached loader', [('django.template.loaders.cached.Loader', SOURCE_LOADERS)], False),
+            ('cached loader + fragments', [('django.template.loaders.cached.Loader', SOURCE_LOADERS)], True),
+        ]
+
+        baseline = {}
+        for mode, loaders, fragments_enabled in modes:
+            with override_settings(TEMPLATES=templates_with(loaders), CACHES=caches_with(fragments_enabled)):
+                client = Client()
+                client.force_login(user)
+                for name, url in pages:
+                    # One warm-up request fills the loader and fragment caches
+                    client.get(url)
+                    timings = []
+                    for _ in range(options['repeat']):
+                        response = client.get(url)
+                        match = TEMPLATE_TIMING.search(response.get('Server-Timing', ''))
+                        timings.append(float(match.group(1)) if match else 0.0)
+
+                    median = statistics.median(timings)
+                    baseline.setdefault(name, median)
+                    change = (1 - median / baseline[name]) * 100 if baseline[name] else 0
+                    self.stdout.write(f"{mode:<28} {name:<16} {median:>8.2f} ms template p50 ({change:>5.1f}% faster)")
@@ -0,0 +1,67 @@
+import csv
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F
+
+from expenses.analytics import bump_analytics_version
+from expenses.currency import clear_rate_cache, quote_currency, reconvert_expenses, ExchangeRateMissing
+from expenses.models import Event, Expense, ExchangeRate, CURRENCY_CHOICES
+from expenses.settlements import mark_settlement_stale
+from expenses.totals import refresh_event_totals
+
+CURRENCIES = {value for value, _ in CURRENCY_CHOICES}
+
+
+class Command(BaseCommand):
+    help = (
+        "Load daily exchange rates from a CSV file with date (YYYY-MM-DD), currency and rate columns. "
+        "Rates are units of FX_QUOTE_CURRENCY per unit of currency; existing rows for the same day are replaced."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--reconvert', action='store_true', help="Recompute base amounts and totals of foreign-currency expenses afterwards.")
+
+    def handle(self, *args, **options):
+        rates = []
+        with open(options['path'], newline='', encoding='utf-8-sig') as csv_file:
+            for line, row in enumerate(csv.DictReader(csv_file), start=2):
+                try:
+                    currency = row['currency'].strip().upper()
+                    if currency not in CURRENCIES:
+                        raise ValueError(f'unknown currency "{currency}"')
+                    rates.append(ExchangeRate(currency=currency, date=date.fromisoformat(row['date'].strip()), rate=Decimal(row['rate'].strip())))
+                except (KeyError, ValueError, InvalidOperation) as error:
+                    raise CommandError(f"Line {line}: {error}")
+
+        ExchangeRate.objects.bulk_create(
+            rates,
+            batch_size=options['batch_size'],
+            update_conflicts=True,
+            unique_fields=['currency', 'date'],
+            update_fields=['rate'],
+        )
+        clear_rate_cache()
+        # Analytics rollups convert events in other currencies to FX_QUOTE_CURRENCY
+        bump_analytics_version(*Event.objects.exclude(base_currency=quote_currency()).values_list('user_id', flat=True).distinct())
+        self.stdout.write(self.style.SUCCESS(f"Loaded {len(rates)} exchange rate(s)."))
+
+        if options['reconvert']:
+            expenses = Expense.objects.exclude(currency=F('event__base_currency'))
+            event_ids = set(expenses.values_list('event_id', flat=True).distinct())
+            for event in Event.objects.filter(id__in=event_ids).order_by('id'):
+                try:
+                    with transaction.atomic():
+                        changed = reconvert_expenses(expenses.filter(event=event))
+                        if changed:
+                            refresh_event_totals(event)
+                            mark_settlement_stale(event)
+                except ExchangeRateMissing as error:
+                    raise CommandError(f"Event #{event.id} ({event.title}): {error}")
+                if changed:
+                    bump_analytics_version(event.user_id)
+                    self.stdout.write(f"Reconverted {changed} expense(s) in event #{event.id} ({event.title})")
@@ -0,0 +1,28 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from expenses.models import ReportJob
+from expenses.reports import run_report_job
+
+
+class Command(BaseCommand):
+    help = "Render queued PDF report jobs, e.g. ones left pending when the server restarted."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stale-minutes', type=int, default=30, help="Requeue jobs stuck in Running for longer than this.")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(minutes=options['stale_minutes'])
+        requeued = ReportJob.objects.filter(status='Running', updated_date__lt=cutoff).update(status='Pending')
+        if requeued:
+            self.stdout.write(f"Requeued {requeued} stale job(s)")
+
+        job_ids = list(ReportJob.objects.filter(status='Pending').order_by('created_date').values_list('id', flat=True))
+        for job_id in job_ids:
+            run_report_job(job_id)
+            job = ReportJob.objects.get(pk=job_id)
+            self.stdout.write(f"Report job #{job_id}: {job.status}")
+
+        self.stdout.write(self.style.SUCCESS(f"Processed {len(job_ids)} report job(s)."))
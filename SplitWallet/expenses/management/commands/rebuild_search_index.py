@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from expenses.search import install_search_index
+
+
+class Command(BaseCommand):
+    help = "Drop and recreate the expense full-text search table and triggers, then reindex every expense."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        if not install_search_index(options['database'], rebuild=True):
+            raise CommandError("Full-text search needs SQLite (FTS5) or PostgreSQL; other databases use the icontains fallback.")
+        self.stdout.write(self.style.SUCCESS("Search index rebuilt."))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from expenses.models import Event
+from expenses.totals import refresh_event_totals, verify_event_totals
+
+
+class Command(BaseCommand):
+    help = "Rebuild (or, with --verify, check) the running expense totals stored on events and members."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--event', type=int, action='append', help="Only process this event id (repeatable).")
+        parser.add_argument('--verify', action='store_true', help="Compare stored totals with a full recompute without writing.")
+
+    def handle(self, *args, **options):
+        events = Event.objects.order_by('id')
+        if options['event']:
+            events = events.filter(id__in=options['event'])
+
+        failures = 0
+        for event in events.iterator():
+            if options['verify']:
+                problems = verify_event_totals(event)
+                if problems:
+                    failures += 1
+                    self.stdout.write(self.style.ERROR(f"Event #{event.id} ({event.title}):"))
+                    for problem in problems:
+                        self.stdout.write(f"  {problem}")
+            else:
+                refresh_event_totals(event)
+                self.stdout.write(f"Rebuilt totals for event #{event.id} ({event.title})")
+
+        if failures:
+            raise CommandError(f"{failures} event(s) have stale totals. Run rebuild_totals to fix them.")
+        if options['verify']:
+            self.stdout.write(self.style.SUCCESS("All event totals match."))
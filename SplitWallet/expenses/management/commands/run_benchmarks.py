@@ -0,0 +1,101 @@
+import json
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from expenses.models import Event, Member
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive the main pages and analytics JSON endpoints through the test client and write "
+        "p50/p95 latency and query counts to a JSON file, for comparing runs between commits."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help="Username to benchmark as (defaults to the user with the most expenses).")
+        parser.add_argument('--event', type=int, help="Event id to benchmark (defaults to the user's largest event).")
+        parser.add_argument('--repeat', type=int, default=10)
+        parser.add_argument('--output', default='benchmark_results.json')
+        parser.add_argument('--label', default='', help="Free-form label stored with the results, e.g. a commit hash.")
+
+    def handle(self, *args, **options):
+        if options['user']:
+            user = User.objects.filter(username=options['user']).first()
+        else:
+            user = User.objects.annotate(count=Count('expense')).order_by('-count').first()
+        if user is None:
+            raise CommandError("No users found. Run seed_benchmark first.")
+
+        events = Event.objects.filter(user=user)
+        if options['event']:
+            events = events.filter(id=options['event'])
+        event = events.order_by('-expense_count').first()
+        if event is None:
+            raise CommandError(f"User {user.username} has no events.")
+        member = Member.objects.filter(event=event).first()
+
+        client = Client()
+        client.force_login(user)
+
+        targets = [
+            ('home', 'get', reverse('home'), None),
+            ('event_details', 'get', reverse('event_details', args=[event.id]), None),
+            ('generate_report', 'post', reverse('generate_report', args=[event.id]), {'user_select': member.id if member else ''}),
+            ('settlement', 'get', reverse('settlement', args=[event.id]), None),
+            ('expense_audit_trail', 'get', reverse('expense_audit_trail', args=[event.id]), None),
+            ('api_event_expenses', 'get', reverse('api_event_expenses', args=[event.id]), {'fields': 'id,date,description,amount,payer,contributors'}),
+            ('analytics_data', 'get', reverse('analytics_data'), None),
+            ('analytics_data_by_month', 'get', reverse('analytics_data_by_month'), None),
+            ('analytics_data_by_year', 'get', reverse('analytics_data_by_year'), None),
+            ('expense_by_category', 'get', reverse('expense_by_category'), None),
+            ('percentage_by_category', 'get', reverse('percentage_by_category'), None),
+            ('expense_and_event_by_month_and_day', 'get', reverse('expense_and_event_by_month_and_day'), None),
+            ('category_distribution', 'get', reverse('category_distribution', args=[event.id]), None),
+        ]
+        if member:
+            targets.append(('selected_user_expenses', 'get', reverse('selected_user_expenses', args=[event.id, member.id]), None))
+
+        results = {}
+        for name, method, url, data in targets:
+            timings = []
+            queries = []
+            status = None
+            for _ in range(options['repeat']):
+                with CaptureQueriesContext(connection) as context:
+                    start = time.perf_counter()
+                    response = getattr(client, method)(url, data or {})
+                    timings.append((time.perf_counter() - start) * 1000)
+                queries.append(len(context.captured_queries))
+                status = response.status_code
+
+            timings.sort()
+            results[name] = {
+                'status': status,
+                'p50_ms': round(statistics.median(timings), 2),
+                'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 2),
+                'queries': max(queries),
+            }
+            self.stdout.write(f"{name:<36} {results[name]['p50_ms']:>9.2f} ms p50 {results[name]['p95_ms']:>9.2f} ms p95 {results[name]['queries']:>5} queries")
+
+        report = {
+            'label': options['label'],
+            'timestamp': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'user': user.username,
+            'event': event.id,
+            'event_expenses': event.expense_count,
+            'repeat': options['repeat'],
+            'results': results,
+        }
+        with open(options['output'], 'w') as output:
+            json.dump(report, output, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
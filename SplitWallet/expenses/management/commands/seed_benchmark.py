@@ -0,0 +1,117 @@
+import random
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from faker import Faker
+
+from expenses.models import Event, Member, Expense, CATEGORY_CHOICES, PAYMENT_METHOD_CHOICES
+from expenses.splits import share_rows
+from expenses.totals import refresh_event_totals
+
+
+class Command(BaseCommand):
+    help = "Generate synthetic users, events, members and expenses for benchmarking."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=5)
+        parser.add_argument('--events', type=int, default=10, help="Events per user.")
+        parser.add_argument('--members', type=int, default=8, help="Members per event.")
+        parser.add_argument('--expenses', type=int, default=200, help="Expenses per event.")
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=42, help="Random seed, so runs are reproducible.")
+        parser.add_argument('--password', default='benchmark', help="Password for every generated user.")
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        fake = Faker()
+        fake.seed_instance(options['seed'])
+        batch_size = options['batch_size']
+        run_id = uuid.uuid4().hex[:8]
+
+        categories = [value for value, _ in CATEGORY_CHOICES]
+        payment_methods = [value for value, _ in PAYMENT_METHOD_CHOICES]
+        statuses = ['Pending', 'Approved', 'Rejected']
+        # Hashing is deliberately slow, so every user shares one hash
+        password = make_password(options['password'])
+
+        with transaction.atomic():
+            users = User.objects.bulk_create([
+                User(username=f"bench_{run_id}_{i}", email=f"bench_{run_id}_{i}@example.com", password=password)
+                for i in range(options['users'])
+            ], batch_size=batch_size)
+
+            events = []
+            for user in users:
+                for i in range(options['events']):
+                    start_date = fake.date_between(start_date='-3y', end_date='today')
+                    events.append(Event(
+                        user=user,
+                        title=f"{fake.city()} {fake.word().title()} {run_id}-{user.id}-{i}",
+                        description=fake.sentence(),
+                        start_date=start_date,
+                        end_date=start_date + timedelta(days=rng.randint(1, 14)),
+                        location=fake.city(),
+                    ))
+            events = Event.objects.bulk_create(events, batch_size=batch_size)
+
+            members = Member.objects.bulk_create([
+                Member(user=event.user, event=event, name=fake.name())
+                for event in events for _ in range(options['members'])
+            ], batch_size=batch_size)
+            members_by_event = {}
+            for member in members:
+                members_by_event.setdefault(member.event_id, []).append(member)
+
+            through_model = Expense.contributors.through
+            expense_count = 0
+            for event in events:
+                event_members = members_by_event[event.id]
+                span = (event.end_date - event.start_date).days
+                pending = []
+                for _ in range(options['expenses']):
+                    amount = Decimal(rng.randint(100, 500000)) / 100
+                    pending.append(Expense(
+                        user=event.user,
+                        event=event,
+                        description=fake.catch_phrase()[:255],
+                        date=event.start_date + timedelta(days=rng.randint(0, span)),
+                        amount=amount,
+                        base_amount=amount,
+                        payer=rng.choice(event_members),
+                        notes=fake.sentence() if rng.random() < 0.3 else '',
+                        category=rng.choice(categories),
+                        location=fake.city()[:50],
+                        payment_method=rng.choice(payment_methods),
+                        approval_status=rng.choices(statuses, weights=[3, 6, 1])[0],
+                    ))
+                    if len(pending) >= batch_size:
+                        expense_count += self.insert_expenses(pending, event_members, rng, through_model, batch_size)
+                        pending = []
+                if pending:
+                    expense_count += self.insert_expenses(pending, event_members, rng, through_model, batch_size)
+
+            for event in events:
+                refresh_event_totals(event)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {len(users)} users, {len(events)} events, {len(members)} members and {expense_count} expenses "
+            f"(usernames bench_{run_id}_*, password '{options['password']}')."
+        ))
+
+    def insert_expenses(self, expenses, members, rng, through_model, batch_size):
+        expenses = Expense.objects.bulk_create(expenses, batch_size=batch_size)
+        links = []
+        for expense in expenses:
+            # Most expenses are shared by everyone, the rest by a random subset
+            if rng.random() < 0.6:
+                contributors = members
+            else:
+                contributors = rng.sample(members, rng.randint(1, len(members)))
+            links.extend(share_rows(expense, contributors))
+        through_model.objects.bulk_create(links, batch_size=batch_size)
+        return len(expenses)
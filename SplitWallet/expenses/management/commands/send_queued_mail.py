@@ -0,0 +1,25 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from expenses.mailqueue import send_queued_mail
+from expenses.models import OutboundEmail
+
+
+class Command(BaseCommand):
+    help = "Deliver queued outbound email that is due, over a single mail server connection."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help="Messages claimed per batch (default MAIL_QUEUE_BATCH_SIZE).")
+        parser.add_argument('--stale-minutes', type=int, default=30, help="Requeue messages stuck in Sending for longer than this.")
+
+    def handle(self, *args, **options):
+        # Messages claimed by a sender that died before finishing
+        cutoff = timezone.now() - timedelta(minutes=options['stale_minutes'])
+        requeued = OutboundEmail.objects.filter(status='Sending', next_attempt__lt=cutoff).update(status='Pending')
+        if requeued:
+            self.stdout.write(f"Requeued {requeued} stale message(s)")
+
+        sent, failed = send_queued_mail(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Sent {sent} message(s), {failed} failed."))
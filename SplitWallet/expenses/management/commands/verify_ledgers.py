@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from expenses.models import Event, Expense
+from expenses.splits import update_shares
+from expenses.totals import refresh_event_totals, verify_event_totals
+
+
+class Command(BaseCommand):
+    help = (
+        "Check every event's stored expense shares, running totals and member ledger (amount_paid / amount_owed) against a full "
+        "recompute from its expenses. With --fix, mismatched events are rebuilt."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--event', type=int, action='append', help="Only check this event id (repeatable).")
+        parser.add_argument('--fix', action='store_true', help="Rebuild the events that do not match.")
+
+    def handle(self, *args, **options):
+        events = Event.objects.order_by('id')
+        if options['event']:
+            events = events.filter(id__in=options['event'])
+
+        checked = 0
+        mismatched = 0
+        for event in events.iterator():
+            checked += 1
+            problems = []
+            expense_ids = list(Expense.objects.filter(event=event).values_list('id', flat=True))
+            stale_shares = update_shares(expense_ids, commit=False)
+            if stale_shares:
+                problems.append(f"{stale_shares} stored share(s) differ from a fresh split")
+            problems += verify_event_totals(event)
+            if not problems:
+                continue
+            mismatched += 1
+            self.stdout.write(self.style.ERROR(f"Event #{event.id} ({event.title}):"))
+            for problem in problems:
+                self.stdout.write(f"  {problem}")
+            if options['fix']:
+                update_shares(expense_ids)
+                refresh_event_totals(event)
+                self.stdout.write("  rebuilt")
+
+        if mismatched and not options['fix']:
+            raise CommandError(f"{mismatched} of {checked} event ledger(s) do not match. Run verify_ledgers --fix to rebuild them.")
+        self.stdout.write(self.style.SUCCESS(f"Checked {checked} event ledger(s), {mismatched} rebuilt." if mismatched else f"All {checked} event ledger(s) match."))
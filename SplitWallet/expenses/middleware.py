@@ -1,11 +1,201 @@
+import contextvars
+import functools
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
 from django.shortcuts import redirect
+from django.template.base import Template
 from django.urls import reverse
 
+logger = logging.getLogger(__name__)
+
+
+# Both middlewares below also run natively under ASGI, so async views are
+# not pushed onto a thread on their way through the stack.
+
 class AlreadyLoggedMiddleware:
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request):
-        if request.user.is_authenticated and request.path in [reverse('login'), reverse('signup')]:
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if request.path in [reverse('login'), reverse('signup')] and request.user.is_authenticated:
             return redirect('home')  # Replace 'home' with the desired URL
-        return self.get_response(request)
\ No newline at end of file
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        # Only the login and signup pages need the user, so other requests skip the session lookup
+        if request.path in [reverse('login'), reverse('signup')] and (await request.auser()).is_authenticated:
+            return redirect('home')
+        return await self.get_response(request)
+
+
+# Request instrumentation
+#
+# Records SQL count, SQL time, template render time and total latency per URL
+# name. Figures are sent back in a Server-Timing header and kept in a rolling
+# in-memory history that the staff-only performance_stats view reports on.
+# settings.PERFORMANCE_QUERY_BUDGETS maps URL names to a maximum query count;
+# PERFORMANCE_BUDGET_ACTION decides whether going over it logs or raises.
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+_request_timings = contextvars.ContextVar('request_timings', default=None)
+_history = {}
+_history_lock = threading.Lock()
+
+
+def _timed_template_render(render):
+    # Only the outermost render is timed; included templates are part of it
+    @functools.wraps(render)
+    def wrapper(self, context):
+        timings = _request_timings.get()
+        if timings is None or timings['template_depth']:
+            return render(self, context)
+        timings['template_depth'] += 1
+        start = time.perf_counter()
+        try:
+            return render(self, context)
+        finally:
+            timings['template'] += time.perf_counter() - start
+            timings['template_depth'] -= 1
+    wrapper.instrumented = True
+    return wrapper
+
+
+if not getattr(Template.render, 'instrumented', False):
+    Template.render = _timed_template_render(Template.render)
+
+
+def record_timing(url_name, sample):
+    size = getattr(settings, 'PERFORMANCE_HISTORY_SIZE', 500)
+    with _history_lock:
+        samples = _history.get(url_name)
+        if samples is None:
+            samples = _history[url_name] = deque(maxlen=size)
+        samples.append(sample)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def timing_summary():
+    with _history_lock:
+        history = {url_name: list(samples) for url_name, samples in _history.items()}
+
+    summary = {}
+    for url_name, samples in history.items():
+        summary[url_name] = {'requests': len(samples)}
+        for key in ('queries', 'sql_ms', 'template_ms', 'total_ms'):
+            values = [sample[key] for sample in samples]
+            summary[url_name][key] = {
+                'p50': percentile(values, 0.5),
+                'p95': percentile(values, 0.95),
+                'max': max(values),
+            }
+    return summary
+
+
+def reset_timings():
+    with _history_lock:
+        _history.clear()
+
+
+class PerformanceMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def start_timing(self, stack):
+        timings = {'queries': 0, 'sql': 0.0, 'template': 0.0, 'template_depth': 0}
+        token = _request_timings.set(timings)
+        stack.callback(_request_timings.reset, token)
+        return timings
+
+    def count_queries(self, timings, stack):
+        # Connections are per thread, so this has to run in the thread that
+        # will execute the request's queries
+        def count_query(execute, sql, params, many, context):
+            start = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                timings['queries'] += 1
+                timings['sql'] += time.perf_counter() - start
+
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(count_query))
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            timings = self.start_timing(stack)
+            self.count_queries(timings, stack)
+            response = self.get_response(request)
+        return self.finish(request, response, timings, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        # Async ORM queries run through thread-sensitive sync_to_async, i.e.
+        # on the request's one sync thread with that thread's connections.
+        # The execute wrappers are installed (and removed) on that thread.
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            timings = self.start_timing(stack)
+            query_stack = ExitStack()
+            await sync_to_async(self.count_queries, thread_sensitive=True)(timings, query_stack)
+            try:
+                response = await self.get_response(request)
+            finally:
+                await sync_to_async(query_stack.close, thread_sensitive=True)()
+        return self.finish(request, response, timings, time.perf_counter() - start)
+
+    def finish(self, request, response, timings, total):
+        match = getattr(request, 'resolver_match', None)
+        url_name = match.url_name if match and match.url_name else 'unresolved'
+        sample = {
+            'queries': timings['queries'],
+            'sql_ms': round(timings['sql'] * 1000, 2),
+            'template_ms': round(timings['template'] * 1000, 2),
+            'total_ms': round(total * 1000, 2),
+        }
+        record_timing(url_name, sample)
+
+        response['Server-Timing'] = (
+            f'db;dur={sample["sql_ms"]};desc="{sample["queries"]} queries", '
+            f'tpl;dur={sample["template_ms"]}, total;dur={sample["total_ms"]}'
+        )
+
+        self.check_budget(url_name, sample['queries'])
+        return response
+
+    def check_budget(self, url_name, queries):
+        budget = getattr(settings, 'PERFORMANCE_QUERY_BUDGETS', {}).get(url_name)
+        if budget is None or queries <= budget:
+            return
+
+        message = f'View "{url_name}" ran {queries} queries (budget {budget})'
+        if getattr(settings, 'PERFORMANCE_BUDGET_ACTION', 'log') == 'raise':
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
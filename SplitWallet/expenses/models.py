@@ -1,6 +1,7 @@
+from django.core.validators import MinValueValidator
 from django.db import models
-from django.db.models import Case, When, Value, BooleanField, Sum
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 
 # Create your models here.
@@ -13,6 +14,10 @@ PAYMENT_METHOD_CHOICES = [
     ('other', 'Other'),
 ]
 
+CURRENCY_CHOICES = [('INR', 'INR'), ('USD', 'USD'), ('EUR', 'EUR')]
+
+CURRENCY_SYMBOLS = {'INR': '₹', 'USD': '$', 'EUR': '€'}
+
 CATEGORY_CHOICES = [
     ('food', 'Food'),
     ('transportation', 'Transportation'),
@@ -46,18 +51,25 @@ class Event(models.Model):
     start_date = models.DateField()
     end_date = models.DateField()
     location = models.CharField(max_length=255, blank=True)
+    # Set whenever expenses change so the stored settlement plan gets rebuilt
+    settlement_stale = models.BooleanField(default=True)
+    # Running totals, maintained by expenses.totals on every expense write
+    total_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    expense_count = models.PositiveIntegerField(default=0)
+    # Currency every expense is converted to for totals and balances
+    base_currency = models.CharField(max_length=3, choices=CURRENCY_CHOICES, default='INR')
 
     def __str__(self):
         return self.title
+
+    @property
+    def currency_symbol(self):
+        return CURRENCY_SYMBOLS.get(self.base_currency, self.base_currency)
     
     def all_expenses_approved(self):
-        return self.expense_set.annotate(
-            is_approved=Case(
-                When(approval_status='Approved', then=Value(True)),
-                default=Value(False),
-                output_field=BooleanField()
-            )
-        ).aggregate(all_approved=Sum('is_approved'))['all_approved'] == self.expense_set.count()
+        # Single conditional aggregate (see expenses.approvals)
+        from .approvals import approval_summary
+        return approval_summary(self)['all_approved']
         
     class Meta:
         ordering = ['-start_date']
@@ -66,9 +78,18 @@ class Member(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     event = models.ForeignKey(Event, on_delete=models.CASCADE)
     name = models.CharField(max_length=50)
+    # Running totals, maintained by expenses.totals on every expense write
+    amount_paid = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    amount_owed = models.DecimalField(max_digits=12, decimal_places=2, default=0)
 
     def __str__(self):
         return f"{self.name}"
+
+    class Meta:
+        indexes = [
+            # Duplicate-name check in add_member / handle_member_form
+            models.Index(fields=['event', 'name'], name='member_event_name_idx'),
+        ]
     
 class Expense(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -77,11 +98,14 @@ class Expense(models.Model):
     date = models.DateField()
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     payer = models.ForeignKey(Member, on_delete=models.CASCADE, related_name='payer')
-    contributors = models.ManyToManyField(Member, related_name='contributed_expenses')
+    # Shares are stored on the through rows, see ExpenseShare
+    contributors = models.ManyToManyField(Member, related_name='contributed_expenses', through='ExpenseShare')
     notes = models.TextField(blank=True)
     document = models.FileField(upload_to='expense_documents/', blank=True, null=True)
     category = models.CharField(max_length=50, choices=CATEGORY_CHOICES, blank=True)
-    currency = models.CharField(max_length=3, choices=[('INR', 'INR'), ('USD', 'USD'), ('EUR', 'EUR')], default='INR')
+    currency = models.CharField(max_length=3, choices=CURRENCY_CHOICES, default='INR')
+    # amount in the event's base currency, set on every save (see expenses.currency)
+    base_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
     location = models.CharField(max_length=50, blank=True)
     payment_method = models.CharField(max_length=50, choices=PAYMENT_METHOD_CHOICES, blank=True)
     approval_status = models.CharField(max_length=20, choices=[('Pending', 'Pending'), ('Approved', 'Approved'), ('Rejected', 'Rejected')], default='Pending')
@@ -91,10 +115,53 @@ class Expense(models.Model):
 
     def __str__(self):
         return f"{self.payer.name} - {self.amount}"
+
+    @property
+    def currency_symbol(self):
+        return CURRENCY_SYMBOLS.get(self.currency, self.currency)
+
+    def save(self, *args, **kwargs):
+        from .currency import base_amount
+        self.base_amount = base_amount(self)
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = set(kwargs['update_fields']) | {'base_amount'}
+        super().save(*args, **kwargs)
     
     class Meta:
         ordering = ['-date']
+        indexes = [
+            # Event listings in Meta.ordering order, without a separate sort
+            models.Index(fields=['event', '-date'], name='expense_event_date_idx'),
+            # Per-payer lookups; base_amount is included so payer sums read only the index
+            models.Index(fields=['event', 'payer', 'base_amount'], name='expense_event_payer_idx'),
+            # Event totals (Sum('base_amount') filtered by event) read only the index
+            models.Index(fields=['event', 'base_amount'], name='expense_event_amount_idx'),
+            models.Index(fields=['event', 'approval_status'], name='expense_event_status_idx'),
+            # Per-user category breakdowns on the analytics page
+            models.Index(fields=['user', 'category'], name='expense_user_category_idx'),
+        ]
     
+class ExpenseShare(models.Model):
+    # One contributor of an expense and their share of it, kept by
+    # expenses.splits. Uses the table of the former auto-created M2M.
+    expense = models.ForeignKey(Expense, on_delete=models.CASCADE, related_name='shares')
+    member = models.ForeignKey(Member, on_delete=models.CASCADE, related_name='expense_shares')
+    # How the expense is split: fixed_amount (in the expense's currency) if
+    # set, otherwise a part of what is left in proportion to weight
+    weight = models.DecimalField(max_digits=8, decimal_places=2, default=1, validators=[MinValueValidator(0)])
+    fixed_amount = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, validators=[MinValueValidator(0)])
+    # Resulting share of base_amount; an expense's shares sum to its base_amount exactly
+    share = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f"{self.member.name} - {self.share}"
+
+    class Meta:
+        db_table = 'expenses_expense_contributors'
+        constraints = [
+            models.UniqueConstraint(fields=['expense', 'member'], name='expenseshare_expense_member_uniq'),
+        ]
+
 class Transaction(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     event = models.ForeignKey(Event, on_delete=models.CASCADE)
@@ -105,3 +172,76 @@ class Transaction(models.Model):
 
     def __str__(self):
         return f"{self.payer.name} to {self.payee.name} - {self.amount}"
+
+class ReportJob(models.Model):
+    # A queued PDF rendering of one member's financial report, processed by expenses.reports
+    STATUS_CHOICES = [
+        ('Pending', 'Pending'),
+        ('Running', 'Running'),
+        ('Done', 'Done'),
+        ('Failed', 'Failed'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    event = models.ForeignKey(Event, on_delete=models.CASCADE)
+    member = models.ForeignKey(Member, on_delete=models.CASCADE)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='Pending')
+    # Hash of the report's inputs; finished PDFs are cached on disk under it
+    data_version = models.CharField(max_length=64)
+    file_path = models.CharField(max_length=255, blank=True)
+    error = models.TextField(blank=True)
+    created_date = models.DateTimeField(auto_now_add=True)
+    updated_date = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Report #{self.id} ({self.member.name}) - {self.status}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['event', 'member', 'data_version'], name='reportjob_lookup_idx'),
+            models.Index(fields=['status', 'created_date'], name='reportjob_status_idx'),
+        ]
+
+class OutboundEmail(models.Model):
+    # Persistent outbound mail queue, delivered by expenses.mailqueue
+    STATUS_CHOICES = [
+        ('Pending', 'Pending'),
+        ('Sending', 'Sending'),
+        ('Sent', 'Sent'),
+        ('Failed', 'Failed'),
+    ]
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    html_body = models.TextField(blank=True)
+    from_email = models.CharField(max_length=255, blank=True)
+    # Comma separated recipient addresses
+    to = models.TextField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='Pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_date = models.DateTimeField(auto_now_add=True)
+    sent_date = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.subject} to {self.to} - {self.status}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt'], name='outboundemail_due_idx'),
+        ]
+
+class ExchangeRate(models.Model):
+    # Daily rate: units of settings.FX_QUOTE_CURRENCY for one unit of `currency`
+    currency = models.CharField(max_length=3, choices=CURRENCY_CHOICES)
+    date = models.DateField()
+    rate = models.DecimalField(max_digits=18, decimal_places=8)
+
+    def __str__(self):
+        return f"{self.currency} {self.date} - {self.rate}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['currency', 'date'], name='exchangerate_currency_date_uniq'),
+        ]
@@ -0,0 +1,88 @@
+from django.core import signing
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+# Keyset (cursor) pagination
+#
+# Pages are addressed by the sort value and id of the last row already shown,
+# so every page is a single indexed range scan no matter how deep the user
+# pages. Cursors are signed so they can't be tampered with, and carry the
+# sort order they were made for: a cursor from another sort (or another page
+# using this module) raises InvalidCursor instead of reaching the query.
+
+CURSOR_SALT = 'expenses.pagination'
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(order_by, values):
+    return signing.dumps([order_by, *values], salt=CURSOR_SALT, compress=True)
+
+
+def sort_field(queryset, name):
+    # The model field or annotation rows are sorted on, to type-check cursors
+    if name in queryset.query.annotations:
+        return queryset.query.annotations[name].output_field
+    return queryset.model._meta.get_field(name)
+
+
+def decode_cursor(cursor, order_by, queryset):
+    # (value, last_id) for a cursor made by keyset_page with the same order_by
+    try:
+        payload = signing.loads(cursor, salt=CURSOR_SALT)
+    except signing.BadSignature:
+        raise InvalidCursor("Invalid cursor.")
+    if not isinstance(payload, list) or len(payload) != 3 or payload[0] != order_by:
+        raise InvalidCursor(f'This cursor is not for sort order "{order_by}".')
+    _, value, last_id = payload
+    try:
+        value = sort_field(queryset, order_by.lstrip('-')).to_python(value)
+    except ValidationError:
+        raise InvalidCursor("Invalid cursor.")
+    if value is None or not isinstance(last_id, int):
+        raise InvalidCursor("Invalid cursor.")
+    return value, last_id
+
+
+def cursor_value(value):
+    # Cursor payloads are JSON, so store dates/decimals as strings
+    if value is None or isinstance(value, (int, float, str)):
+        return value
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+
+def row_value(row, name):
+    # Rows may be model instances or dicts from .values()
+    return row[name] if isinstance(row, dict) else getattr(row, name)
+
+
+def keyset_page(queryset, order_by, cursor=None, page_size=25):
+    # order_by is a field name with an optional leading '-'. Rows are ordered
+    # by (field, id) in the same direction; returns (rows, next_cursor).
+    # Raises InvalidCursor for a cursor that keyset_page didn't make for
+    # this order_by.
+    descending = order_by.startswith('-')
+    field = order_by.lstrip('-')
+    lookup = 'lt' if descending else 'gt'
+
+    queryset = queryset.order_by(order_by, '-id' if descending else 'id')
+
+    if cursor:
+        value, last_id = decode_cursor(cursor, order_by, queryset)
+        queryset = queryset.filter(
+            Q(**{f'{field}__{lookup}': value}) | Q(**{field: value, f'id__{lookup}': last_id})
+        )
+
+    # Fetch one extra row to know whether there is a next page
+    rows = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        next_cursor = encode_cursor(order_by, [cursor_value(row_value(last, field)), row_value(last, 'id')])
+
+    return rows, next_cursor
@@ -0,0 +1,65 @@
+import threading
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.base.base import NO_DB_ALIAS
+from django.db.backends.postgresql import base
+
+# PostgreSQL backend with an in-process psycopg_pool connection pool
+#
+# Django 5.0 opens a new server connection per request (or keeps one per
+# thread with CONN_MAX_AGE). With settings_dict['POOL'] set, connections come
+# from one psycopg_pool.ConnectionPool per database alias instead, shared by
+# every thread of the process, and closing a connection hands it back to the
+# pool. This is what Django 5.1+ does with OPTIONS['pool'].
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    _connection_pools = {}
+    _pools_lock = threading.Lock()
+
+    @property
+    def pool(self):
+        pool_options = self.settings_dict.get('POOL')
+        if self.alias == NO_DB_ALIAS or not pool_options:
+            return None
+        with self._pools_lock:
+            if self.alias not in self._connection_pools:
+                from psycopg_pool import ConnectionPool
+
+                connect_kwargs = self.get_connection_params()
+                # Pooled connections start in autocommit; Django sets its own mode on checkout
+                connect_kwargs['autocommit'] = True
+                self._connection_pools[self.alias] = ConnectionPool(
+                    kwargs=connect_kwargs,
+                    # Opened on first use, not while settings are loading
+                    open=False,
+                    check=ConnectionPool.check_connection if self.settings_dict['CONN_HEALTH_CHECKS'] else None,
+                    **pool_options,
+                )
+        return self._connection_pools[self.alias]
+
+    def get_new_connection(self, conn_params):
+        pool = self.pool
+        if pool is None:
+            return super().get_new_connection(conn_params)
+
+        # Same isolation level handling as the base get_new_connection
+        isolation_level = self.settings_dict['OPTIONS'].get('isolation_level')
+        try:
+            self.isolation_level = base.IsolationLevel(isolation_level) if isolation_level is not None else base.IsolationLevel.READ_COMMITTED
+        except ValueError:
+            raise ImproperlyConfigured(f"Invalid transaction isolation level {isolation_level} specified.")
+        pool.open()
+        connection = pool.getconn()
+        if isolation_level is not None:
+            connection.isolation_level = self.isolation_level
+        return connection
+
+    def _close(self):
+        if self.connection is not None and self.pool is not None:
+            with self.wrap_database_errors:
+                # putconn() rolls back anything left open before reuse
+                self.pool.putconn(self.connection)
+                self.connection = None
+            return
+        return super()._close()
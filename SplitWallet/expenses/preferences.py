@@ -0,0 +1,34 @@
+from .models import UserPreferences
+
+# User preferences, cached in the session
+#
+# Preferences are read from the database once per session and kept in the
+# session afterwards, so rendering base.html needs no UserPreferences query.
+# user_settings writes the new value to both places when it changes.
+
+SESSION_KEY = 'user_preferences'
+DEFAULT_PREFERENCES = {'dark_mode': False}
+
+
+def load_preferences(user):
+    dark_mode = UserPreferences.objects.filter(user=user).values_list('dark_mode', flat=True).first()
+    return {'dark_mode': bool(dark_mode)}
+
+
+def store_preferences(request, preferences):
+    request.session[SESSION_KEY] = dict(preferences, user_id=request.user.id)
+
+
+def get_preferences(request):
+    if not request.user.is_authenticated:
+        return DEFAULT_PREFERENCES
+    preferences = request.session.get(SESSION_KEY)
+    if preferences is None or preferences.get('user_id') != request.user.id:
+        preferences = load_preferences(request.user)
+        store_preferences(request, preferences)
+    return preferences
+
+
+def user_preferences(request):
+    # Context processor: exposes {{ preferences.dark_mode }} to every template
+    return {'preferences': get_preferences(request)}
@@ -0,0 +1,21 @@
+from django.db.models import Count, Prefetch
+
+from .models import Member, Expense
+
+# Shared querysets for the expense list pages
+#
+# Listings show each expense's payer and contributors, so the rows come with
+# the payer joined in, contributors prefetched in one extra query and the
+# contributor count annotated. Rendering then costs the same number of
+# queries for 10 expenses or 5,000.
+
+
+def expense_listing(event, user=None):
+    expenses = Expense.objects.filter(event=event)
+    if user is not None:
+        expenses = expenses.filter(user=user)
+
+    # Meta.ordering is dropped from aggregate queries, so it is re-applied here
+    return expenses.select_related('payer').prefetch_related(
+        Prefetch('contributors', queryset=Member.objects.all())
+    ).annotate(contributor_count=Count('contributors', distinct=True)).order_by(*Expense._meta.ordering)
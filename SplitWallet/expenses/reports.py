@@ -0,0 +1,193 @@
+import glob
+import hashlib
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Count, Max, Sum
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from .balances import EventBalances
+from .models import Member, Expense, ReportJob
+
+# PDF report pipeline
+#
+# Rendering a member's report to PDF can take seconds on a large event, so
+# requests only queue a ReportJob row and a small in-process thread pool does
+# the rendering. The job table is the queue: a worker claims a job with a
+# conditional UPDATE, so the pool and the process_report_jobs command never
+# render the same job twice, and jobs left behind by a restart are picked up
+# by that command. Finished PDFs are cached on disk under a hash of the
+# report's inputs, so an unchanged report is never rendered again.
+
+logger = logging.getLogger(__name__)
+
+# Bump when report_pdf.html changes so cached PDFs are re-rendered
+REPORT_FORMAT_VERSION = 2
+
+executor = None
+executor_lock = threading.Lock()
+
+
+def member_report(balances, selected_user):
+    # Everything report.html and report_pdf.html show for one member
+    members = balances.members
+    contributors = [member for member in members if member.id != selected_user.id]
+
+    for contributor in contributors:
+        contributor.expenses_paid = balances.paid_by(contributor)
+        contributor.expense_count = balances.expense_count_for(contributor)
+
+        # Pairwise amounts between the selected user and the contributor
+        contributor.pay_to = balances.pay_to(selected_user, contributor)
+        contributor.get_from = balances.get_from(selected_user, contributor)
+
+        contributor.percentage_spent = balances.percentage_spent(contributor)
+
+    # The member's own stored share of every expense, for the expense tables
+    for expense in balances.expenses:
+        expense.member_share = expense.member_shares.get(selected_user.id, 0)
+
+    selected_user.percentage_spent = balances.percentage_spent(selected_user)
+    expense_count = balances.expense_count_for(selected_user)
+    total_expenses_paid_by_user = balances.paid_by(selected_user)
+
+    return {
+        'selected_user': selected_user,
+        'contributors': contributors,
+        'selected_user_expenses': balances.expenses_paid_by(selected_user),
+        'other_user_expenses': balances.expenses_not_paid_by(selected_user),
+        'expense_count': expense_count,
+        'user_report': {
+            'user_name': selected_user.name,
+            'total_contribution': total_expenses_paid_by_user,
+            'total_expenses_paid': balances.owed_by(selected_user),
+            'balance': balances.balance(selected_user),
+            'expense_count': expense_count,
+            'expenses_added': total_expenses_paid_by_user > 0,
+        },
+    }
+
+
+def report_data_version(event):
+    # Hash of everything a report depends on. Two queries: members with their
+    # ledger (which moves whenever stored shares do), and one aggregate over
+    # the expenses (every edit bumps updated_date, adds and deletes change the
+    # count).
+    expenses = Expense.objects.filter(event=event).order_by().aggregate(
+        count=Count('id'),
+        total=Sum('base_amount'),
+        last_updated=Max('updated_date'),
+    )
+    data = {
+        'format': REPORT_FORMAT_VERSION,
+        'event': [event.title, event.start_date, event.end_date, event.location, event.base_currency],
+        'members': list(Member.objects.filter(event=event).order_by('id').values_list('id', 'name', 'amount_owed')),
+        'expenses': expenses,
+    }
+    encoded = json.dumps(data, sort_keys=True, default=str).encode()
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def report_dir():
+    return str(getattr(settings, 'REPORT_PDF_DIR', os.path.join(settings.BASE_DIR, 'report_cache')))
+
+
+def report_pdf_path(event_id, member_id, data_version):
+    return os.path.join(report_dir(), f'event-{event_id}-member-{member_id}-{data_version[:32]}.pdf')
+
+
+def render_report_pdf(event, member, data_version):
+    from xhtml2pdf import pisa
+
+    balances = EventBalances(event)
+    selected_user = next(m for m in balances.members if m.id == member.id)
+    context = {
+        'event': event,
+        'total_expense_amount': balances.total,
+        'date_difference': (event.end_date - event.start_date).days + 1,
+    }
+    context.update(member_report(balances, selected_user))
+    html = render_to_string('expenses/report_pdf.html', context)
+
+    path = report_pdf_path(event.id, member.id, data_version)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write to a temporary name and rename, so readers never see a partial file
+    temp_path = f'{path}.{threading.get_ident()}.tmp'
+    with open(temp_path, 'wb') as output:
+        result = pisa.CreatePDF(html, dest=output, encoding='utf-8')
+    if result.err:
+        os.remove(temp_path)
+        raise RuntimeError(f"xhtml2pdf reported {result.err} error(s) rendering the report.")
+    os.replace(temp_path, path)
+
+    # Older versions of this member's report are never served again
+    for old_path in glob.glob(os.path.join(report_dir(), f'event-{event.id}-member-{member.id}-*.pdf')):
+        if old_path != path:
+            try:
+                os.remove(old_path)
+            except OSError:
+                pass
+    return path
+
+
+def run_report_job(job_id):
+    close_old_connections()
+    try:
+        # Claim the job; whoever flips it to Running renders it
+        if not ReportJob.objects.filter(pk=job_id, status='Pending').update(status='Running', updated_date=timezone.now()):
+            return
+        job = ReportJob.objects.select_related('event', 'member').get(pk=job_id)
+        try:
+            path = report_pdf_path(job.event_id, job.member_id, job.data_version)
+            if not os.path.exists(path):
+                path = render_report_pdf(job.event, job.member, job.data_version)
+        except Exception as error:
+            logger.exception("Report job #%s failed", job_id)
+            ReportJob.objects.filter(pk=job_id).update(status='Failed', error=str(error) or error.__class__.__name__, updated_date=timezone.now())
+        else:
+            ReportJob.objects.filter(pk=job_id).update(status='Done', file_path=path, updated_date=timezone.now())
+    finally:
+        close_old_connections()
+
+
+def get_executor():
+    global executor
+    with executor_lock:
+        if executor is None:
+            executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'REPORT_PDF_WORKERS', 2),
+                thread_name_prefix='report-pdf',
+            )
+        return executor
+
+
+def enqueue_report_job(job_id):
+    if getattr(settings, 'REPORT_PDF_WORKERS', 2) > 0:
+        get_executor().submit(run_report_job, job_id)
+    else:
+        # No pool configured: render in the calling thread
+        run_report_job(job_id)
+
+
+def submit_report_job(event, member, user):
+    data_version = report_data_version(event)
+
+    # An identical report is already queued, rendering or rendered
+    job = ReportJob.objects.filter(event=event, member=member, data_version=data_version).exclude(status='Failed').order_by('-id').first()
+    if job and (job.status != 'Done' or os.path.exists(job.file_path)):
+        return job
+
+    path = report_pdf_path(event.id, member.id, data_version)
+    if os.path.exists(path):
+        return ReportJob.objects.create(user=user, event=event, member=member, data_version=data_version, status='Done', file_path=path)
+
+    job = ReportJob.objects.create(user=user, event=event, member=member, data_version=data_version)
+    # Only hand the job to a worker once the row is visible to other connections
+    transaction.on_commit(lambda: enqueue_report_job(job.id))
+    return job
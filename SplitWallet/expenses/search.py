@@ -0,0 +1,272 @@
+import logging
+import re
+
+from django.db import connections
+from django.db.models import Q
+
+from .models import Expense
+
+# Full-text expense search
+#
+# Expense descriptions, notes, locations and payer names are indexed in a
+# side table kept in sync by database triggers, so every write path (forms,
+# bulk imports, cascading deletes, member renames) updates the index without
+# any Python code running.
+#
+# SQLite: an FTS5 virtual table (expenses_expense_fts) ranked with bm25().
+# The owner and event are indexed as tokens ("u12 e34") in a scope column, so
+# the user/event filter is part of the MATCH instead of a per-row check.
+# PostgreSQL: a tsvector table (expenses_expense_search) with a GIN index,
+# ranked with ts_rank_cd(). Other databases fall back to icontains filters.
+#
+# The tables are created (and filled) after migrate by install_search_index,
+# and rebuild_search_index recreates them from scratch.
+
+logger = logging.getLogger(__name__)
+
+SEARCH_PAGE_SIZE = 25
+# Deeper pages are clamped; huge page numbers would overflow the OFFSET
+SEARCH_MAX_PAGE = 1000
+# Longest query accepted, in terms
+MAX_TERMS = 8
+
+SQLITE_TABLE = 'expenses_expense_fts'
+POSTGRES_TABLE = 'expenses_expense_search'
+
+SQLITE_SCHEMA = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {SQLITE_TABLE} USING fts5(
+        description, notes, location, payer, scope,
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {SQLITE_TABLE}_insert AFTER INSERT ON expenses_expense BEGIN
+        INSERT INTO {SQLITE_TABLE} (rowid, description, notes, location, payer, scope)
+        VALUES (
+            NEW.id, NEW.description, NEW.notes, NEW.location,
+            (SELECT name FROM expenses_member WHERE id = NEW.payer_id),
+            (SELECT 'u' || user_id || ' e' || id FROM expenses_event WHERE id = NEW.event_id)
+        );
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {SQLITE_TABLE}_update
+    AFTER UPDATE OF description, notes, location, payer_id, event_id ON expenses_expense BEGIN
+        DELETE FROM {SQLITE_TABLE} WHERE rowid = OLD.id;
+        INSERT INTO {SQLITE_TABLE} (rowid, description, notes, location, payer, scope)
+        VALUES (
+            NEW.id, NEW.description, NEW.notes, NEW.location,
+            (SELECT name FROM expenses_member WHERE id = NEW.payer_id),
+            (SELECT 'u' || user_id || ' e' || id FROM expenses_event WHERE id = NEW.event_id)
+        );
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {SQLITE_TABLE}_delete AFTER DELETE ON expenses_expense BEGIN
+        DELETE FROM {SQLITE_TABLE} WHERE rowid = OLD.id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {SQLITE_TABLE}_payer_rename AFTER UPDATE OF name ON expenses_member BEGIN
+        UPDATE {SQLITE_TABLE} SET payer = NEW.name
+        WHERE rowid IN (SELECT id FROM expenses_expense WHERE payer_id = NEW.id);
+    END
+    """,
+]
+
+SQLITE_POPULATE = f"""
+    INSERT INTO {SQLITE_TABLE} (rowid, description, notes, location, payer, scope)
+    SELECT expense.id, expense.description, expense.notes, expense.location, member.name,
+           'u' || event.user_id || ' e' || event.id
+    FROM expenses_expense expense
+    JOIN expenses_event event ON event.id = expense.event_id
+    LEFT JOIN expenses_member member ON member.id = expense.payer_id
+"""
+
+SQLITE_DROP = [
+    f"DROP TRIGGER IF EXISTS {SQLITE_TABLE}_insert",
+    f"DROP TRIGGER IF EXISTS {SQLITE_TABLE}_update",
+    f"DROP TRIGGER IF EXISTS {SQLITE_TABLE}_delete",
+    f"DROP TRIGGER IF EXISTS {SQLITE_TABLE}_payer_rename",
+    f"DROP TABLE IF EXISTS {SQLITE_TABLE}",
+]
+
+# Description weighs most, then payer and location, then notes
+POSTGRES_SCHEMA = [
+    f"""
+    CREATE TABLE IF NOT EXISTS {POSTGRES_TABLE} (
+        expense_id bigint PRIMARY KEY,
+        event_id bigint NOT NULL,
+        user_id integer NOT NULL,
+        document tsvector NOT NULL
+    )
+    """,
+    f"CREATE INDEX IF NOT EXISTS {POSTGRES_TABLE}_document ON {POSTGRES_TABLE} USING GIN (document)",
+    f"CREATE INDEX IF NOT EXISTS {POSTGRES_TABLE}_user ON {POSTGRES_TABLE} (user_id)",
+    f"CREATE INDEX IF NOT EXISTS {POSTGRES_TABLE}_event ON {POSTGRES_TABLE} (event_id)",
+    """
+    CREATE OR REPLACE FUNCTION expenses_expense_document(description text, notes text, location text, payer text)
+    RETURNS tsvector AS $$
+        SELECT setweight(to_tsvector('simple', coalesce(description, '')), 'A')
+            || setweight(to_tsvector('simple', coalesce(payer, '')), 'B')
+            || setweight(to_tsvector('simple', coalesce(location, '')), 'B')
+            || setweight(to_tsvector('simple', coalesce(notes, '')), 'C')
+    $$ LANGUAGE sql IMMUTABLE
+    """,
+    f"""
+    CREATE OR REPLACE FUNCTION {POSTGRES_TABLE}_sync() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            DELETE FROM {POSTGRES_TABLE} WHERE expense_id = OLD.id;
+            RETURN NULL;
+        END IF;
+        INSERT INTO {POSTGRES_TABLE} (expense_id, event_id, user_id, document)
+        SELECT NEW.id, NEW.event_id, event.user_id,
+               expenses_expense_document(NEW.description, NEW.notes, NEW.location, member.name)
+        FROM expenses_event event
+        LEFT JOIN expenses_member member ON member.id = NEW.payer_id
+        WHERE event.id = NEW.event_id
+        ON CONFLICT (expense_id) DO UPDATE
+            SET event_id = EXCLUDED.event_id, user_id = EXCLUDED.user_id, document = EXCLUDED.document;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    f"""
+    CREATE OR REPLACE FUNCTION {POSTGRES_TABLE}_payer_rename() RETURNS trigger AS $$
+    BEGIN
+        UPDATE {POSTGRES_TABLE} search
+        SET document = expenses_expense_document(expense.description, expense.notes, expense.location, NEW.name)
+        FROM expenses_expense expense
+        WHERE expense.id = search.expense_id AND expense.payer_id = NEW.id;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    f"DROP TRIGGER IF EXISTS {POSTGRES_TABLE}_sync ON expenses_expense",
+    f"""
+    CREATE TRIGGER {POSTGRES_TABLE}_sync
+    AFTER INSERT OR DELETE OR UPDATE OF description, notes, location, payer_id, event_id ON expenses_expense
+    FOR EACH ROW EXECUTE FUNCTION {POSTGRES_TABLE}_sync()
+    """,
+    f"DROP TRIGGER IF EXISTS {POSTGRES_TABLE}_payer_rename ON expenses_member",
+    f"""
+    CREATE TRIGGER {POSTGRES_TABLE}_payer_rename
+    AFTER UPDATE OF name ON expenses_member
+    FOR EACH ROW EXECUTE FUNCTION {POSTGRES_TABLE}_payer_rename()
+    """,
+]
+
+POSTGRES_POPULATE = f"""
+    INSERT INTO {POSTGRES_TABLE} (expense_id, event_id, user_id, document)
+    SELECT expense.id, expense.event_id, event.user_id,
+           expenses_expense_document(expense.description, expense.notes, expense.location, member.name)
+    FROM expenses_expense expense
+    JOIN expenses_event event ON event.id = expense.event_id
+    LEFT JOIN expenses_member member ON member.id = expense.payer_id
+"""
+
+POSTGRES_DROP = [
+    f"DROP TRIGGER IF EXISTS {POSTGRES_TABLE}_sync ON expenses_expense",
+    f"DROP TRIGGER IF EXISTS {POSTGRES_TABLE}_payer_rename ON expenses_member",
+    f"DROP TABLE IF EXISTS {POSTGRES_TABLE}",
+]
+
+
+def search_table_exists(connection):
+    table = SQLITE_TABLE if connection.vendor == 'sqlite' else POSTGRES_TABLE
+    with connection.cursor() as cursor:
+        return table in connection.introspection.table_names(cursor)
+
+
+def install_search_index(using='default', rebuild=False):
+    # Create the search table and triggers; fill the table when it is new
+    connection = connections[using]
+    if connection.vendor == 'sqlite':
+        schema, populate, drop = SQLITE_SCHEMA, SQLITE_POPULATE, SQLITE_DROP
+    elif connection.vendor == 'postgresql':
+        schema, populate, drop = POSTGRES_SCHEMA, POSTGRES_POPULATE, POSTGRES_DROP
+    else:
+        return False
+
+    with connection.cursor() as cursor:
+        if rebuild:
+            for statement in drop:
+                cursor.execute(statement)
+        is_new = not search_table_exists(connection)
+        for statement in schema:
+            cursor.execute(statement)
+        if is_new:
+            cursor.execute(populate)
+    return True
+
+
+def install_after_migrate(sender, using='default', **kwargs):
+    try:
+        install_search_index(using)
+    except Exception:
+        # e.g. an SQLite build without FTS5; search then uses the fallback
+        logger.exception("Could not install the expense search index")
+
+
+def search_terms(query):
+    # Words only, so user input can never inject FTS or tsquery syntax
+    return re.findall(r'\w+', query.lower())[:MAX_TERMS]
+
+
+def ranked_ids(connection, terms, user, event, limit, offset):
+    if connection.vendor == 'sqlite':
+        # Every term must match a content column; the last may be a word prefix
+        words = ' AND '.join([f'"{term}"' for term in terms[:-1]] + [f'"{terms[-1]}"*'])
+        match = f'scope:u{user.id} AND ' + (f'scope:e{event.id} AND ' if event else '') + f'{{description notes location payer}}: ({words})'
+        sql = (
+            f"SELECT rowid FROM {SQLITE_TABLE} WHERE {SQLITE_TABLE} MATCH %s"
+            f" ORDER BY bm25({SQLITE_TABLE}, 10.0, 2.0, 4.0, 4.0, 0.0), rowid DESC LIMIT %s OFFSET %s"
+        )
+        params = [match, limit, offset]
+    else:
+        match = ' & '.join(terms[:-1] + [f'{terms[-1]}:*'])
+        sql = (
+            f"SELECT expense_id FROM {POSTGRES_TABLE}, to_tsquery('simple', %s) query"
+            " WHERE document @@ query AND user_id = %s"
+            + (" AND event_id = %s" if event else "")
+            + " ORDER BY ts_rank_cd(document, query) DESC, expense_id DESC LIMIT %s OFFSET %s"
+        )
+        params = [match, user.id] + ([event.id] if event else []) + [limit, offset]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def fallback_ids(terms, user, event, limit, offset):
+    expenses = Expense.objects.filter(event__user=user)
+    if event:
+        expenses = expenses.filter(event=event)
+    for term in terms:
+        expenses = expenses.filter(
+            Q(description__icontains=term) | Q(notes__icontains=term) | Q(location__icontains=term) | Q(payer__name__icontains=term)
+        )
+    return list(expenses.order_by('-date', '-id').values_list('id', flat=True)[offset:offset + limit])
+
+
+def search_expenses(user, query, event=None, page=1, page_size=SEARCH_PAGE_SIZE):
+    # Returns (expenses, has_next) for one page of hits, best match first
+    terms = search_terms(query)
+    if not terms:
+        return [], False
+
+    connection = connections[Expense.objects.db]
+    page = min(max(page, 1), SEARCH_MAX_PAGE)
+    offset = (page - 1) * page_size
+    # One extra hit tells us whether there is a next page
+    if connection.vendor in ('sqlite', 'postgresql') and search_table_exists(connection):
+        ids = ranked_ids(connection, terms, user, event, page_size + 1, offset)
+    else:
+        ids = fallback_ids(terms, user, event, page_size + 1, offset)
+
+    has_next = len(ids) > page_size
+    ids = ids[:page_size]
+    expenses = Expense.objects.filter(id__in=ids).select_related('payer', 'event').in_bulk()
+    # in_bulk loses the ranking order; ids whose expense is gone are skipped
+    return [expenses[expense_id] for expense_id in ids if expense_id in expenses], has_next
@@ -0,0 +1,137 @@
+import heapq
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import transaction
+
+from .balances import net_balances
+from .models import Event, Transaction
+
+# Settlement planner
+#
+# Turns each member's net balance into the smallest set of payer -> payee
+# transfers and stores them as Transaction rows (with no expense attached).
+# Amounts are handled in integer paise so zero checks are exact.
+
+# Groups with at most this many non-settled members are solved exactly
+EXACT_SOLVER_LIMIT = 12
+
+PAISE = Decimal('0.01')
+
+
+def to_paise(balances):
+    paise = {member_id: int((amount.quantize(PAISE, rounding=ROUND_HALF_UP) * 100)) for member_id, amount in balances.items()}
+    # Rounding every member to paise can leave a few paise unassigned;
+    # give the leftover to the member with the largest balance
+    drift = sum(paise.values())
+    if drift and paise:
+        largest = max(paise, key=lambda member_id: abs(paise[member_id]))
+        paise[largest] -= drift
+    return {member_id: amount for member_id, amount in paise.items() if amount}
+
+
+def greedy_transfers(balances):
+    # Repeatedly settle the largest debtor against the largest creditor.
+    # Produces at most (members - 1) transfers.
+    creditors = [(-amount, member_id) for member_id, amount in balances.items() if amount > 0]
+    debtors = [(amount, member_id) for member_id, amount in balances.items() if amount < 0]
+    heapq.heapify(creditors)
+    heapq.heapify(debtors)
+
+    transfers = []
+    while creditors and debtors:
+        credit, payee = heapq.heappop(creditors)
+        debt, payer = heapq.heappop(debtors)
+        amount = min(-credit, -debt)
+        transfers.append((payer, payee, amount))
+
+        if -credit > amount:
+            heapq.heappush(creditors, (credit + amount, payee))
+        if -debt > amount:
+            heapq.heappush(debtors, (debt + amount, payer))
+
+    return transfers
+
+
+def exact_transfers(balances):
+    # The minimum number of transfers is (members - zero-sum groups), so split
+    # the members into as many zero-sum groups as possible (bitmask DP) and
+    # settle each group on its own.
+    member_ids = list(balances)
+    amounts = [balances[member_id] for member_id in member_ids]
+    size = len(member_ids)
+    full = (1 << size) - 1
+
+    subset_sum = [0] * (full + 1)
+    for mask in range(1, full + 1):
+        low = mask & -mask
+        subset_sum[mask] = subset_sum[mask ^ low] + amounts[low.bit_length() - 1]
+
+    groups_in = [0] * (full + 1)
+    for mask in range(1, full + 1):
+        best = 0
+        remaining = mask
+        while remaining:
+            bit = remaining & -remaining
+            remaining ^= bit
+            best = max(best, groups_in[mask ^ bit])
+        groups_in[mask] = best + (1 if subset_sum[mask] == 0 else 0)
+
+    # Peel members off one at a time; every zero-sum prefix closes a group
+    order = []
+    mask = full
+    while mask:
+        remaining = mask
+        while remaining:
+            bit = remaining & -remaining
+            remaining ^= bit
+            if groups_in[mask ^ bit] + (1 if subset_sum[mask] == 0 else 0) == groups_in[mask]:
+                order.append(bit)
+                mask ^= bit
+                break
+
+    transfers = []
+    group = {}
+    prefix = 0
+    for bit in reversed(order):
+        prefix |= bit
+        index = bit.bit_length() - 1
+        group[member_ids[index]] = amounts[index]
+        if subset_sum[prefix] == 0:
+            transfers.extend(greedy_transfers(group))
+            group = {}
+
+    return transfers
+
+
+def plan_transfers(balances, exact_limit=EXACT_SOLVER_LIMIT):
+    # balances: member id -> Decimal net balance. Returns (payer, payee, Decimal amount) tuples.
+    paise = to_paise(balances)
+    if len(paise) <= exact_limit:
+        transfers = exact_transfers(paise)
+    else:
+        transfers = greedy_transfers(paise)
+    return [(payer, payee, Decimal(amount) / 100) for payer, payee, amount in transfers]
+
+
+def mark_settlement_stale(event):
+    Event.objects.filter(pk=event.pk).update(settlement_stale=True)
+
+
+def rebuild_settlement(event, exact_limit=EXACT_SOLVER_LIMIT):
+    transfers = plan_transfers(net_balances(event), exact_limit=exact_limit)
+
+    with transaction.atomic():
+        Transaction.objects.filter(event=event, expense__isnull=True).delete()
+        Transaction.objects.bulk_create([
+            Transaction(user=event.user, event=event, payer_id=payer, payee_id=payee, amount=amount)
+            for payer, payee, amount in transfers
+        ])
+        Event.objects.filter(pk=event.pk).update(settlement_stale=False)
+    event.settlement_stale = False
+
+
+def settlement_plan(event):
+    # Stored plan for the event, rebuilt only after its expenses changed
+    if event.settlement_stale:
+        rebuild_settlement(event)
+    return Transaction.objects.filter(event=event, expense__isnull=True).select_related('payer', 'payee').order_by('payer__name', '-amount')
@@ -0,0 +1,109 @@
+from decimal import Decimal, ROUND_FLOOR, ROUND_HALF_UP
+
+from .models import Expense, ExpenseShare
+
+# Split engine
+#
+# Works out each contributor's share of an expense once, when the expense or
+# its contributors change, and stores it on the ExpenseShare through row.
+# Everything that needs shares (the ledger in expenses.totals, balances,
+# reports) sums the stored column instead of dividing amounts again.
+#
+# Shares are split from base_amount in whole paise. A contributor with a
+# fixed_amount gets exactly that (converted to the base currency); what is
+# left is divided in proportion to the other contributors' weights. Paise left
+# over by rounding go one each to the largest remainders, ties to the lowest
+# member id, so the shares always add up to base_amount exactly and the same
+# inputs always give the same split.
+
+PAISE = Decimal('0.01')
+
+
+class SplitError(ValueError):
+    pass
+
+
+def to_paise(amount):
+    return int((amount * 100).to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def from_paise(paise):
+    return (Decimal(paise) / 100).quantize(PAISE)
+
+
+def allocate_paise(total, targets):
+    # Largest remainder allocation of `total` paise over exact (unrounded)
+    # paise targets that add up to `total`
+    parts = [int(target.to_integral_value(rounding=ROUND_FLOOR)) for target in targets]
+    remainders = sorted((-(target - part), index) for index, (target, part) in enumerate(zip(targets, parts)))
+    for _, index in remainders[:total - sum(parts)]:
+        parts[index] += 1
+    return parts
+
+
+def compute_shares(amount, base_amount, entries):
+    # entries: (weight, fixed_amount or None) per contributor, in member id
+    # order. Returns the shares of base_amount in the same order.
+    if not entries:
+        return []
+    if any(weight < 0 or (fixed_amount is not None and fixed_amount < 0) for weight, fixed_amount in entries):
+        raise SplitError("Weights and fixed shares can't be negative.")
+    total = to_paise(base_amount)
+    fixed = [fixed_amount for _, fixed_amount in entries if fixed_amount is not None]
+    fixed_total = sum(fixed, Decimal('0'))
+    if fixed_total > amount:
+        raise SplitError("Fixed shares add up to more than the expense amount.")
+    if len(fixed) == len(entries) and fixed_total != amount:
+        raise SplitError("Fixed shares must add up to the expense amount when every contributor has one.")
+
+    # Exact targets first, rounded together in one pass: fixed amounts are in
+    # the expense's currency and take their part of base_amount, the weighted
+    # contributors divide what is left. Rounding each share on its own could
+    # overshoot the total and leave a negative share.
+    targets = [None] * len(entries)
+    for index, (_, fixed_amount) in enumerate(entries):
+        if fixed_amount is not None:
+            targets[index] = Decimal(total) * fixed_amount / amount if amount else Decimal('0')
+    weighted = [index for index, target in enumerate(targets) if target is None]
+    if weighted:
+        weight_total = sum(entries[index][0] for index in weighted)
+        if weight_total <= 0:
+            raise SplitError("Weights must add up to more than zero.")
+        rest = max(Decimal(total) - sum(target for target in targets if target is not None), Decimal('0'))
+        for index in weighted:
+            targets[index] = rest * entries[index][0] / weight_total
+    return [from_paise(part) for part in allocate_paise(total, targets)]
+
+
+def equal_shares(base_amount, count):
+    # Shares for `count` contributors with the default weight, for bulk inserts
+    return compute_shares(base_amount, base_amount, [(Decimal('1'), None)] * count)
+
+
+def share_rows(expense, members):
+    # Unsaved ExpenseShare rows splitting a new expense equally between
+    # `members`, for bulk_create
+    members = sorted(members, key=lambda member: member.id)
+    shares = equal_shares(expense.base_amount, len(members))
+    return [ExpenseShare(expense_id=expense.id, member_id=member.id, share=share) for member, share in zip(members, shares)]
+
+
+def update_shares(expense_ids, commit=True):
+    # Recompute and store the shares of the given expenses; returns the number
+    # of rows that changed (with commit=False, that would change)
+    amounts = {expense_id: (amount, base_amount) for expense_id, amount, base_amount in Expense.objects.filter(id__in=expense_ids).values_list('id', 'amount', 'base_amount')}
+    rows_by_expense = {}
+    for row in ExpenseShare.objects.filter(expense_id__in=expense_ids).order_by('expense_id', 'member_id'):
+        rows_by_expense.setdefault(row.expense_id, []).append(row)
+
+    changed = []
+    for expense_id, rows in rows_by_expense.items():
+        amount, base_amount = amounts[expense_id]
+        shares = compute_shares(amount, base_amount, [(row.weight, row.fixed_amount) for row in rows])
+        for row, share in zip(rows, shares):
+            if row.share != share:
+                row.share = share
+                changed.append(row)
+    if changed and commit:
+        ExpenseShare.objects.bulk_update(changed, ['share'], batch_size=500)
+    return len(changed)
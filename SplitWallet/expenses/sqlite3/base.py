@@ -0,0 +1,14 @@
+from django.db.backends.sqlite3 import base
+
+# SQLite backend that starts transactions with BEGIN IMMEDIATE
+#
+# A plain BEGIN takes the write lock lazily: a transaction that reads first
+# (refresh_event_totals does) and then writes cannot wait for a busy writer,
+# and SQLite fails it at once with "database is locked" whatever busy_timeout
+# says. Taking the lock up front lets every writer queue on busy_timeout.
+# Django 5.1+ does the same with OPTIONS['transaction_mode'] = 'IMMEDIATE'.
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute('BEGIN IMMEDIATE')
@@ -1,3 +1,871 @@
-from django.test import TestCase
+import csv
+import datetime
+import io
+import json
+import os
+import random
+import re
+import tempfile
+from decimal import Decimal
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Sum
+from django.test import AsyncClient, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .middleware import QueryBudgetExceeded
+from .analytics import analytics_cache, version_cache, version_key, analytics_version, bump_analytics_version, get_rollup
+from .search import search_expenses, SEARCH_MAX_PAGE
+from .currency import clear_rate_cache
+from .db import current_pragmas
+from .balances import net_balances, member_totals
+from .totals import refresh_event_totals, verify_event_totals
+from .forms import ExpenseForm
+from .models import Event, Member, Expense, ExpenseShare, UserPreferences, ExchangeRate, ReportJob, OutboundEmail
+from .splits import compute_shares, share_rows, update_shares, SplitError
+from .exports import expense_rows
+from .pagination import encode_cursor
+from .queries import expense_listing
+from .importers import import_expenses, ImportFileError
+from .settlements import plan_transfers
+from .mailqueue import claim_due, send_queued_mail
+from .reports import report_data_version, report_pdf_path, run_report_job, submit_report_job
+from .approvals import approval_summary, approval_summaries, set_approval_status
 
 # Create your tests here.
+
+
+def create_event_with_expenses(user, title, expense_count, member_count=5):
+    event = Event.objects.create(user=user, title=title, start_date=datetime.date(2024, 1, 1), end_date=datetime.date(2024, 1, 31))
+    members = Member.objects.bulk_create([Member(user=user, event=event, name=f"Member {i}") for i in range(member_count)])
+    expenses = Expense.objects.bulk_create([
+        Expense(user=user, event=event, description=f"Expense {i}", date=datetime.date(2024, 1, 1 + i % 28),
+                amount=Decimal('100.00'), base_amount=Decimal('100.00'), payer=members[i % member_count])
+        for i in range(expense_count)
+    ])
+    ExpenseShare.objects.bulk_create([share for expense in expenses for share in share_rows(expense, members)])
+    return event
+
+
+class ExpenseListingQueryCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('listing_user', 'listing@example.com', 'password123')
+        cls.small_event = create_event_with_expenses(cls.user, "Small Event", 10)
+        cls.large_event = create_event_with_expenses(cls.user, "Large Event", 5000)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        # Preferences are loaded into the session on the first page view
+        self.client.get(reverse('home'))
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def assertConstantQueries(self, url_name):
+        small = self.count_queries(reverse(url_name, args=[self.small_event.id]))
+        large = self.count_queries(reverse(url_name, args=[self.large_event.id]))
+        self.assertEqual(small, large)
+
+    def test_event_details_query_count_is_constant(self):
+        self.assertConstantQueries('event_details')
+
+    def test_expense_audit_trail_query_count_is_constant(self):
+        self.assertConstantQueries('expense_audit_trail')
+
+    def render_without_listing(self, url):
+        # The page as rendered from the plain event queryset expense_listing replaced
+        def baseline(event, user=None):
+            expenses = Expense.objects.filter(event=event)
+            return expenses.filter(user=user) if user is not None else expenses
+
+        with mock.patch('expenses.views.expense_listing', side_effect=baseline):
+            return self.client.get(url)
+
+    def assertSameRows(self, url_name):
+        url = reverse(url_name, args=[self.small_event.id])
+        expected = self.render_without_listing(url).content.decode()
+        rendered = self.client.get(url).content.decode()
+        # CSRF tokens are masked differently on every render
+        csrf = re.compile(r'name="csrfmiddlewaretoken" value="[^"]*"')
+        self.assertEqual(csrf.sub('', rendered), csrf.sub('', expected))
+        self.assertIn('Expense 9', rendered)
+
+    def test_event_details_renders_the_same_rows(self):
+        self.assertSameRows('event_details')
+
+    def test_expense_audit_trail_renders_the_same_rows(self):
+        self.assertSameRows('expense_audit_trail')
+
+    def test_listing_matches_event_expenses(self):
+        baseline = Expense.objects.filter(event=self.small_event)
+        rows = [
+            (expense.id, expense.payer.name, [member.name for member in expense.contributors.all()], expense.contributor_count)
+            for expense in expense_listing(self.small_event)
+        ]
+        expected = [
+            (expense.id, expense.payer.name, [member.name for member in expense.contributors.all()], expense.contributors.count())
+            for expense in baseline
+        ]
+        self.assertEqual(rows, expected)
+        self.assertEqual([expense.id for expense in expense_listing(self.small_event, user=self.user)], [row[0] for row in expected])
+
+
+class PerformanceMiddlewareTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('perf_user', 'perf@example.com', 'password123')
+        self.client.force_login(self.user)
+
+    def test_server_timing_header(self):
+        response = self.client.get(reverse('home'))
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn('total;dur=', response['Server-Timing'])
+
+    @override_settings(PERFORMANCE_QUERY_BUDGETS={'home': 1}, PERFORMANCE_BUDGET_ACTION='raise')
+    def test_query_budget_raises(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            self.client.get(reverse('home'))
+
+    def test_stats_are_staff_only(self):
+        response = self.client.get(reverse('performance_stats'))
+        self.assertEqual(response.status_code, 302)
+
+        self.user.is_staff = True
+        self.user.save()
+        self.client.get(reverse('home'))
+        response = self.client.get(reverse('performance_stats'))
+        self.assertIn('home', response.json())
+
+
+class UserPreferencesSessionTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('prefs_user', 'prefs@example.com', 'password123')
+        UserPreferences.objects.create(user=self.user, dark_mode=True)
+        self.client.force_login(self.user)
+
+    def test_preferences_are_read_once_per_session(self):
+        response = self.client.get(reverse('home'))
+        self.assertContains(response, 'css/dark.css')
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('home'))
+        self.assertContains(response, 'css/dark.css')
+        self.assertFalse([query for query in context.captured_queries if 'userpreferences' in query['sql']])
+
+    def test_settings_post_refreshes_session(self):
+        self.client.get(reverse('home'))
+        self.client.post(reverse('settings'), {'dark_mode': 'false'})
+        self.assertFalse(UserPreferences.objects.get(user=self.user).dark_mode)
+
+        response = self.client.get(reverse('home'))
+        self.assertNotContains(response, 'css/dark.css')
+
+
+class ExpenseApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('api_user', 'api@example.com', 'password123')
+        cls.event = create_event_with_expenses(cls.user, "API Event", 120)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        self.url = reverse('api_event_expenses', args=[self.event.id])
+
+    def test_pages_follow_meta_ordering(self):
+        ids = []
+        params = {'page_size': 50, 'fields': 'id'}
+        while True:
+            data = self.client.get(self.url, params).json()
+            ids.extend(row['id'] for row in data['results'])
+            if not data['next_cursor']:
+                break
+            params['cursor'] = data['next_cursor']
+        expected = list(Expense.objects.filter(event=self.event).order_by('-date', '-id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+
+    def test_fields_and_filters(self):
+        payer = Member.objects.filter(event=self.event).first()
+        data = self.client.get(self.url, {'fields': 'id,payer,contributors', 'payer': payer.id, 'date_to': '2024-01-10'}).json()
+        self.assertTrue(data['results'])
+        for row in data['results']:
+            self.assertEqual(set(row), {'id', 'payer', 'contributors'})
+            self.assertEqual(row['payer'], payer.name)
+            self.assertEqual(len(row['contributors']), 5)
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.client.get(self.url, {'fields': 'password'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'date_from': '01/01/2024'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'cursor': 'not-a-cursor'}).status_code, 400)
+
+
+class KeysetCursorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('cursor_user', 'cursor@example.com', 'password123')
+        Event.objects.bulk_create([
+            Event(user=cls.user, title=f"Trip {i:02}", start_date=datetime.date(2024, 1, 1) + datetime.timedelta(days=i),
+                  end_date=datetime.date(2024, 2, 1), total_amount=Decimal(i))
+            for i in range(30)
+        ])
+        cls.event = create_event_with_expenses(cls.user, "API Event", 60)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_home_cursor_is_tied_to_its_sort(self):
+        title_cursor = self.client.get(reverse('home'), {'sort': 'title'}).context['next_cursor']
+        response = self.client.get(reverse('home'), {'sort': 'title', 'cursor': title_cursor})
+        self.assertEqual(response.context['events'][0]['event'].title, "Trip 24")
+
+        # A title cursor reused with another sort falls back to the first page
+        response = self.client.get(reverse('home'), {'sort': '-total_amount', 'cursor': title_cursor})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['is_first_page'])
+        self.assertEqual(response.context['events'][0]['event'].title, "Trip 29")
+
+        # A signed cursor whose value doesn't fit the sort field
+        response = self.client.get(reverse('home'), {'sort': '-total_amount', 'cursor': encode_cursor('-total_amount', ['Trip', 1])})
+        self.assertTrue(response.context['is_first_page'])
+
+    def test_cursors_are_not_shared_between_home_and_api(self):
+        home_cursor = self.client.get(reverse('home')).context['next_cursor']
+        url = reverse('api_event_expenses', args=[self.event.id])
+        response = self.client.get(url, {'cursor': home_cursor})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('sort order', response.json()['error'])
+
+        api_cursor = self.client.get(url, {'page_size': 10}).json()['next_cursor']
+        response = self.client.get(reverse('home'), {'sort': '-start_date', 'cursor': api_cursor})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['is_first_page'])
+
+
+class ExpenseSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('search_user', 'search@example.com', 'password123')
+        cls.event = create_event_with_expenses(cls.user, "Search Event", 30)
+
+    def search(self, query, user=None, event=None):
+        expenses, has_next = search_expenses(user or self.user, query, event=event)
+        return [expense.id for expense in expenses]
+
+    def test_index_follows_writes(self):
+        expense = Expense.objects.filter(event=self.event).first()
+        expense.description = "Dinner at the harbour"
+        expense.save()
+        self.assertEqual(self.search('harbour'), [expense.id])
+        self.assertEqual(self.search('harb', event=self.event), [expense.id])
+
+        expense.payer.name = "Zebediah"
+        expense.payer.save()
+        self.assertIn(expense.id, self.search('zebediah'))
+
+        expense.delete()
+        self.assertEqual(self.search('harbour'), [])
+
+    def test_results_are_limited_to_the_user(self):
+        other = User.objects.create_user('search_other', 'other@example.com', 'password123')
+        self.assertTrue(self.search('expense'))
+        self.assertEqual(self.search('expense', user=other), [])
+        # Scope tokens are not searchable
+        self.assertEqual(self.search(f'u{self.user.id}'), [])
+
+    def test_huge_page_numbers_are_clamped(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('search_expenses'), {'q': 'expense', 'page': '9' * 30})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['page'], SEARCH_MAX_PAGE)
+
+
+class CurrencyConversionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('currency_user', 'currency@example.com', 'password123')
+        cls.event = create_event_with_expenses(cls.user, "Currency Event", 2, member_count=2)
+        cls.member = Member.objects.filter(event=cls.event).first()
+        ExchangeRate.objects.create(currency='USD', date=datetime.date(2024, 1, 1), rate=Decimal('83.10'))
+        ExchangeRate.objects.create(currency='EUR', date=datetime.date(2024, 1, 1), rate=Decimal('90.50'))
+
+    def setUp(self):
+        clear_rate_cache()
+        self.client.force_login(self.user)
+
+    def add_expense(self, amount, currency, date=datetime.date(2024, 1, 10)):
+        return Expense.objects.create(user=self.user, event=self.event, description="Taxi", date=date, amount=amount, currency=currency, payer=self.member)
+
+    def test_base_amount_is_set_on_save(self):
+        # Latest rate on or before the expense date
+        self.assertEqual(self.add_expense(Decimal('10.00'), 'USD').base_amount, Decimal('831.00'))
+        self.assertEqual(self.add_expense(Decimal('10.00'), 'INR').base_amount, Decimal('10.00'))
+
+    @override_settings(FX_RATE_CACHE_TTL=60)
+    def test_cached_rates_expire(self):
+        with mock.patch('expenses.currency.time.monotonic', return_value=1000.0):
+            self.assertEqual(self.add_expense(Decimal('10.00'), 'USD').base_amount, Decimal('831.00'))
+            # Loaded by another process, which can't clear this one's cache
+            ExchangeRate.objects.create(currency='USD', date=datetime.date(2024, 1, 10), rate=Decimal('84.00'))
+            self.assertEqual(self.add_expense(Decimal('10.00'), 'USD').base_amount, Decimal('831.00'))
+        with mock.patch('expenses.currency.time.monotonic', return_value=1060.0):
+            self.assertEqual(self.add_expense(Decimal('10.00'), 'USD').base_amount, Decimal('840.00'))
+
+    def test_missing_rate_is_a_form_error(self):
+        ExchangeRate.objects.filter(currency='USD').delete()
+        data = {'description': "Taxi", 'date': '2024-01-10', 'amount': '10.00', 'payer': self.member.id,
+                'contributors': [self.member.id], 'currency': 'USD', 'approval_status': 'Pending'}
+        form = ExpenseForm(data, event=self.event)
+        self.assertFalse(form.is_valid())
+        self.assertIn('currency', form.errors)
+
+    def test_analytics_are_in_one_reporting_currency(self):
+        usd_event = Event.objects.create(user=self.user, title="Dollar Event", start_date=datetime.date(2024, 1, 1), end_date=datetime.date(2024, 1, 31), base_currency='USD')
+        usd_member = Member.objects.create(user=self.user, event=usd_event, name="Sam")
+        Expense.objects.create(user=self.user, event=usd_event, description="Hotel", date=datetime.date(2024, 1, 5), amount=Decimal('10.00'), currency='USD', payer=usd_member)
+        # No EUR rate before 2024-01-01, so this one can't be converted to INR
+        eur_event = Event.objects.create(user=self.user, title="Euro Event", start_date=datetime.date(2023, 12, 1), end_date=datetime.date(2023, 12, 31), base_currency='EUR')
+        eur_member = Member.objects.create(user=self.user, event=eur_event, name="Eva")
+        Expense.objects.create(user=self.user, event=eur_event, description="Museum", date=datetime.date(2023, 12, 30), amount=Decimal('5.00'), currency='EUR', payer=eur_member)
+        bump_analytics_version(self.user.id)
+
+        rollup = get_rollup(self.user)
+        self.assertEqual(rollup['currency'], 'INR')
+        # 2 x 100 INR + 10 USD at 83.10
+        self.assertEqual(rollup['total_event_expenditure'], Decimal('1031.00'))
+        self.assertEqual(rollup['total_expenses_count'], 4)
+        self.assertEqual(rollup['unconverted'], {'EUR': Decimal('5.00')})
+
+        response = self.client.get(reverse('analytics'))
+        self.assertContains(response, '₹1031.00')
+        self.assertContains(response, 'Not included (no exchange rate): €5.00')
+
+    def test_changing_base_currency_reconverts(self):
+        expense = self.add_expense(Decimal('10.00'), 'USD')
+        response = self.client.post(reverse('edit_event', args=[self.event.id]), {
+            'title': self.event.title, 'description': '', 'start_date': '2024-01-01', 'end_date': '2024-01-31',
+            'location': '', 'base_currency': 'EUR',
+        })
+        self.assertEqual(response.status_code, 302)
+        expense.refresh_from_db()
+        # 10 USD = 831 INR = 831 / 90.50 EUR
+        self.assertEqual(expense.base_amount, Decimal('9.18'))
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.total_amount, Expense.objects.filter(event=self.event).aggregate(total=Sum('base_amount'))['total'])
+
+    def test_backfill_fills_rows_already_in_the_base_currency(self):
+        # What existing rows look like right after the base_amount / share migration
+        Expense.objects.filter(event=self.event).update(base_amount=0)
+        ExpenseShare.objects.filter(expense__event=self.event).update(share=0)
+        call_command('backfill_base_amounts', stdout=io.StringIO())
+        self.assertFalse(Expense.objects.filter(event=self.event, base_amount=0).exists())
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.total_amount, Decimal('200.00'))
+        self.assertEqual(verify_event_totals(self.event), [])
+
+
+class SqliteProfileTests(TestCase):
+    def test_pragmas_are_applied_to_connections(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest("SQLite profile only")
+        pragmas = current_pragmas(connection)
+        self.assertEqual(pragmas['busy_timeout'], 20000)
+        # synchronous=NORMAL
+        self.assertEqual(pragmas['synchronous'], 1)
+
+
+class AsyncChartViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('chart_user', 'chart@example.com', 'password123')
+        cls.event = create_event_with_expenses(cls.user, "Chart Event", 10, member_count=2)
+        cls.member = Member.objects.filter(event=cls.event).first()
+        cls.other = User.objects.create_user('chart_other', 'other@example.com', 'password123')
+
+    async def test_chart_data(self):
+        client = AsyncClient()
+        await client.aforce_login(self.user)
+        response = await client.get(reverse('category_distribution', args=[self.event.id]))
+        self.assertEqual(response.json()['percentiles'], [100.0])
+        response = await client.get(reverse('selected_user_expenses', args=[self.event.id, self.member.id]))
+        # Member 0 paid every other expense of 100
+        self.assertEqual(Decimal(response.json()['data'][0]), Decimal('500'))
+        self.assertEqual(response.json()['percentiles'], [100.0])
+        response = await client.get(reverse('selected_user_expenses', args=[self.event.id, 0]))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_async_queries_are_counted(self):
+        url = reverse('category_distribution', args=[self.event.id])
+        client = AsyncClient()
+        await client.aforce_login(self.user)
+        async_timing = (await client.get(url))['Server-Timing']
+        await sync_to_async(self.client.force_login)(self.user)
+        sync_timing = (await sync_to_async(self.client.get)(url))['Server-Timing']
+        queries = re.search(r'desc="(\d+) queries"', async_timing).group(1)
+        self.assertGreater(int(queries), 0)
+        self.assertIn(f'desc="{queries} queries"', sync_timing)
+
+    async def test_requires_owner(self):
+        client = AsyncClient()
+        response = await client.get(reverse('category_distribution', args=[self.event.id]))
+        self.assertEqual(response.status_code, 302)
+        await client.aforce_login(self.other)
+        response = await client.get(reverse('category_distribution', args=[self.event.id]))
+        self.assertEqual(response.status_code, 404)
+
+
+class IncrementalLedgerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('ledger_user', 'ledger@example.com', 'password123')
+        cls.event = create_event_with_expenses(cls.user, "Ledger Event", 6, member_count=3)
+        refresh_event_totals(cls.event)
+        cls.members = list(Member.objects.filter(event=cls.event).order_by('id'))
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def expense_data(self, amount, payer, contributors):
+        return {'add_expense': '1', 'description': "Dinner", 'date': '2024-01-05', 'amount': amount, 'payer': payer.id,
+                'contributors': [member.id for member in contributors], 'currency': 'INR', 'approval_status': 'Pending'}
+
+    def assertLedgerMatches(self):
+        self.event.refresh_from_db()
+        self.assertEqual(verify_event_totals(self.event), [])
+
+    def test_add_edit_and_delete_keep_the_ledger_in_step(self):
+        self.client.post(reverse('event_details', args=[self.event.id]), self.expense_data('100.00', self.members[0], self.members))
+        self.assertLedgerMatches()
+        expense = Expense.objects.get(event=self.event, description="Dinner")
+
+        # New amount, payer and contributors: the old shares are reverted
+        data = self.expense_data('45.50', self.members[1], self.members[1:])
+        del data['add_expense']
+        self.client.post(reverse('edit_expense', args=[expense.id]), data)
+        self.assertLedgerMatches()
+        self.assertEqual(Member.objects.get(id=self.members[1].id).amount_paid, Decimal('245.50'))
+
+        self.client.post(reverse('delete_expense', args=[expense.id]))
+        self.assertLedgerMatches()
+        self.assertEqual(self.event.expense_count, 6)
+
+    def test_admin_writes_keep_the_ledger_in_step(self):
+        admin_user = User.objects.create_superuser('ledger_admin', 'ledger_admin@example.com', 'password123')
+        self.client.force_login(admin_user)
+        expense = Expense.objects.filter(event=self.event).first()
+        data = {
+            'user': self.user.id, 'event': self.event.id, 'description': "Edited in admin", 'date': '2024-01-05',
+            'amount': '60.00', 'payer': self.members[2].id,
+            'notes': '', 'category': '', 'currency': 'INR', 'location': '', 'payment_method': '', 'approval_status': 'Pending',
+        }
+        # Contributors inline: keep the first two members, drop the third
+        rows = list(ExpenseShare.objects.filter(expense=expense).order_by('member_id'))
+        data.update({'shares-TOTAL_FORMS': len(rows), 'shares-INITIAL_FORMS': len(rows), 'shares-MIN_NUM_FORMS': 0, 'shares-MAX_NUM_FORMS': 1000})
+        for index, row in enumerate(rows):
+            data.update({f'shares-{index}-id': row.id, f'shares-{index}-expense': expense.id, f'shares-{index}-member': row.member_id, f'shares-{index}-weight': '1'})
+        data['shares-2-DELETE'] = 'on'
+        response = self.client.post(reverse('admin:expenses_expense_change', args=[expense.id]), data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(sorted(ExpenseShare.objects.filter(expense=expense).values_list('share', flat=True)), [Decimal('30.00'), Decimal('30.00')])
+        self.assertLedgerMatches()
+
+        self.client.post(reverse('admin:expenses_expense_delete', args=[expense.id]), {'post': 'yes'})
+        self.assertFalse(Expense.objects.filter(id=expense.id).exists())
+        self.assertLedgerMatches()
+
+        self.client.post(reverse('admin:expenses_member_delete', args=[self.members[2].id]), {'post': 'yes'})
+        self.assertLedgerMatches()
+
+    def test_balance_reads_only_the_members(self):
+        with self.assertNumQueries(1):
+            balances = net_balances(self.event)
+        paid, owed = member_totals(self.event)
+        self.assertEqual(balances, {member_id: paid[member_id] - owed[member_id] for member_id in paid})
+
+
+class SplitEngineTests(TestCase):
+    def test_remainder_paise_are_allocated(self):
+        shares = compute_shares(Decimal('100.00'), Decimal('100.00'), [(Decimal('1'), None)] * 3)
+        self.assertEqual(shares, [Decimal('33.34'), Decimal('33.33'), Decimal('33.33')])
+
+    def test_weighted_and_fixed_splits(self):
+        shares = compute_shares(Decimal('100.00'), Decimal('100.00'), [(Decimal('2'), None), (Decimal('1'), None), (Decimal('1'), Decimal('10.00'))])
+        self.assertEqual(shares, [Decimal('60.00'), Decimal('30.00'), Decimal('10.00')])
+        # Fixed amounts are in the expense's currency and converted with it
+        shares = compute_shares(Decimal('10.00'), Decimal('831.00'), [(Decimal('1'), Decimal('4.00')), (Decimal('1'), None), (Decimal('1'), None)])
+        self.assertEqual(shares, [Decimal('332.40'), Decimal('249.30'), Decimal('249.30')])
+        self.assertEqual(sum(shares), Decimal('831.00'))
+
+    def test_converted_fixed_shares_never_overshoot_the_total(self):
+        # Rounding the two converted fixed shares up separately used to leave -0.01
+        shares = compute_shares(Decimal('1.00'), Decimal('83.15'), [(Decimal('1'), Decimal('0.50')), (Decimal('1'), Decimal('0.50')), (Decimal('1'), None)])
+        self.assertEqual(shares, [Decimal('41.58'), Decimal('41.57'), Decimal('0.00')])
+
+    def test_fixed_amounts_over_the_total_are_rejected(self):
+        with self.assertRaises(SplitError):
+            compute_shares(Decimal('10.00'), Decimal('10.00'), [(Decimal('1'), Decimal('8.00')), (Decimal('1'), Decimal('3.00'))])
+
+    def test_admin_weight_change_resplits_and_updates_the_ledger(self):
+        admin_user = User.objects.create_superuser('split_admin', 'split_admin@example.com', 'password123')
+        event = create_event_with_expenses(admin_user, "Admin Split Event", 1, member_count=2)
+        refresh_event_totals(event)
+        row = ExpenseShare.objects.filter(expense__event=event).order_by('member_id').first()
+        self.client.force_login(admin_user)
+        response = self.client.post(reverse('admin:expenses_expenseshare_change', args=[row.id]), {'weight': '3', 'fixed_amount': ''})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(list(ExpenseShare.objects.filter(expense__event=event).order_by('member_id').values_list('share', flat=True)), [Decimal('75.00'), Decimal('25.00')])
+        event.refresh_from_db()
+        self.assertEqual(verify_event_totals(event), [])
+
+        # A fixed amount over the expense amount is a form error, not a 500
+        response = self.client.post(reverse('admin:expenses_expenseshare_change', args=[row.id]), {'weight': '1', 'fixed_amount': '150.00'})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "more than the expense amount")
+
+        # Negative weights and fixed amounts are rejected by the field validators
+        for data in ({'weight': '-1', 'fixed_amount': ''}, {'weight': '1', 'fixed_amount': '-10.00'}):
+            response = self.client.post(reverse('admin:expenses_expenseshare_change', args=[row.id]), data)
+            self.assertEqual(response.status_code, 200)
+            self.assertContains(response, "Ensure this value is greater than or equal to 0")
+        with self.assertRaises(SplitError):
+            compute_shares(Decimal('100'), Decimal('100'), [(Decimal('-1'), None), (Decimal('2'), None)])
+        self.assertEqual(verify_event_totals(event), [])
+
+
+    def test_export_uses_the_stored_shares(self):
+        user = User.objects.create_user('split_export', 'split_export@example.com', 'password123')
+        event = create_event_with_expenses(user, "Export Split Event", 1, member_count=3)
+        ExpenseShare.objects.filter(expense__event=event, member__name="Member 0").update(weight=2)
+        update_shares(list(Expense.objects.filter(event=event).values_list('id', flat=True)))
+        row = next(expense_rows(event))
+        self.assertEqual(row['shares'], [Decimal('50.00'), Decimal('25.00'), Decimal('25.00')])
+
+
+class ApprovalSummaryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('approval_user', 'approval@example.com', 'password123')
+        cls.event = create_event_with_expenses(cls.user, "Approval Event", 5, member_count=2)
+        cls.empty_event = Event.objects.create(user=cls.user, title="Empty Event", start_date=datetime.date(2024, 1, 1), end_date=datetime.date(2024, 1, 2))
+
+    def test_summary_is_one_query_and_bulk_variant_matches(self):
+        Expense.objects.filter(id=Expense.objects.filter(event=self.event).order_by('id')[0].id).update(approval_status='Rejected')
+        with self.assertNumQueries(1):
+            summary = approval_summary(self.event)
+        self.assertEqual(summary['pending'], {'count': 4, 'amount': Decimal('400.00')})
+        self.assertEqual(summary['rejected'], {'count': 1, 'amount': Decimal('100.00')})
+        self.assertFalse(summary['all_approved'])
+
+        with self.assertNumQueries(1):
+            summaries = approval_summaries([self.event.id, self.empty_event.id])
+        self.assertEqual(summaries[self.event.id], summary)
+        self.assertEqual(summaries[self.empty_event.id]['total_count'], 0)
+        self.assertFalse(summaries[self.empty_event.id]['all_approved'])
+        self.assertFalse(self.empty_event.all_expenses_approved())
+
+    def test_home_reads_only_the_page_expenses(self):
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('home'))
+        self.assertContains(response, "Approval Event")
+        # Events are paginated on their own; expenses are only read for the page ids
+        expense_queries = [query['sql'] for query in queries if '"expenses_expense"' in query['sql']]
+        self.assertEqual(len(expense_queries), 1)
+        self.assertNotIn('"expenses_event"', expense_queries[0])
+        self.assertIn(' IN (', expense_queries[0])
+
+    def test_bulk_approve_updates_in_one_statement(self):
+        self.client.force_login(self.user)
+        expense_ids = list(Expense.objects.filter(event=self.event).values_list('id', flat=True))
+        with CaptureQueriesContext(connection) as queries:
+            updated, summary = set_approval_status(self.event, expense_ids, 'Approved')
+        self.assertEqual(updated, 5)
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('UPDATE')]), 1)
+        self.assertTrue(summary['all_approved'])
+        self.assertTrue(self.event.all_expenses_approved())
+
+        response = self.client.post(reverse('bulk_update_approval', args=[self.event.id]), {'expense_ids': expense_ids[:2], 'approval_status': 'Rejected'})
+        self.assertRedirects(response, reverse('expense_audit_trail', args=[self.event.id]))
+        self.assertEqual(approval_summary(self.event)['rejected']['count'], 2)
+        with self.assertRaises(ValueError):
+            set_approval_status(self.event, expense_ids, 'Settled')
+
+
+class ExpenseImportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('import_user', 'import@example.com', 'password123')
+        cls.event = create_event_with_expenses(cls.user, "Import Event", 0, member_count=2)
+
+    def csv_file(self, content, name='expenses.csv'):
+        return SimpleUploadedFile(name, content if isinstance(content, bytes) else content.encode())
+
+    def test_valid_rows_are_imported_and_bad_rows_reported(self):
+        result = import_expenses(self.event, self.csv_file(
+            "description,date,amount,payer,contributors\n"
+            "Dinner,2024-01-05,90.00,Member 0,\n"
+            "Taxi,2024-01-06,NaN,Member 1,\n"
+            "Hotel,2024-01-07,1e999999,Member 1,\n"
+            "Lunch,2024-01-08,10.00,Nobody,\n"
+        ), self.user)
+        self.assertEqual(result.imported, 1)
+        self.assertEqual([error['row'] for error in result.errors], [3, 4, 5])
+        self.assertIn('Invalid amount "NaN"', result.errors[0]['message'])
+        expense = Expense.objects.get(event=self.event, description="Dinner")
+        self.assertEqual(sorted(expense.shares.values_list('share', flat=True)), [Decimal('45.00'), Decimal('45.00')])
+
+    def test_unreadable_files_are_file_errors(self):
+        with self.assertRaises(ImportFileError):
+            import_expenses(self.event, self.csv_file(b"description,date,amount,payer\nCaf\xe9,2024-01-05,1.00,Member 0\n"), self.user)
+        with self.assertRaises(ImportFileError):
+            import_expenses(self.event, self.csv_file(b"not a zip file", name='expenses.xlsx'), self.user)
+        with self.assertRaises(ImportFileError):
+            import_expenses(self.event, self.csv_file("description,date\nDinner,2024-01-05\n"), self.user)
+        self.assertFalse(Expense.objects.filter(event=self.event).exists())
+
+    def test_view_reports_file_errors(self):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('import_expenses', args=[self.event.id]), {'file': self.csv_file(b"description,date,amount,payer\n\xff\xfe\n")}, follow=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "not valid UTF-8")
+
+
+class AnalyticsVersionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('analytics_user', 'analytics@example.com', 'password123')
+        create_event_with_expenses(cls.user, "Analytics Event", 3, member_count=2)
+
+    def setUp(self):
+        analytics_cache().clear()
+        version_cache().clear()
+        self.client.force_login(self.user)
+
+    def test_etag_is_not_reused_after_the_version_is_lost(self):
+        url = reverse('analytics_bundle')
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # A restart or eviction loses the version; the old ETag must not match again
+        version_cache().clear()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        etag = self.client.get(url)['ETag']
+        bump_analytics_version(self.user.id)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_versions_are_shared_between_workers(self):
+        # Another worker only shares the database with this one
+        self.assertNotEqual(settings.CACHES[settings.ANALYTICS_VERSION_CACHE_ALIAS]['BACKEND'], 'django.core.cache.backends.locmem.LocMemCache')
+        get_rollup(self.user)
+        # Cached: only the version lookup
+        with self.assertNumQueries(1):
+            get_rollup(self.user)
+        version = analytics_version(self.user.id)
+        bump_analytics_version(self.user.id)
+        self.assertNotEqual(version_cache().get(version_key(self.user.id)), version)
+        with CaptureQueriesContext(connection) as queries:
+            get_rollup(self.user)
+        self.assertGreater(len(queries), 1)
+
+
+class ExpenseExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('export_user', 'export@example.com', 'password123')
+        cls.event = create_event_with_expenses(cls.user, "Export Event", 5, member_count=2)
+
+    def test_csv_and_ndjson_output(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('export_expenses', args=[self.event.id, 'csv']))
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[0]['contributors'], 'Member 0; Member 1')
+        self.assertEqual(rows[0]['shares'], '50.00; 50.00')
+
+        response = self.client.get(reverse('export_expenses', args=[self.event.id, 'ndjson']))
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([line['id'] for line in lines], [int(row['id']) for row in rows])
+        self.assertEqual(lines[0]['base_amount'], '100.00')
+
+    def test_prefetches_run_per_chunk(self):
+        # One cursor for the expenses, then the contributor and share prefetches once per chunk
+        with self.assertNumQueries(1 + 2 * 3):
+            rows = list(expense_rows(self.event, chunk_size=2))
+        self.assertEqual(len(rows), 5)
+        self.assertTrue(all(len(row['shares']) == 2 for row in rows))
+
+
+class SettlementPlanTests(TestCase):
+    def assertSettles(self, balances, transfers):
+        # Applying the transfers brings every balance back to zero
+        remaining = dict(balances)
+        for payer, payee, amount in transfers:
+            self.assertGreater(amount, 0)
+            remaining[payer] += amount
+            remaining[payee] -= amount
+        self.assertTrue(all(abs(amount) < Decimal('0.01') for amount in remaining.values()), remaining)
+
+    def test_random_balances_settle(self):
+        generator = random.Random(7)
+        for _ in range(50):
+            amounts = [Decimal(generator.randint(-50000, 50000)) / 100 for _ in range(generator.randint(2, 9))]
+            balances = dict(enumerate(amounts + [-sum(amounts)]))
+            transfers = plan_transfers(balances)
+            self.assertSettles(balances, transfers)
+            self.assertLessEqual(len(transfers), len(balances) - 1)
+
+    def test_exact_solver_beats_greedy_on_small_groups(self):
+        balances = {member_id: Decimal(amount) for member_id, amount in enumerate([-8, 6, -2, 3, 4, -3])}
+        self.assertEqual(len(plan_transfers(balances, exact_limit=0)), 5)
+        # {3, -3} settles on its own: 6 members in 2 zero-sum groups need 4 transfers
+        transfers = plan_transfers(balances)
+        self.assertEqual(len(transfers), 4)
+        self.assertSettles(balances, transfers)
+
+    def test_rounding_drift_is_absorbed(self):
+        third = Decimal('100') / 3
+        balances = {1: third, 2: third, 3: -2 * third}
+        transfers = plan_transfers(balances)
+        self.assertSettles(balances, transfers)
+        # 33.33 + 33.33 - 66.67 leaves a paisa over; the largest balance absorbs it
+        self.assertEqual(transfers, [(3, 1, Decimal('33.33')), (3, 2, Decimal('33.33'))])
+
+    def test_large_groups_fall_back_to_greedy(self):
+        balances = {member_id: Decimal(member_id + 1) for member_id in range(13)}
+        balances[13] = -sum(balances.values())
+        with mock.patch('expenses.settlements.exact_transfers', side_effect=AssertionError("exact solver used")):
+            transfers = plan_transfers(balances)
+        self.assertEqual(len(transfers), 13)
+        self.assertSettles(balances, transfers)
+
+    def test_settlement_page_requires_login(self):
+        user = User.objects.create_user('settle_user', 'settle@example.com', 'password123')
+        event = create_event_with_expenses(user, "Settlement Event", 4, member_count=3)
+        url = reverse('settlement', args=[event.id])
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.force_login(user)
+        self.assertEqual(self.client.get(url).status_code, 200)
+        event.refresh_from_db()
+        self.assertFalse(event.settlement_stale)
+
+
+class ReportJobTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('report_user', 'report@example.com', 'password123')
+        cls.event = create_event_with_expenses(cls.user, "Report Event", 4, member_count=2)
+        refresh_event_totals(cls.event)
+        cls.member = Member.objects.filter(event=cls.event).first()
+
+    def setUp(self):
+        report_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(report_dir.cleanup)
+        settings_override = override_settings(REPORT_PDF_WORKERS=0, REPORT_PDF_DIR=report_dir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        patcher = mock.patch('expenses.reports.render_report_pdf', side_effect=self.fake_render)
+        self.render = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def fake_render(self, event, member, data_version):
+        path = report_pdf_path(event.id, member.id, data_version)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as output:
+            output.write(b'%PDF-1.4')
+        return path
+
+    def submit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return submit_report_job(self.event, self.member, self.user)
+
+    def test_a_job_is_claimed_once(self):
+        job = ReportJob.objects.create(user=self.user, event=self.event, member=self.member, data_version=report_data_version(self.event))
+        run_report_job(job.id)
+        run_report_job(job.id)
+        self.assertEqual(self.render.call_count, 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'Done')
+        self.assertTrue(os.path.exists(job.file_path))
+
+    def test_unchanged_reports_come_from_the_cache(self):
+        job = self.submit()
+        self.assertEqual(job.status, 'Pending')
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'Done')
+        # Same data: the finished job is handed back, nothing is rendered again
+        self.assertEqual(self.submit().id, job.id)
+        ReportJob.objects.all().delete()
+        cached = self.submit()
+        self.assertEqual((cached.status, cached.file_path), ('Done', job.file_path))
+        self.assertEqual(self.render.call_count, 1)
+
+    def test_expense_changes_invalidate_the_cache(self):
+        first = self.submit()
+        expense = Expense.objects.filter(event=self.event).first()
+        self.client.force_login(self.user)
+        self.client.post(reverse('delete_expense', args=[expense.id]))
+        self.event.refresh_from_db()
+        second = self.submit()
+        self.assertNotEqual(second.data_version, first.data_version)
+        self.assertEqual(self.render.call_count, 2)
+
+
+class FailingMailConnection:
+    def open(self):
+        return True
+
+    def close(self):
+        pass
+
+    def send_messages(self, messages):
+        raise ConnectionResetError("relay hung up")
+
+
+@override_settings(MAIL_QUEUE_SENDER_THREAD=False, MAIL_QUEUE_BACKEND='django.core.mail.backends.locmem.EmailBackend', MAIL_QUEUE_RETRY_DELAY=60, MAIL_QUEUE_MAX_ATTEMPTS=2)
+class MailQueueTests(TestCase):
+    def queue(self, subject, **fields):
+        return OutboundEmail.objects.create(subject=subject, body="Body", to='member@example.com', **fields)
+
+    def test_due_messages_are_claimed_once(self):
+        first = self.queue("First")
+        second = self.queue("Second")
+        self.queue("Later", next_attempt=timezone.now() + datetime.timedelta(hours=1))
+        self.assertEqual([email.id for email in claim_due(10)], [first.id, second.id])
+        self.assertEqual(claim_due(10), [])
+        self.assertEqual(OutboundEmail.objects.filter(status='Sending').count(), 2)
+
+    def test_failures_back_off_then_give_up(self):
+        email = self.queue("Retry me")
+        self.assertEqual(send_queued_mail(connection=FailingMailConnection()), (0, 1))
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts, email.last_error), ('Pending', 1, "relay hung up"))
+        self.assertAlmostEqual((email.next_attempt - timezone.now()).total_seconds(), 60, delta=5)
+        # Not due yet, so nothing is claimed
+        self.assertEqual(send_queued_mail(connection=FailingMailConnection()), (0, 0))
+
+        OutboundEmail.objects.filter(pk=email.pk).update(next_attempt=timezone.now())
+        send_queued_mail(connection=FailingMailConnection())
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ('Failed', 2))
+
+    def test_stuck_messages_are_requeued_and_sent(self):
+        stuck = self.queue("Stuck", status='Sending', next_attempt=timezone.now() - datetime.timedelta(hours=1))
+        in_flight = self.queue("In flight", status='Sending', next_attempt=timezone.now())
+        call_command('send_queued_mail', stale_minutes=30, stdout=io.StringIO())
+        stuck.refresh_from_db()
+        in_flight.refresh_from_db()
+        self.assertEqual(stuck.status, 'Sent')
+        self.assertEqual(in_flight.status, 'Sending')
+        self.assertEqual([message.subject for message in mail.outbox], ["Stuck"])
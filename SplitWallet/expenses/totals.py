@@ -0,0 +1,162 @@
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import transaction
+from django.db.models import Sum, Count, F, Case, When, Value, DecimalField
+
+from .analytics import bump_analytics_version
+from .balances import member_totals
+from .models import Event, Member, Expense, ExpenseShare
+from .settlements import mark_settlement_stale
+
+# Running totals
+#
+# Event.total_amount / Event.expense_count and Member.amount_paid /
+# Member.amount_owed are denormalized so read paths never re-aggregate the
+# expense table. The member columns form a per-event ledger: each expense
+# adds its amount to its payer's amount_paid and each contributor's stored
+# share (expenses.splits) to their amount_owed, so a member's balance is
+# paid - owed.
+#
+# Single-expense writes keep the ledger up to date incrementally: take a
+# ledger_entries snapshot of the expense before the write and another after
+# it, and apply_ledger adds the difference. That covers adds, edits, deletes
+# and contributor changes, in a few queries whatever the event size. Bulk
+# writes (imports, member deletes, reconversions) call refresh_event_totals,
+# which recomputes everything. Both run inside the write's transaction.
+# Writers go through expense_changed / expenses_changed, which also mark the
+# settlement plan stale and invalidate cached analytics.
+#
+# The views and the admin (expenses.admin) are the only writers that keep
+# the ledger this way; there are no model signals. Anything else that
+# changes expenses, contributors or shares directly (a shell session,
+# expense.contributors.add(), ExpenseShare.objects.update(), a raw SQL fix)
+# must call update_shares and apply_ledger / refresh_event_totals itself,
+# or be followed by `manage.py verify_ledgers --fix`.
+
+PAISE = Decimal('0.01')
+ZERO_AMOUNT = Decimal('0.00')
+
+
+def to_amount(value):
+    return (value or Decimal('0')).quantize(PAISE, rounding=ROUND_HALF_UP)
+
+
+def compute_event_totals(event):
+    # Fresh totals straight from the expense table
+    summary = Expense.objects.filter(event=event).order_by().aggregate(total=Sum('base_amount'), count=Count('id'))
+    paid, owed = member_totals(event)
+    return {
+        'total_amount': to_amount(summary['total']),
+        'expense_count': summary['count'],
+        'members': {member_id: (to_amount(paid[member_id]), to_amount(owed[member_id])) for member_id in paid},
+    }
+
+
+def ledger_entries(expense_ids):
+    # What the given expenses contribute to their event's totals and ledger
+    entries = {'total_amount': ZERO_AMOUNT, 'expense_count': 0, 'members': {}}
+    if not expense_ids:
+        return entries
+
+    def add(member_id, paid=ZERO_AMOUNT, owed=ZERO_AMOUNT):
+        member_paid, member_owed = entries['members'].get(member_id, (ZERO_AMOUNT, ZERO_AMOUNT))
+        entries['members'][member_id] = (member_paid + paid, member_owed + owed)
+
+    for payer_id, amount in Expense.objects.filter(id__in=expense_ids).order_by().values_list('payer_id', 'base_amount'):
+        entries['total_amount'] += amount
+        entries['expense_count'] += 1
+        add(payer_id, paid=amount)
+
+    for member_id, share in ExpenseShare.objects.filter(expense_id__in=expense_ids).values_list('member_id', 'share'):
+        add(member_id, owed=share)
+
+    return entries
+
+
+def apply_ledger(event, before, after):
+    # Move the event's totals and member ledger from `before` to `after`
+    # (two ledger_entries snapshots of the same expenses)
+    total_delta = after['total_amount'] - before['total_amount']
+    count_delta = after['expense_count'] - before['expense_count']
+    if total_delta or count_delta:
+        Event.objects.filter(pk=event.pk).update(
+            total_amount=F('total_amount') + total_delta,
+            expense_count=F('expense_count') + count_delta,
+        )
+        event.total_amount += total_delta
+        event.expense_count += count_delta
+
+    deltas = {}
+    for member_id in before['members'].keys() | after['members'].keys():
+        paid_before, owed_before = before['members'].get(member_id, (ZERO_AMOUNT, ZERO_AMOUNT))
+        paid_after, owed_after = after['members'].get(member_id, (ZERO_AMOUNT, ZERO_AMOUNT))
+        if paid_after != paid_before or owed_after != owed_before:
+            deltas[member_id] = (paid_after - paid_before, owed_after - owed_before)
+    if not deltas:
+        return
+
+    # One UPDATE for every affected member
+    def delta_case(index):
+        return Case(
+            *[When(id=member_id, then=Value(delta[index])) for member_id, delta in deltas.items()],
+            default=Value(ZERO_AMOUNT),
+            output_field=DecimalField(max_digits=12, decimal_places=2),
+        )
+
+    Member.objects.filter(event=event, id__in=deltas).update(
+        amount_paid=F('amount_paid') + delta_case(0),
+        amount_owed=F('amount_owed') + delta_case(1),
+    )
+
+
+def refresh_event_totals(event):
+    totals = compute_event_totals(event)
+
+    with transaction.atomic():
+        Event.objects.filter(pk=event.pk).update(total_amount=totals['total_amount'], expense_count=totals['expense_count'])
+        members = [
+            Member(id=member_id, amount_paid=paid, amount_owed=owed)
+            for member_id, (paid, owed) in totals['members'].items()
+        ]
+        Member.objects.bulk_update(members, ['amount_paid', 'amount_owed'], batch_size=500)
+
+    event.total_amount = totals['total_amount']
+    event.expense_count = totals['expense_count']
+    return totals
+
+
+def expenses_changed(event):
+    # Keep everything derived from an event's expenses in step with a write.
+    # Call inside the same transaction as the write itself.
+    refresh_event_totals(event)
+    mark_settlement_stale(event)
+    # Only invalidate cached analytics once the new data is visible to readers
+    transaction.on_commit(lambda: bump_analytics_version(event.user_id))
+
+
+def expense_changed(event, before, after):
+    # Incremental expenses_changed for a single expense: `before` and `after`
+    # are its ledger_entries snapshots around the write
+    apply_ledger(event, before, after)
+    mark_settlement_stale(event)
+    transaction.on_commit(lambda: bump_analytics_version(event.user_id))
+
+
+def verify_event_totals(event):
+    # List of human readable mismatches between stored and fresh totals
+    totals = compute_event_totals(event)
+    problems = []
+
+    if event.total_amount != totals['total_amount']:
+        problems.append(f"total_amount is {event.total_amount}, expected {totals['total_amount']}")
+    if event.expense_count != totals['expense_count']:
+        problems.append(f"expense_count is {event.expense_count}, expected {totals['expense_count']}")
+
+    for member in Member.objects.filter(event=event):
+        paid, owed = totals['members'][member.id]
+        if member.amount_paid != paid:
+            problems.append(f"{member.name}: amount_paid is {member.amount_paid}, expected {paid}")
+        if member.amount_owed != owed:
+            problems.append(f"{member.name}: amount_owed is {member.amount_owed}, expected {owed}")
+
+    return problems
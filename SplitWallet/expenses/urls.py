@@ -12,6 +12,7 @@ urlpatterns = [
     path('event/<int:event_id>/settlement/', views.settlement, name='settlement'),
     
     path('analytics/', views.analytics, name='analytics'),
+    path('analytics/bundle/', views.analytics_bundle, name='analytics_bundle'),
     path('analytics_data/', views.analytics_data, name='analytics_data'),
     path('analytics_data_by_month/', views.analytics_data_by_month, name='analytics_data_by_month'),
     path('analytics_data_by_year/', views.analytics_data_by_year, name='analytics_data_by_year'),
@@ -35,6 +36,10 @@ urlpatterns = [
     path('event/<int:event_id>/', views.event_details, name='event_details'),
     path('event/<int:event_id>/edit/', views.edit_event, name='edit_event'),
     path('event/<int:event_id>/add_member/', views.add_member, name='add_member'),
+    path('event/<int:event_id>/import/', views.import_event_expenses, name='import_expenses'),
+    path('event/<int:event_id>/export/<str:export_format>/', views.export_expenses, name='export_expenses'),
+    path('api/event/<int:event_id>/expenses/', views.api_event_expenses, name='api_event_expenses'),
+    path('search/', views.search, name='search_expenses'),
     
     path('event/<int:event_id>/members/', views.members, name='members'),
     path('event/<int:event_id>/edit_member/<int:member_id>/', views.edit_member, name='edit_member'),
@@ -44,9 +49,15 @@ urlpatterns = [
     path('expense/<int:expense_id>/edit/', views.edit_expense, name='edit_expense'),
     path('expense/<int:expense_id>/delete/', views.delete_expense, name='delete_expense'),
     path('event/<int:event_id>/generate_report/', views.generate_report, name='generate_report'),
+    path('event/<int:event_id>/report/<int:member_id>/pdf/', views.request_report_pdf, name='request_report_pdf'),
+    path('report/job/<int:job_id>/', views.report_job_status, name='report_job_status'),
+    path('report/job/<int:job_id>/download/', views.download_report, name='download_report'),
     path('expense/<int:event_id>/audit_trail/', views.expense_audit_trail, name='expense_audit_trail'),
+    path('expense/<int:event_id>/approval/', views.bulk_update_approval, name='bulk_update_approval'),
     
     path('category_distribution/<int:event_id>/', views.category_distribution_view, name='category_distribution'),
     path('selected_user_expenses/<int:event_id>/<int:user_id>/', views.selected_user_expense_view, name='selected_user_expenses'),
+    
+    path('performance/', views.performance_stats, name='performance_stats'),
 
 ]
@@ -1,31 +1,49 @@
-from django.shortcuts import render, redirect, get_object_or_404
-from .models import Event, Member, Expense, UserPreferences, Transaction
+from decimal import Decimal
+
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
+from .models import Event, Member, Expense, ExpenseShare, UserPreferences, Transaction, ReportJob, CURRENCY_SYMBOLS
 from django.contrib import messages
-from django.db.models import Sum, Count
-from django.db.models.functions import ExtractYear, ExtractMonth
+from django.db.models import Sum, Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth import login, authenticate
-from .forms import EventForm, MemberForm, ExpenseForm, CustomUserCreationForm, ForgotPasswordForm, TransactionForm
-from django.views.decorators.http import require_POST
-from django.http import JsonResponse
-from django.db.models import F, ExpressionWrapper, fields
-from django.db.models.functions import ExtractMonth, ExtractDay
+from .balances import EventBalances
+from .settlements import settlement_plan
+from .totals import ledger_entries, expense_changed, expenses_changed
+from .splits import share_rows, update_shares, SplitError
+from .pagination import keyset_page, InvalidCursor
+from .queries import expense_listing
+from .middleware import timing_summary
+from .analytics import get_rollup, get_bundle, aget_bundle, bundle_etag, bump_analytics_version
+from .forms import EventForm, MemberForm, ExpenseForm, CustomUserCreationForm, ForgotPasswordForm, TransactionForm, ExpenseImportForm
+from .importers import import_expenses, ImportFileError
+from .exports import expense_rows, csv_stream, ndjson_stream
+from .reports import member_report, submit_report_job
+from .mailqueue import queue_message
+from .emails import build_email
+from .preferences import get_preferences, store_preferences
+from .api import expense_page, ApiError
+from .search import search_expenses, SEARCH_MAX_PAGE
+from .currency import reconvert_expenses, ExchangeRateMissing
+from .approvals import approval_summary, approval_summaries, set_approval_status
+from .decorators import alogin_required
+from django.views.decorators.http import require_POST, condition
+from django.db import transaction
+from django.http import JsonResponse, Http404, StreamingHttpResponse, FileResponse
 
 import logging
 from django.contrib.auth import logout
 from django.contrib.auth.forms import AuthenticationForm
-from django.utils.html import strip_tags
 from django.contrib.auth import get_user_model
 from django.contrib.sites.shortcuts import get_current_site
-from django.template.loader import render_to_string
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
 from django.utils.encoding import force_bytes
-from django.core.mail import EmailMultiAlternatives
 from django.contrib.auth.tokens import default_token_generator
 from django.core.exceptions import ValidationError
 from django.core.exceptions import ObjectDoesNotExist
 
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
 from django.contrib.auth import views as auth_views
 # Create your views here.
 
@@ -72,13 +90,14 @@ def user_profile(request):
 @login_required(login_url='login')
 def user_settings(request):
     user = request.user
-    user_profile, created = UserPreferences.objects.get_or_create(user=user)
+    preferences = get_preferences(request)
 
     if request.method == 'POST':
         dark_mode = request.POST.get('dark_mode', None)
         if dark_mode is not None:
-            user_profile.dark_mode = dark_mode == 'true'
-            user_profile.save()
+            user_profile, created = UserPreferences.objects.update_or_create(user=user, defaults={'dark_mode': dark_mode == 'true'})
+            # Refresh the copy kept in the session
+            store_preferences(request, {'dark_mode': user_profile.dark_mode})
             if dark_mode == 'true':
                 messages.success(request, "Switched to Dark Mode")
             else:
@@ -88,7 +107,7 @@ def user_settings(request):
     dynamic_title = f"Settings ({user.username})"
     context = {
         'dynamic_title': dynamic_title,
-        'dark_mode_preference': user_profile.dark_mode,
+        'dark_mode_preference': preferences['dark_mode'],
     }
 
     return render(request, 'expenses/settings.html', context)
@@ -109,22 +128,17 @@ def user_signup(request):
 
             # Send email verification link
             current_site = get_current_site(request)
-            mail_subject = 'Activate your account'
-            message = render_to_string('expenses/account_activation_email.html', {
-                'user': user,
-                'domain': current_site.domain,
-                'uid': urlsafe_base64_encode(force_bytes(user.pk)),
-                'token': default_token_generator.make_token(user),
-            })
-            
-            # Remove HTML tags from the email message
-            plain_text_message = strip_tags(message)
-
-            email = EmailMultiAlternatives(mail_subject, plain_text_message, to=[email])
-            email.attach_alternative(message, "text/html")  # Attach the HTML version
-
-            # Send the email
-            email.send()
+            email = build_email(
+                'account_activation',
+                user=user,
+                domain=current_site.domain,
+                uid=urlsafe_base64_encode(force_bytes(user.pk)),
+                token=default_token_generator.make_token(user),
+                to=[email],
+            )
+
+            # Queue the email; the mail queue sender delivers it in the background
+            queue_message(email)
 
             # Redirect to a success page after successful signup (change 'home' to your desired URL)
             messages.success(request, "Account created successfully.")
@@ -181,20 +195,9 @@ def forgot_password(request):
             token = default_token_generator.make_token(user)
 
             # Send email for password reset
-            mail_subject = 'Reset Your Password'
-            message_html = render_to_string('expenses/password_reset_email.html', {
-                'user': user,
-                'domain': current_site.domain,
-                'uid': uid,
-                'token': token,
-            })
-            text_message = strip_tags(message_html)  # Extract plain text version from HTML content
-
-            # Create an EmailMultiAlternatives object
-            email_message = EmailMultiAlternatives(mail_subject, text_message, to=[email])
-            email_message.attach_alternative(message_html, "text/html")  # Attach HTML content
+            email_message = build_email('password_reset', user=user, domain=current_site.domain, uid=uid, token=token, to=[email])
 
-            email_message.send()
+            queue_message(email_message)
 
             messages.success(request, "An email has been sent with instructions to reset your password.")
             return redirect('login')
@@ -242,27 +245,58 @@ class CustomPasswordResetCompleteView(auth_views.PasswordResetCompleteView):
         context['dynamic_title'] = "Password Reset Completed"
         return context
 
+# Sort options for the home page event list
+HOME_SORT_FIELDS = ['-start_date', 'start_date', 'title', '-title', '-total_amount', 'total_amount', '-member_count', 'member_count']
+HOME_PAGE_SIZE = 25
+
 @login_required(login_url='login')
 def home(request):
     dynamic_title = "Home"
-    events = Event.objects.filter(user=request.user)
-    events_with_member_count = []
+    sort = request.GET.get('sort', '-start_date')
+    if sort not in HOME_SORT_FIELDS:
+        sort = '-start_date'
+
+    # The page of events is one query: the member count comes from a correlated
+    # subquery (no members x expenses join fan-out), the expense total and
+    # count from the running totals on the event row. The approval breakdown
+    # is a second query over the expenses of this page's events only.
+    member_count = Member.objects.filter(event=OuterRef('pk')).order_by().values('event').annotate(count=Count('id')).values('count')
+    events = Event.objects.filter(user=request.user).annotate(
+        member_count=Coalesce(Subquery(member_count), 0),
+    )
+
+    cursor = request.GET.get('cursor')
+    try:
+        page, next_cursor = keyset_page(events, sort, cursor, HOME_PAGE_SIZE)
+    except InvalidCursor:
+        # e.g. a cursor kept from another sort order: start again from the top
+        cursor = None
+        page, next_cursor = keyset_page(events, sort, None, HOME_PAGE_SIZE)
+    approvals = approval_summaries([event.id for event in page])
 
-    for event in events:
-        expenses = Expense.objects.filter(event=event)
-        total_expense_amount = expenses.aggregate(Sum('amount'))['amount__sum'] or 0
-        members = Member.objects.filter(event=event)
-        member_count = members.count()
+    events_with_member_count = []
+    for event in page:
         # Calculate the difference in days
         date_difference = (event.end_date - event.start_date).days + 1
+        approval = approvals[event.id]
         events_with_member_count.append({
             'event': event,
-            'member_count': member_count,
+            'member_count': event.member_count,
             'date_difference':date_difference,
-            'total_expense_amount': total_expense_amount
+            'total_expense_amount': event.total_amount,
+            'has_expenses': event.expense_count > 0,
+            'all_expenses_approved': approval['all_approved'],
+            'approval': approval,
         })
 
-    return render(request, 'expenses/home.html', {'events': events_with_member_count, 'dynamic_title': dynamic_title})
+    context = {
+        'events': events_with_member_count,
+        'dynamic_title': dynamic_title,
+        'sort': sort,
+        'next_cursor': next_cursor,
+        'is_first_page': not cursor,
+    }
+    return render(request, 'expenses/home.html', context)
 
 @login_required(login_url='login')
 def create_event(request):
@@ -273,6 +307,7 @@ def create_event(request):
             event = event_form.save(commit=False)
             event.user = request.user
             event.save()
+            bump_analytics_version(request.user.id)
 
             messages.success(request, 'Event created successfully!')
             return redirect('event_details', event_id=event.id)
@@ -310,7 +345,7 @@ def handle_member_form(request, event):
 
 @login_required(login_url='login')
 def handle_expense_form(request, event):
-    expense_form = ExpenseForm(request.POST, request.FILES)
+    expense_form = ExpenseForm(request.POST, request.FILES, event=event)
     error_message = None
     
     if request.method == 'POST':
@@ -322,8 +357,10 @@ def handle_expense_form(request, event):
             expense.event = event
             expense.payer = expense_form.cleaned_data['payer']
             contributors = expense_form.cleaned_data.get('contributors', [])
-            expense.save()
-            expense.contributors.set(contributors)
+            with transaction.atomic():
+                expense.save()
+                ExpenseShare.objects.bulk_create(share_rows(expense, contributors))
+                expense_changed(event, ledger_entries([]), ledger_entries([expense.id]))
             
             # Add success message
             messages.success(request, f'Expense "{expense.description} (Paid by: {expense.payer})" added successfully.')
@@ -350,9 +387,9 @@ def event_details(request, event_id):
             return redirect('event_details', event_id=event_id)
 
     members = Member.objects.filter(event=event)
-    expenses = Expense.objects.filter(event=event)
+    expenses = expense_listing(event)
     
-    total_expense_amount = expenses.aggregate(Sum('amount'))['amount__sum'] or 0
+    total_expense_amount = event.total_amount
 
     context = {
         'event': event,
@@ -367,6 +404,40 @@ def event_details(request, event_id):
     return render(request, 'expenses/event_details.html', context)
 
 
+@login_required(login_url='login')
+def import_event_expenses(request, event_id):
+    event = get_object_or_404(Event, pk=event_id, user=request.user)
+    dynamic_title = f"Import Expenses ({event.title})"
+    result = None
+
+    if request.method == 'POST':
+        form = ExpenseImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            try:
+                with transaction.atomic():
+                    result = import_expenses(event, form.cleaned_data['file'], request.user)
+                    if result.imported:
+                        expenses_changed(event)
+            except ImportFileError as error:
+                messages.error(request, str(error))
+            else:
+                if result.imported:
+                    messages.success(request, f'{result.imported} expense(s) imported successfully.')
+                if result.error_count:
+                    messages.warning(request, f'{result.error_count} row(s) could not be imported.')
+        else:
+            messages.error(request, 'Invalid form submission. Please check the entered data.')
+    else:
+        form = ExpenseImportForm()
+
+    context = {
+        'event': event,
+        'form': form,
+        'result': result,
+        'dynamic_title': dynamic_title,
+    }
+    return render(request, 'expenses/import_expenses.html', context)
+
 @login_required(login_url='login')
 def add_member(request, event_id):
     event = get_object_or_404(Event, id=event_id)
@@ -406,9 +477,9 @@ def members(request, event_id):
     event = get_object_or_404(Event, id=event_id, user=request.user)
     dynamic_title = f"Members ({event.title})"
     members = Member.objects.filter(event=event)
-    # Calculate total expenses paid by each member
+    # Total expenses paid by each member is kept up to date on the member row
     for member in members:
-        member.total_expenses_paid = Expense.objects.filter(event=event, payer=member).aggregate(Sum('amount'))['amount__sum'] or 0
+        member.total_expenses_paid = member.amount_paid
     context = {
         'event': event,
         'members': members,
@@ -442,7 +513,12 @@ def delete_member(request, event_id, member_id):
 
     if request.method == 'POST':
         # Delete the member
-        member.delete()
+        with transaction.atomic():
+            # Their shares go with them; the other contributors split those expenses again
+            expense_ids = list(member.expense_shares.values_list('expense_id', flat=True))
+            member.delete()
+            update_shares(expense_ids)
+            expenses_changed(event)
         messages.success(request, f'Member "{member.name}" deleted successfully.')
         return redirect('members', event_id=event.id)
 
@@ -461,15 +537,13 @@ def expense_detail(request, expense_id):
     event = expense.event
     dynamic_title = f"Expense Details ({expense.description})"
 
-    # Get the contributors and their contributions for the specific expense
-    contributors = expense.contributors.all()
-    # Calculate the total contribution amount
-    contributions_amount = expense.amount / contributors.count()
+    # Each contributor's stored share, in the event's base currency
+    shares = expense.shares.select_related('member').order_by('member_id')
 
     context = {
         'event': event,
         'expense': expense,
-        'contributions_amount': contributions_amount,
+        'shares': shares,
         'dynamic_title': dynamic_title
     }
 
@@ -484,9 +558,17 @@ def edit_expense(request, expense_id):
     if request.method == 'POST':
         form = ExpenseForm(request.POST, instance=expense, event=event)
         if form.is_valid():
-            form.save()
-            messages.success(request, f'Expense "{expense.description}" updated successfully.')
-            return redirect('expense_detail', expense_id=expense.id)
+            try:
+                with transaction.atomic():
+                    before = ledger_entries([expense.id])
+                    form.save()
+                    update_shares([expense.id])
+                    expense_changed(event, before, ledger_entries([expense.id]))
+            except SplitError as error:
+                messages.error(request, str(error))
+            else:
+                messages.success(request, f'Expense "{expense.description}" updated successfully.')
+                return redirect('expense_detail', expense_id=expense.id)
         else:
             messages.error(request, 'Invalid form submission. Please check the entered data.')
     else:
@@ -502,7 +584,19 @@ def edit_event(request, event_id):
     if request.method == 'POST':
         form = EventForm(request.POST, instance=event)
         if form.is_valid():
-            form.save()
+            if 'base_currency' in form.changed_data:
+                # Every stored base_amount is in the old currency
+                try:
+                    with transaction.atomic():
+                        form.save()
+                        reconvert_expenses(Expense.objects.filter(event=event))
+                        expenses_changed(event)
+                except ExchangeRateMissing as error:
+                    messages.error(request, str(error))
+                    return render(request, 'expenses/edit_event.html', {'form': form, 'event': event, 'dynamic_title': dynamic_title})
+            else:
+                form.save()
+            bump_analytics_version(event.user_id)
             messages.success(request, f'Event "{event.title}" updated successfully.')
             return redirect('event_details', event_id=event.id)
         else:
@@ -516,7 +610,10 @@ def edit_event(request, event_id):
 @login_required(login_url='login')
 def delete_expense(request, expense_id):
     expense = get_object_or_404(Expense, pk=expense_id, user=request.user)
-    expense.delete()
+    with transaction.atomic():
+        before = ledger_entries([expense.id])
+        expense.delete()
+        expense_changed(expense.event, before, ledger_entries([]))
     messages.success(request, f'Expense "{expense.description}" deleted successfully.')
     return redirect('expense_audit_trail', event_id=expense.event_id)
 
@@ -531,14 +628,12 @@ def generate_report(request, event_id):
     #     return redirect('home')
     date_difference = (event.end_date - event.start_date).days + 1
     
-    # Get all members associated with the event
-    members = Member.objects.filter(event=event)
-    
-    # Get all expenses associated with the event
-    expenses = Expense.objects.filter(event=event)
+    # Load members, expenses and contributors once and compute every figure in memory
+    balances = EventBalances(event)
+    members = balances.members
     
     # Get the total sum of amount for all expenses in the event
-    total_expense_amount = expenses.aggregate(Sum('amount'))['amount__sum'] or 0
+    total_expense_amount = balances.total
     
     # Default values for the form
     selected_user_id = None
@@ -548,106 +643,24 @@ def generate_report(request, event_id):
     selected_user_expenses = None
     other_user_expenses = None
     expense_count = None
-    # Initialize the variable here
-    balance = 0
-    total_expenses_paid = 0
-    total_contribution = 0
-    total_expenses_paid_by_user = 0
     
     if request.method == 'POST':
         # Form is submitted, retrieve the selected member ID
         selected_user_id = request.POST.get('user_select')
 
-        # Retrieve the user object based on the selected ID
-        selected_user = get_object_or_404(Member, id=selected_user_id)
+        # Retrieve the member from the ones already loaded for this event
+        selected_user = next((member for member in members if str(member.id) == str(selected_user_id)), None)
+        if selected_user is None:
+            raise Http404("No Member matches the given query.")
         dynamic_title = f"Financial Report ({selected_user})"
 
-        # Get all contributors (excluding the selected user)
-        contributors = Member.objects.filter(event=event).exclude(id=selected_user_id)
-        
-        # all_contributors = Member.objects.filter(event=event)
-        # contributors_count = all_contributors.count()
-        
-        # Filter expenses where the selected user is the payer
-        selected_user_expenses = Expense.objects.filter(event=event, payer=selected_user)
-        
-        # Calculate expenses count for the selected user
-        expense_count = selected_user_expenses.count()
-        
-        # Calculate contribution amount for each expense
-        for expense in selected_user_expenses:
-            expense.contribution_amount = expense.amount / expense.contributors.count() if expense.contributors.count() > 0 else 0
-            
-        # Filter expenses where the other user is the payer
-        other_user_expenses = Expense.objects.filter(event=event).exclude(payer=selected_user)
-        
-        # Calculate contribution amount for each expense
-        for expense in other_user_expenses:
-            expense.contribution_amount = expense.amount / expense.contributors.count() if expense.contributors.count() > 0 else 0
-            
-
-        # Calculate expenses paid, transactions received, and total balance for each contributor
-        for contributor in contributors:
-            # Get all expenses where the selected user is the payer
-            expenses_paid_by_user = Expense.objects.filter(event=event, payer=selected_user, contributors=contributor)
-            total_expenses_paid_by_user = expenses_paid_by_user.aggregate(Sum('amount'))['amount__sum'] or 0
-
-            # Get all expenses where the contributor is the payer
-            expenses_paid_to_contributor = Expense.objects.filter(event=event, payer=contributor, contributors=selected_user)
-            total_expenses_paid_to_contributor = expenses_paid_to_contributor.aggregate(Sum('amount'))['amount__sum'] or 0
-
-            # Calculate total contribution amount for the selected user
-            total_contribution = total_expenses_paid_by_user
-
-            # Calculate total expenses paid by the selected user
-            total_expenses_paid = total_expenses_paid_by_user + total_expenses_paid_to_contributor
-
-            # Calculate total balance for the contributor
-            balance = total_expenses_paid_by_user - total_expenses_paid_to_contributor
-            
-            # Calculate expenses paid by the contributor
-            contributor.expenses_paid = Expense.objects.filter(event=event, payer=contributor).aggregate(Sum('amount'))['amount__sum'] or 0
-            
-            # Calculate expenses count for the selected user
-            expense_count = expenses_paid_by_user.count()
-
-            # Add expense_count to the contributor dictionary
-            contributor.expense_count = expense_count
-            
-            contributors_count = expense.contributors.count()
-
-            # Calculate pay_to and get_from amounts for the contributor
-            contributor.pay_to = max(0, -balance) / contributors_count # The amount the contributor needs to pay to others
-            contributor.get_from = max(0, balance) / contributors_count # The amount the contributor can get from others
-            
-            # Calculate the percentage based on the total expense amount and the user's contribution
-            # Calculate percentage_spent only if total_expense_amount is greater than zero
-            percentage_spent = 0
-            if total_expense_amount > 0:
-                percentage_spent = (contributor.expenses_paid / total_expense_amount) * 100
-
-            # Add the percentage_spent to the contributor object
-            contributor.percentage_spent = percentage_spent
-            
-        # Default value for selected_user_percentage_spent
-        selected_user_percentage_spent = 0
-
-        # Calculate the percentage spent by the selected user
-        if total_expense_amount > 0:
-            selected_user_percentage_spent = (total_expenses_paid_by_user / total_expense_amount) * 100
-
-        # Add the selected_user_percentage_spent to the selected_user object
-        selected_user.percentage_spent = selected_user_percentage_spent
-
-        # Create a dictionary with report details
-        user_report = {
-            'user_name': selected_user.name,
-            'total_contribution': total_contribution,
-            'total_expenses_paid': total_expenses_paid,
-            'balance': balance,
-            'expense_count': expense_count,
-            'expenses_added': total_expenses_paid_by_user > 0,
-        }
+        # Contributors, pay to/get from and weightage against every other member
+        report = member_report(balances, selected_user)
+        contributors = report['contributors']
+        selected_user_expenses = report['selected_user_expenses']
+        other_user_expenses = report['other_user_expenses']
+        expense_count = report['expense_count']
+        user_report = report['user_report']
 
     context = {
         'event': event,
@@ -666,12 +679,52 @@ def generate_report(request, event_id):
     
     return render(request, 'expenses/report.html', context)
 
+@require_POST
+@login_required(login_url='login')
+def request_report_pdf(request, event_id, member_id):
+    event = get_object_or_404(Event, id=event_id, user=request.user)
+    member = get_object_or_404(Member, id=member_id, event=event)
+
+    # Queue the rendering; the browser polls report_job_status until it is done
+    job = submit_report_job(event, member, request.user)
+    return JsonResponse(report_job_data(job), status=202)
+
+def report_job_data(job):
+    data = {
+        'id': job.id,
+        'status': job.status,
+        'status_url': reverse('report_job_status', args=[job.id]),
+    }
+    if job.status == 'Done':
+        data['download_url'] = reverse('download_report', args=[job.id])
+    elif job.status == 'Failed':
+        data['error'] = job.error
+    return data
+
+@login_required(login_url='login')
+def report_job_status(request, job_id):
+    job = get_object_or_404(ReportJob, id=job_id, user=request.user)
+    return JsonResponse(report_job_data(job))
+
+@login_required(login_url='login')
+def download_report(request, job_id):
+    job = get_object_or_404(ReportJob.objects.select_related('event', 'member'), id=job_id, user=request.user, status='Done')
+
+    # Served straight from the PDF cache
+    try:
+        report_file = open(job.file_path, 'rb')
+    except OSError:
+        raise Http404("This report is no longer available. Please generate it again.")
+    filename = f"{job.event.title} - {job.member.name}.pdf"
+    return FileResponse(report_file, as_attachment=True, filename=filename, content_type='application/pdf')
+
+@login_required(login_url='login')
 def settlement(request, event_id):
     dynamic_title = "Settlement"
     event = get_object_or_404(Event, id=event_id, user=request.user)
-    members = Member.objects.filter(event=event).count()
-    expenses = Expense.objects.filter(event=event)
-    total_expense_amount = expenses.aggregate(Sum('amount'))['amount__sum'] or 0
+    balances = EventBalances(event)
+    members = len(balances.members)
+    total_expense_amount = event.total_amount
     
     each = 0
     member_percentile = 0
@@ -679,60 +732,60 @@ def settlement(request, event_id):
         each = total_expense_amount / members
         member_percentile = (each / total_expense_amount) * 100
     
-    member_expenses = Expense.objects.filter(event=event)
-    for expense in member_expenses:
-        expense.contribution_amount = expense.amount / members if expense.contributors.count() > 0 else 0
+    # Each expense already carries its per-contributor share from the balance engine
+    member_expenses = balances.expenses
+
+    # Who pays whom, read from the stored plan
+    transfers = settlement_plan(event)
     
     context = {
         'event': event,
+        'approval': approval_summary(event),
         'dynamic_title': dynamic_title,
         'members': members,
         'each': each,
         'member_expenses': member_expenses,
+        'transfers': transfers,
         'member_percentile': member_percentile,
         'total_expense_amount': total_expense_amount,
     }
     
     return render(request, 'expenses/settlement.html', context)
 
-@login_required(login_url='login')
-def category_distribution_view(request, event_id):
-    event = get_object_or_404(Event, id=event_id)
-    category_distribution = Expense.objects.filter(event=event).values('category').annotate(total_amount=Sum('amount'))
-
-    total_expense_amount = Expense.objects.filter(event=event).aggregate(Sum('amount'))['amount__sum'] or 1
-    category_distribution = category_distribution.annotate(percentile=ExpressionWrapper(F('total_amount') * 100.0 / total_expense_amount, output_field=fields.FloatField()))
-
-    data = {
-        'labels': [f"{item['category']} ({item['percentile']:.2f}%) - ₹{item['total_amount']:.2f}" for item in category_distribution],
-        'data': [item['total_amount'] for item in category_distribution],
-        'percentiles': [item['percentile'] for item in category_distribution],
+# Chart data for report.html. The async ORM runs every query on the same
+# thread, so each view awaits its queries in turn; the total is the sum of
+# the category rows rather than a second scan of the expenses.
+
+def category_chart_data(rows, currency_symbol):
+    total = sum(row['total_amount'] for row in rows) or 1
+    percentiles = [float(row['total_amount'] * 100 / total) for row in rows]
+    return {
+        'labels': [f"{row['category']} ({percentile:.2f}%) - {currency_symbol}{row['total_amount']:.2f}" for row, percentile in zip(rows, percentiles)],
+        'data': [row['total_amount'] for row in rows],
+        'percentiles': percentiles,
     }
 
-    return JsonResponse(data)
+async def category_totals(expenses):
+    return [row async for row in expenses.order_by('category').values('category').annotate(total_amount=Sum('base_amount'))]
 
-@login_required(login_url='login')
-def selected_user_expense_view(request, event_id, user_id):
-    event = get_object_or_404(Event, id=event_id)
-    selected_user = get_object_or_404(Member, id=user_id)
-
-    selected_user_expenses = Expense.objects.filter(event=event, payer=selected_user).values('category').annotate(total_amount=Sum('amount'))
-    total_user_expense_amount = selected_user_expenses.aggregate(Sum('total_amount'))['total_amount__sum'] or 1
-    selected_user_expenses = selected_user_expenses.annotate(percentile=ExpressionWrapper(F('total_amount') * 100.0 / total_user_expense_amount, output_field=fields.FloatField()))
+@alogin_required(login_url='login')
+async def category_distribution_view(request, event_id):
+    event = await aget_object_or_404(Event, id=event_id, user=request.user)
+    rows = await category_totals(Expense.objects.filter(event=event))
+    return JsonResponse(category_chart_data(rows, event.currency_symbol))
 
-    data = {
-        'labels': [f"{item['category']} ({item['percentile']:.2f}%) - ₹{item['total_amount']:.2f}" for item in selected_user_expenses],
-        'data': [item['total_amount'] for item in selected_user_expenses],
-        'percentiles': [item['percentile'] for item in selected_user_expenses],
-    }
-
-    return JsonResponse(data)
+@alogin_required(login_url='login')
+async def selected_user_expense_view(request, event_id, user_id):
+    event = await aget_object_or_404(Event, id=event_id, user=request.user)
+    member = await aget_object_or_404(Member, id=user_id, event=event)
+    rows = await category_totals(Expense.objects.filter(event=event, payer=member))
+    return JsonResponse(category_chart_data(rows, event.currency_symbol))
 
 @login_required(login_url='login')
 def expense_audit_trail(request, event_id):
     event = get_object_or_404(Event, pk=event_id, user=request.user)
     dynamic_title = f"Audit Trail ({event.title})"
-    expenses = Expense.objects.filter(event_id=event_id, user=request.user)
+    expenses = expense_listing(event, user=request.user).prefetch_related('shares')
     
     # Create a list to store detailed information for each expense
     expense_details_list = []
@@ -741,15 +794,12 @@ def expense_audit_trail(request, event_id):
         # Get the payer (user who paid the expense)
         payer = expense.payer
 
-        # Get the contributors and their contributions for the specific expense
+        # Stored shares of the contributors, read from the prefetched through rows
+        shares = {share.member_id: share.share for share in expense.shares.all()}
         contributors = expense.contributors.all()
 
-        # Calculate the total contribution amount
-        if contributors.count() > 0:
-            total_contribution = expense.amount / contributors.count()
-        else:
-            total_contribution = 0  # Or handle this case according to your application logic
-
+        # What the other contributors owe the payer for this expense
+        total_contribution = sum((share for member_id, share in shares.items() if member_id != payer.id), Decimal('0'))
 
         # Create a list to store detailed information for each contributor
         contributor_details = []
@@ -757,8 +807,8 @@ def expense_audit_trail(request, event_id):
         # Add details for the payer
         payer_detail = {
             'name': payer.name,
-            'contribution': total_contribution,
-            'paid_amount': expense.amount,
+            'contribution': shares.get(payer.id, Decimal('0')),
+            'paid_amount': expense.base_amount,
         }
         contributor_details.append(payer_detail)
 
@@ -767,7 +817,7 @@ def expense_audit_trail(request, event_id):
             if contributor != payer:  # Skip the payer in contributor details
                 contributor_detail = {
                     'name': contributor.name,
-                    'contribution': total_contribution,
+                    'contribution': shares.get(contributor.id, Decimal('0')),
                 }
                 contributor_details.append(contributor_detail)
 
@@ -785,227 +835,176 @@ def expense_audit_trail(request, event_id):
         'expense_details_list': expense_details_list,
         'dynamic_title': dynamic_title,
         'event': event,
+        'approval': approval_summary(event),
     }
 
     return render(request, 'expenses/expense_audit_trail.html', context)
 
-# def analytics(request):
-#     event = Event.objects.filter(user=request.user)
-#     dynamic_title = f"Analytics"
+@require_POST
+@login_required(login_url='login')
+def bulk_update_approval(request, event_id):
+    event = get_object_or_404(Event, pk=event_id, user=request.user)
+    status = request.POST.get('approval_status')
+    expense_ids = [expense_id for expense_id in request.POST.getlist('expense_ids') if expense_id.isdigit()]
+    if not expense_ids:
+        messages.error(request, 'Select at least one expense.')
+        return redirect('expense_audit_trail', event_id=event.id)
+
+    # One UPDATE for all the selected expenses; approval status doesn't touch
+    # the ledger or the settlement plan
+    try:
+        updated, approval = set_approval_status(event, expense_ids, status)
+    except ValueError as error:
+        messages.error(request, str(error))
+        return redirect('expense_audit_trail', event_id=event.id)
+    messages.success(request, f"{updated} expense(s) marked {status.lower()}. {approval['pending']['count']} pending, {approval['approved']['count']} approved, {approval['rejected']['count']} rejected.")
+    return redirect('expense_audit_trail', event_id=event.id)
 
-#     # Get the count of events created per year
-#     events_by_year = event.annotate(year=ExtractYear('start_date')).values('year').annotate(count=Count('id'))
+@login_required(login_url='login')
+def export_expenses(request, event_id, export_format):
+    event = get_object_or_404(Event, pk=event_id, user=request.user)
+    rows = expense_rows(event, user=request.user)
 
-#     # Get the count of expenses paid for each event per month
-#     expenses_by_month = Expense.objects.filter(event__in=event).annotate(
-#         year=ExtractYear('event__start_date'),
-#         month=ExtractMonth('event__start_date')
-#     ).values('year', 'month').annotate(count=Count('id'))
+    # Streamed straight from the database cursor, so large events never build the whole file in memory
+    if export_format == 'csv':
+        response = StreamingHttpResponse(csv_stream(rows), content_type='text/csv')
+    elif export_format == 'ndjson':
+        response = StreamingHttpResponse(ndjson_stream(rows), content_type='application/x-ndjson')
+    else:
+        raise Http404("Unsupported export format")
 
-#     # Convert queryset to list for serialization
-#     events_by_year_list = list(events_by_year)
-#     expenses_by_month_list = list(expenses_by_month)
-    
-#     context = {
-#         'events_by_year': events_by_year_list,
-#         'expenses_by_month': expenses_by_month_list,
-#         'dynamic_title': dynamic_title,
-#     }
-#     return render(request, 'expenses/analytics.html', context)
+    response['Content-Disposition'] = f'attachment; filename="event-{event.id}-expenses.{export_format}"'
+    return response
 
-def analytics(request):
-    user = request.user
-    events = Event.objects.filter(user=user)
-    expenses = Expense.objects.filter(event__in=events)
-    
-    # Total number of events
-    total_events = events.count()
+@login_required(login_url='login')
+def api_event_expenses(request, event_id):
+    event = get_object_or_404(Event, pk=event_id, user=request.user)
 
-    # Total events expenditure
-    total_event_expenditure = events.aggregate(total_expenditure=Sum('expense__amount'))['total_expenditure'] or 0
+    # One keyset page of the event's expenses; pass next_cursor back as ?cursor= for the next one
+    try:
+        results, next_cursor = expense_page(event, request.GET)
+    except ApiError as error:
+        return JsonResponse({'error': str(error)}, status=400)
 
-    # Total expenses count
-    total_expenses_count = expenses.count()
+    next_url = None
+    if next_cursor:
+        params = request.GET.copy()
+        params['cursor'] = next_cursor
+        next_url = f"{request.path}?{params.urlencode()}"
 
-    # Get the count of events created per year
-    events_by_year = events.annotate(year=ExtractYear('start_date')).values('year').annotate(count=Count('id'))
+    return JsonResponse({'results': results, 'next_cursor': next_cursor, 'next': next_url})
 
-    # Get the count of expenses paid for each event per month
-    expenses_by_month = expenses.annotate(
-        year=ExtractYear('event__start_date'),
-        month=ExtractMonth('event__start_date')
-    ).values('year', 'month').annotate(count=Count('id'))
+@login_required(login_url='login')
+def search(request):
+    query = request.GET.get('q', '').strip()
+    event = None
+    if request.GET.get('event', '').isdigit():
+        event = get_object_or_404(Event, pk=request.GET['event'], user=request.user)
+    # Digit strings only, clamped so an absurd page number can't overflow the query
+    page = int(request.GET['page']) if request.GET.get('page', '').isdigit() else 1
+    page = min(max(page, 1), SEARCH_MAX_PAGE)
+
+    # Ranked hits from the full-text index, one page at a time
+    expenses, has_next = search_expenses(request.user, query, event=event, page=page)
 
     context = {
-        'total_events': total_events,
-        'total_event_expenditure': total_event_expenditure,
-        'total_expenses_count': total_expenses_count,
-        'events_by_year': events_by_year,
-        'expenses_by_month': expenses_by_month,
-        'dynamic_title': "Analytics",
+        'query': query,
+        'event': event,
+        'expenses': expenses,
+        'page': page,
+        'has_next': has_next,
+        'dynamic_title': f"Search ({query})" if query else "Search",
     }
-    return render(request, 'expenses/analytics.html', context)
+    return render(request, 'expenses/search.html', context)
 
-def expense_and_event_by_month_and_day(request):
-    # Fetch events created by month and day date
-    events_by_month_and_day = Event.objects.filter(user=request.user).annotate(
-        year=ExtractYear('start_date'),  # Add year annotation
-        month=ExtractMonth('start_date'),
-        day=ExtractDay('start_date')
-    ).values('year', 'month', 'day').annotate(event_count=Count('id')).order_by('year', 'month', 'day')
-
-    # Fetch expenses by month and day date within the event start and end dates
-    expenses_by_month_and_day = Expense.objects.filter(
-        event__user=request.user,
-        event__start_date__lte=F('date'),  # Expense date should be after or equal to event start date
-        event__end_date__gte=F('date')     # Expense date should be before or equal to event end date
-    ).annotate(
-        year=ExtractYear('date'),  # Add year annotation
-        month=ExtractMonth('date'),
-        day=ExtractDay('date')
-    ).values('year', 'month', 'day').annotate(expense_count=Count('id')).order_by('year', 'month', 'day')
-
-    # Combine the data for expenses and events into a single dictionary
-    data = {
-        'events': list(events_by_month_and_day),
-        'expenses': list(expenses_by_month_and_day)
+@login_required(login_url='login')
+def analytics(request):
+    # Every figure on the page comes from the user's cached analytics rollup
+    rollup = get_rollup(request.user)
+
+    context = {
+        'currency_symbol': CURRENCY_SYMBOLS.get(rollup['currency'], rollup['currency']),
+        'unconverted': [
+            {'currency': currency, 'symbol': CURRENCY_SYMBOLS.get(currency, currency), 'amount': amount}
+            for currency, amount in rollup['unconverted'].items()
+        ],
+        'total_events': rollup['total_events'],
+        'total_event_expenditure': rollup['total_event_expenditure'] or 0,
+        'total_expenses_count': rollup['total_expenses_count'],
+        'events_by_year': rollup['events_by_year'],
+        'expenses_by_month': rollup['expenses_by_month'],
+        'dynamic_title': "Analytics",
     }
+    return render(request, 'expenses/analytics.html', context)
 
+@login_required(login_url='login')
+@condition(etag_func=bundle_etag)
+def analytics_bundle(request):
+    # All analytics chart series in one compact response; unchanged data costs a 304
+    return JsonResponse(get_bundle(request.user), json_dumps_params={'separators': (',', ':')})
+
+# The endpoints below are kept for existing clients and are thin async views
+# over the bundle: a cached bundle is served without leaving the event loop
+
+@alogin_required(login_url='login')
+async def expense_and_event_by_month_and_day(request):
+    # Events by start date, and expenses dated within their event's start and end dates
+    data = (await aget_bundle(request.user))['expense_and_event_by_month_and_day']
     return JsonResponse(data, safe=False)
 
 
-def analytics_data_by_month(request):
-    user_events = Event.objects.filter(user=request.user)
-
-    # Get the count of events created per year
-    events_by_year = user_events.annotate(year=ExtractYear('start_date')).values('year').annotate(count=Count('id'))
-
-    # Get the count of expenses paid for each event per month
-    expenses_by_month = Expense.objects.filter(event__in=user_events).annotate(
-        year=ExtractYear('event__start_date'),
-        month=ExtractMonth('event__start_date')
-    ).values('year', 'month').annotate(count=Count('id'))
-
-    # Manually create month names and corresponding expense counts for the line chart
-    line_chart_labels = []
-    line_chart_data = []
-
-    month_names = [
-        'January', 'February', 'March', 'April', 'May', 'June',
-        'July', 'August', 'September', 'October', 'November', 'December'
-    ]
+@alogin_required(login_url='login')
+async def analytics_data_by_month(request):
+    bundle = await aget_bundle(request.user)
 
-    for entry in expenses_by_month:
-        month_name = month_names[entry['month'] - 1]  # Adjust month index
-        line_chart_labels.append(f"{entry['year']}-{month_name}")
-        line_chart_data.append(entry['count'])
-
-    # Convert the queryset data to a dictionary
     data = {
-        'events_by_year': list(events_by_year),
-        'expenses_by_month': list(expenses_by_month),
-        'line_chart_data': {
-            'labels': line_chart_labels,
-            'data': line_chart_data,
-        },
+        'events_by_year': bundle['events_by_year'],
+        'expenses_by_month': bundle['expenses_by_month'],
+        'line_chart_data': bundle['line_chart_data'],
     }
 
     return JsonResponse(data, safe=False)
 
-def analytics_data_by_year(request):
-    user_events = Event.objects.filter(user=request.user)
-
-    # Get the count of events created per year
-    events_by_year = user_events.annotate(year=ExtractYear('start_date')).values('year').annotate(count=Count('id'))
+@alogin_required(login_url='login')
+async def analytics_data_by_year(request):
+    bundle = await aget_bundle(request.user)
 
-    # Convert the queryset data to a dictionary
     data = {
-        'events_by_year': list(events_by_year),
-        'bar_chart_data': {
-            'labels': [entry['year'] for entry in events_by_year],
-            'data': [entry['count'] for entry in events_by_year],
-        }
+        'events_by_year': bundle['events_by_year'],
+        'bar_chart_data': bundle['bar_chart_events_by_year'],
     }
 
     return JsonResponse(data, safe=False)
 
 
-def analytics_data(request):
-    user_events = Event.objects.filter(user=request.user)
-
-    # Get the count of events created per year
-    events_by_year = user_events.annotate(year=ExtractYear('start_date')).values('year').annotate(count=Count('id'))
-
-    # Get the count of expenses paid for each event per month
-    expenses_by_month = Expense.objects.filter(event__in=user_events).annotate(
-        year=ExtractYear('event__start_date'),
-        month=ExtractMonth('event__start_date')
-    ).values('year', 'month').annotate(count=Count('id'))
-
-    # Calculate the total expense for each event per year
-    event_expenditure_by_year = user_events.annotate(
-        year=ExtractYear('start_date')
-    ).values('year').annotate(
-        total_expenditure=Sum('expense__amount')
-    )
-
-    # Manually create month names and corresponding expense counts for the line chart
-    line_chart_labels = []
-    line_chart_data = []
-
-    month_names = [
-        'January', 'February', 'March', 'April', 'May', 'June',
-        'July', 'August', 'September', 'October', 'November', 'December'
-    ]
+@alogin_required(login_url='login')
+async def analytics_data(request):
+    bundle = await aget_bundle(request.user)
 
-    for entry in expenses_by_month:
-        month_name = month_names[entry['month'] - 1]  # Adjust month index
-        line_chart_labels.append(f"{entry['year']}-{month_name}")
-        line_chart_data.append(entry['count'])
-
-    # Convert the queryset data to a dictionary
     data = {
-        'events_by_year': list(events_by_year),
-        'bar_chart_events_by_year': {
-            'labels': [entry['year'] for entry in events_by_year],
-            'data': [entry['count'] for entry in events_by_year],
-        },
-        'line_chart_expenses_by_month': {
-            'labels': [entry['year'] for entry in expenses_by_month],
-            'data': [entry['count'] or 0 for entry in expenses_by_month],
-        },
-        'event_expenditure_data': {
-            'labels': [entry['year'] for entry in event_expenditure_by_year],
-            'data': [entry['total_expenditure'] or 0 for entry in event_expenditure_by_year],
-        }
+        'events_by_year': bundle['events_by_year'],
+        'bar_chart_events_by_year': bundle['bar_chart_events_by_year'],
+        'line_chart_expenses_by_month': bundle['line_chart_expenses_by_month'],
+        'event_expenditure_data': bundle['event_expenditure_data'],
     }
 
     return JsonResponse(data, safe=False)
 
 
-def calculate_expense_by_category(user):
-    expenses_by_category = Expense.objects.filter(user=user).values('category').annotate(total_amount=Sum('amount'))
-    return {entry['category']: entry['total_amount'] for entry in expenses_by_category}
-
-def expense_by_category(request):
+@alogin_required(login_url='login')
+async def expense_by_category(request):
     if request.method == 'GET':
-        user = request.user
-        expenses_by_category = calculate_expense_by_category(user)
-        return JsonResponse(expenses_by_category)
+        return JsonResponse((await aget_bundle(request.user))['expense_by_category'])
     
-def percentage_by_category(request):
+@alogin_required(login_url='login')
+async def percentage_by_category(request):
     if request.method == 'GET':
-        user = request.user
-        expenses_by_category = Expense.objects.filter(user=user).values('category').annotate(total_amount=Sum('amount'))
-        
-        total_expenses = sum(entry['total_amount'] for entry in expenses_by_category)
-        
-        if total_expenses != 0:
-            percentages = {entry['category']: round((entry['total_amount'] / total_expenses) * 100, 2) for entry in expenses_by_category}
-        else:
-            percentages = {}
-    
-        return JsonResponse(percentages)
+        return JsonResponse((await aget_bundle(request.user))['percentage_by_category'])
+
+@staff_member_required(login_url='login')
+def performance_stats(request):
+    # Rolling per-view latency/query figures recorded by PerformanceMiddleware
+    return JsonResponse(timing_summary())
 
 def error_404_view(request, exception):
     dynamic_title = "Page Not Found"